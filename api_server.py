@@ -0,0 +1,410 @@
+import os
+import json
+import asyncio
+import argparse
+import threading
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from aiohttp import web
+from dialogue_system import (
+    create_dialogue_stages, agenerate_travel_plan, acompare_travel_plans, arefine_travel_plan,
+    stream_travel_plan, stream_refined_travel_plan, create_refinement_history, add_refinement_round,
+    COMPARISON_MODELS
+)
+from llm_providers import get_provider, check_providers_health, close_providers
+from llm_setup import request_flights, first_token_latency, circuit_breakers, model_router
+from metrics import registry
+
+# Address the API listens on
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+API_PORT = int(os.getenv("API_PORT", "8080"))
+
+# Generations served at once, and requests allowed to wait for one before getting a 503
+API_WORKERS = int(os.getenv("API_WORKERS", "16"))
+API_QUEUE_SIZE = int(os.getenv("API_QUEUE_SIZE", "64"))
+
+# Seconds a rejected client is told to wait before retrying
+API_RETRY_AFTER = int(os.getenv("API_RETRY_AFTER", "5"))
+
+class WorkerPool:
+    """
+    Bounded pool of generation slots with a bounded wait queue.
+
+    Requests take a slot for as long as their generation runs, including
+    the whole of a streamed response. Once every slot is busy and the
+    queue is full, new requests are turned away instead of piling up.
+    """
+
+    def __init__(self, workers, max_queue):
+        """
+        Args:
+            workers (int): Generations served at once
+            max_queue (int): Requests allowed to wait for a free slot
+        """
+        self.workers = workers
+        self.max_queue = max_queue
+        self.active = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(workers)
+
+    def full(self):
+        """
+        Check whether a new request would have to be turned away.
+
+        Returns:
+            bool: True when every slot is busy and the queue is full
+        """
+        return self.active + self.waiting >= self.workers + self.max_queue
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold a generation slot, waiting in the queue for one if needed.
+        """
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        """
+        Report the pool's current load.
+
+        Returns:
+            dict: Slots, busy slots and queue depth
+        """
+        return {"workers": self.workers, "active": self.active, "queue_depth": self.waiting,
+                "max_queue": self.max_queue}
+
+def json_error(status, message, headers=None, **extra):
+    """
+    Build a JSON error response.
+
+    Args:
+        status (int): HTTP status code
+        message (str): Error message
+        headers (dict): Optional response headers
+        **extra: Additional fields for the body
+
+    Returns:
+        web.Response: The response
+    """
+    return web.json_response({"error": message, **extra}, status=status, headers=headers)
+
+async def read_json(request):
+    # Returns the request body as a dict, or None if it isn't a JSON object
+    try:
+        body = await request.json()
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return None
+    return body if isinstance(body, dict) else None
+
+def validate_user_responses(user_responses):
+    """
+    Check a request's answers the way the dialogue would.
+
+    Args:
+        user_responses (dict): Answers keyed by dialogue stage name
+
+    Returns:
+        str: Problem with the answers, or None if they can be planned from
+    """
+    if not isinstance(user_responses, dict):
+        return "user_responses must be an object"
+    missing = [stage["name"] for stage in create_dialogue_stages()
+               if stage["required"] and not str(user_responses.get(stage["name"], "")).strip()]
+    if missing:
+        return f"Missing required fields: {', '.join(missing)}"
+    return None
+
+async def iterate_in_thread(executor, streams):
+    """
+    Drain blocking plan generators on worker threads without blocking the event loop.
+
+    Args:
+        executor (ThreadPoolExecutor): Threads the generators run on
+        streams (dict): Generators of plan pieces, keyed by label
+
+    Yields:
+        tuple: (label, chunk) pairs as the pieces arrive
+    """
+    loop = asyncio.get_running_loop()
+    updates = asyncio.Queue()
+    stopped = threading.Event()
+
+    def pump(label, chunks):
+        try:
+            for chunk in chunks:
+                # Stop generating once the client has gone away
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(updates.put_nowait, (label, chunk))
+        except Exception as e:
+            loop.call_soon_threadsafe(updates.put_nowait, (label, f"Error: {str(e)}"))
+        finally:
+            chunks.close()
+            loop.call_soon_threadsafe(updates.put_nowait, (label, None))
+
+    for label, chunks in streams.items():
+        executor.submit(pump, label, chunks)
+
+    remaining = len(streams)
+    try:
+        while remaining:
+            label, chunk = await updates.get()
+            if chunk is None:
+                remaining -= 1
+                continue
+            yield label, chunk
+    finally:
+        stopped.set()
+
+async def send_event(response, event, data):
+    # Writes one server-sent event
+    await response.write(f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+async def stream_plans(request, streams, finish=None):
+    """
+    Stream plan generation to the client as server-sent events.
+
+    Each piece is sent as a "chunk" event with the label it belongs to. The
+    stream ends with a "done" event holding the full plans, or an "error"
+    event if every one of them failed.
+
+    Args:
+        request (web.Request): The HTTP request
+        streams (dict): Generators of plan pieces, keyed by label
+        finish (coroutine function): Optional callback given the full plans,
+            returning extra fields for the "done" event
+
+    Returns:
+        web.StreamResponse: The streamed response
+    """
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    pieces = {label: [] for label in streams}
+    events = iterate_in_thread(request.app["executor"], streams)
+    try:
+        async for label, chunk in events:
+            pieces[label].append(chunk)
+            await send_event(response, "chunk", {"label": label, "text": chunk})
+    finally:
+        # Stops the generators right away if the client disconnected
+        await events.aclose()
+
+    plans = {label: "".join(chunks) for label, chunks in pieces.items()}
+    errors = {label: plan for label, plan in plans.items() if plan.startswith("Error")}
+    if len(errors) == len(plans):
+        await send_event(response, "error", {"errors": errors})
+    else:
+        extra = await finish(plans) if finish else {}
+        await send_event(response, "done", {"plans": plans, **extra})
+    await response.write_eof()
+    return response
+
+def generation_endpoint(handler):
+    """
+    Wrap an endpoint with body parsing and the worker pool's backpressure.
+
+    Args:
+        handler (coroutine function): Called with (request, body) while a slot is held
+
+    Returns:
+        coroutine function: The aiohttp handler
+    """
+    async def endpoint(request):
+        pool = request.app["pool"]
+        if pool.full():
+            return json_error(503, "Server is at capacity, try again later",
+                              headers={"Retry-After": str(API_RETRY_AFTER)}, **pool.stats())
+        body = await read_json(request)
+        if body is None:
+            return json_error(400, "Request body must be a JSON object")
+        async with pool.slot():
+            return await handler(request, body)
+    return endpoint
+
+async def handle_generate(request, body):
+    """
+    POST /v1/plans: generate a travel plan.
+
+    Body: {"user_responses": {...}, "model": "openai", "stream": false}
+    """
+    user_responses = body.get("user_responses")
+    model = body.get("model", "openai")
+    problem = validate_user_responses(user_responses)
+    if problem:
+        return json_error(400, problem)
+    if get_provider(model) is None:
+        return json_error(400, f"Unknown model: {model}")
+
+    if body.get("stream"):
+        return await stream_plans(request, {model: stream_travel_plan(user_responses, model)})
+    plan = await agenerate_travel_plan(user_responses, model)
+    if plan.startswith("Error"):
+        return json_error(502, plan)
+    return web.json_response({"model": model, "plan": plan})
+
+async def handle_compare(request, body):
+    """
+    POST /v1/compare: generate plans from every comparison model.
+
+    Body: {"user_responses": {...}, "stream": false}
+    """
+    user_responses = body.get("user_responses")
+    problem = validate_user_responses(user_responses)
+    if problem:
+        return json_error(400, problem)
+
+    if body.get("stream"):
+        return await stream_plans(request, {
+            label: stream_travel_plan(user_responses, model, hedge=False)
+            for label, model in COMPARISON_MODELS.items()
+        })
+    plans = await acompare_travel_plans(user_responses)
+    if all(plan.startswith("Error") for plan in plans.values()):
+        return json_error(502, "Every model failed", plans=plans)
+    return web.json_response({"plans": plans})
+
+async def handle_refine(request, body):
+    """
+    POST /v1/refine: refine a plan.
+
+    The server keeps no state: the client sends the plan and the refinement
+    history it got back last time, and receives the updated history.
+
+    Body: {"plan": "...", "request": "...", "model": "openai", "history": {...}, "stream": false}
+    """
+    plan = body.get("plan")
+    refinement_request = body.get("request")
+    model = body.get("model", "openai")
+    history = body.get("history") or create_refinement_history()
+    if not isinstance(plan, str) or not plan.strip():
+        return json_error(400, "plan is required")
+    if not isinstance(refinement_request, str) or not refinement_request.strip():
+        return json_error(400, "request is required")
+    if not isinstance(history, dict) or not isinstance(history.get("rounds"), list):
+        return json_error(400, "history must be an object from an earlier refine response")
+    history.setdefault("summary", "")
+    if get_provider(model) is None:
+        return json_error(400, f"Unknown model: {model}")
+
+    async def record_round(plans):
+        # Compacting the history may call the model, so it runs off the event loop
+        await asyncio.to_thread(add_refinement_round, history, refinement_request, model)
+        return {"history": history}
+
+    if body.get("stream"):
+        return await stream_plans(request, {
+            model: stream_refined_travel_plan(plan, refinement_request, model, history)
+        }, finish=record_round)
+    refined = await arefine_travel_plan(plan, refinement_request, model, history)
+    if refined.startswith("Error"):
+        return json_error(502, refined)
+    return web.json_response({"model": model, "plan": refined, **await record_round({model: refined})})
+
+async def handle_health(request):
+    """
+    GET /health: liveness and load, for load balancer checks.
+
+    With ?deep=1 the model backends are checked as well.
+    """
+    result = {
+        "status": "ok",
+        **request.app["pool"].stats(),
+        "single_flight": request_flights.stats(),
+        "first_token_latency": first_token_latency.stats(),
+        "circuits": {name: breaker.stats() for name, breaker in circuit_breakers.items()},
+        "router": model_router.stats()
+    }
+    if request.query.get("deep") in ("1", "true"):
+        result["providers"] = await check_providers_health()
+        if not any(check["ok"] for check in result["providers"].values()):
+            result["status"] = "degraded"
+    return web.json_response(result, status=200 if result["status"] == "ok" else 503)
+
+async def handle_metrics(request):
+    """
+    GET /metrics: LLM call and server metrics in the Prometheus text format.
+    """
+    return web.Response(body=registry.render().encode("utf-8"),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+def create_app(workers=None, max_queue=None):
+    """
+    Build the API application.
+
+    Args:
+        workers (int): Generations served at once; defaults to API_WORKERS
+        max_queue (int): Requests allowed to wait for a slot; defaults to API_QUEUE_SIZE
+
+    Returns:
+        web.Application: The application
+    """
+    workers = workers or API_WORKERS
+    max_queue = API_QUEUE_SIZE if max_queue is None else max_queue
+    app = web.Application()
+
+    async def start_pool(app):
+        # Created here so the pool belongs to the loop the server runs on
+        app["pool"] = WorkerPool(workers, max_queue)
+        # Streamed plans come from blocking generators; each busy slot needs a thread per stream it
+        # drains, and a streamed comparison drains one per comparison model
+        app["executor"] = ThreadPoolExecutor(max_workers=workers * len(COMPARISON_MODELS),
+                                             thread_name_prefix="api-stream")
+        registry.add_collector(collect_pool_state)
+
+    async def stop_pool(app):
+        registry.remove_collector(collect_pool_state)
+        app["executor"].shutdown(wait=False, cancel_futures=True)
+        # The providers' HTTP clients belong to this loop, so their connections are closed before it ends
+        await close_providers()
+
+    def collect_pool_state():
+        pool = app["pool"].stats()
+        return [
+            ("api_workers_busy", "gauge", "Generation slots in use", [({}, pool["active"])]),
+            ("api_queue_depth", "gauge", "Requests waiting for a generation slot", [({}, pool["queue_depth"])])
+        ]
+
+    app.on_startup.append(start_pool)
+    app.on_cleanup.append(stop_pool)
+    app.router.add_post("/v1/plans", generation_endpoint(handle_generate))
+    app.router.add_post("/v1/compare", generation_endpoint(handle_compare))
+    app.router.add_post("/v1/refine", generation_endpoint(handle_refine))
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+def run_api_server(host=None, port=None, workers=None, max_queue=None):
+    """
+    Serve the API until interrupted.
+
+    Args:
+        host (str): Interface to listen on; defaults to API_HOST
+        port (int): Port to listen on; defaults to API_PORT
+        workers (int): Generations served at once; defaults to API_WORKERS
+        max_queue (int): Requests allowed to wait for a slot; defaults to API_QUEUE_SIZE
+    """
+    web.run_app(create_app(workers, max_queue), host=host or API_HOST, port=port or API_PORT)
+
+def main():
+    parser = argparse.ArgumentParser(description="Travel plan HTTP API")
+    parser.add_argument("--host", default=API_HOST, help="Interface to listen on")
+    parser.add_argument("--port", type=int, default=API_PORT, help="Port to listen on")
+    parser.add_argument("--workers", type=int, default=API_WORKERS, help="Generations served at once")
+    parser.add_argument("--queue-size", type=int, default=API_QUEUE_SIZE,
+                        help="Requests allowed to wait for a free worker before getting a 503")
+    args = parser.parse_args()
+    run_api_server(args.host, args.port, args.workers, args.queue_size)
+
+if __name__ == "__main__":
+    main()
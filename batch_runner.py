@@ -0,0 +1,181 @@
+import os
+import json
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dialogue_system import create_dialogue_stages, generate_travel_plan
+from rate_limiter import request_priority, BACKGROUND
+from llm_setup import backend_concurrency
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a list of numbers.
+
+    Args:
+        values (list): Numbers to summarize
+        percent (float): Percentile between 0 and 100
+
+    Returns:
+        float: The percentile, or None for an empty list
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(percent / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def load_batch_requests(input_path):
+    """
+    Read trip requests from a JSONL file.
+
+    Each line is a user_responses dict using the stage names from
+    create_dialogue_stages. Two optional keys are also understood: "id"
+    (defaults to the line number) and "model" (overrides the batch model).
+
+    Args:
+        input_path (str): Path to the JSONL file
+
+    Returns:
+        list: (request_id, model, user_responses) tuples
+    """
+    requests_to_run = []
+    with open(input_path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            request_id = str(record.pop("id", line_number))
+            model = record.pop("model", None)
+            requests_to_run.append((request_id, model, record))
+    return requests_to_run
+
+def load_completed_ids(output_path):
+    """
+    Collect the ids that already have a successful result, for resuming a run.
+
+    Args:
+        output_path (str): Path to the output JSONL file
+
+    Returns:
+        set: Request ids with a successful result
+    """
+    completed = set()
+    if not os.path.exists(output_path):
+        return completed
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # A run killed mid-write can leave a truncated last line
+                continue
+            if result.get("ok"):
+                completed.add(str(result["id"]))
+    return completed
+
+def run_batch(input_path, output_path, model="openai", workers=4, backend_limits=None, resume=True):
+    """
+    Generate travel plans for every request in a JSONL file.
+
+    Requests run on a pool of worker threads, with an additional cap on how
+    many calls may be in flight per backend. The cap counts the calls sent to
+    each backend after routing, including every day call of a long trip. Results are appended to the
+    output file as they finish, so an interrupted run can be resumed.
+
+    Args:
+        input_path (str): JSONL file of user_responses dicts
+        output_path (str): JSONL file results are appended to
+        model (str): Default model for requests without a "model" key
+        workers (int): Number of requests processed at once
+        backend_limits (dict): Optional maximum in-flight calls per backend ("openai" or "llama")
+        resume (bool): Skip requests that already succeeded in output_path
+
+    Returns:
+        dict: Throughput and latency summary
+    """
+    stages = create_dialogue_stages()
+    known_fields = {stage["name"] for stage in stages}
+    required_fields = [stage["name"] for stage in stages if stage["required"]]
+
+    requests_to_run = load_batch_requests(input_path)
+    completed = load_completed_ids(output_path) if resume else set()
+    pending = [entry for entry in requests_to_run if entry[0] not in completed]
+    if completed:
+        print(f"Resuming: {len(requests_to_run) - len(pending)} of {len(requests_to_run)} requests already done")
+
+    limits = {
+        name: threading.BoundedSemaphore(limit)
+        for name, limit in (backend_limits or {}).items() if limit
+    }
+    latencies = []
+    failures = 0
+
+    def run_one(request_id, request_model, user_responses):
+        request_model = request_model or model
+        unknown = sorted(set(user_responses) - known_fields)
+        missing = [name for name in required_fields if not str(user_responses.get(name, "")).strip()]
+        if missing:
+            return {"id": request_id, "model": request_model, "ok": False, "latency": 0.0,
+                    "error": f"Missing required fields: {', '.join(missing)}"}
+
+        start = time.monotonic()
+        # Batch work yields to interactive users at the shared rate limiter
+        with request_priority(BACKGROUND), backend_concurrency(limits):
+            plan = generate_travel_plan(user_responses, request_model)
+        latency = time.monotonic() - start
+
+        result = {"id": request_id, "model": request_model, "latency": round(latency, 3)}
+        if plan.startswith("Error"):
+            result.update(ok=False, error=plan)
+        else:
+            result.update(ok=True, plan=plan)
+        if unknown:
+            result["ignored_fields"] = unknown
+        return result
+
+    start = time.monotonic()
+    with open(output_path, "a", encoding="utf-8") as output, ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_one, *entry) for entry in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            output.write(json.dumps(result, ensure_ascii=False) + "\n")
+            output.flush()
+
+            if result["ok"]:
+                latencies.append(result["latency"])
+                status = f"done in {result['latency']:.1f}s"
+            else:
+                failures += 1
+                status = f"failed: {result['error'][:80]}"
+            print(f"[{done}/{len(pending)}] {result['id']} ({result['model']}) {status}")
+
+    elapsed = time.monotonic() - start
+    summary = {
+        "requests": len(requests_to_run),
+        "skipped": len(requests_to_run) - len(pending),
+        "succeeded": len(latencies),
+        "failed": failures,
+        "elapsed_seconds": round(elapsed, 2),
+        "plans_per_minute": round(len(latencies) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95)
+    }
+    return summary
+
+def print_batch_summary(summary):
+    """
+    Print the throughput summary of a batch run.
+
+    Args:
+        summary (dict): Output of run_batch
+    """
+    print("\n===== BATCH SUMMARY =====\n")
+    print(f"Requests:      {summary['requests']} ({summary['skipped']} skipped from checkpoint)")
+    print(f"Succeeded:     {summary['succeeded']}")
+    print(f"Failed:        {summary['failed']}")
+    print(f"Elapsed:       {summary['elapsed_seconds']}s")
+    print(f"Throughput:    {summary['plans_per_minute']} plans/min")
+    if summary["latency_p50"] is not None:
+        print(f"Latency p50:   {summary['latency_p50']:.2f}s")
+        print(f"Latency p95:   {summary['latency_p95']:.2f}s")
@@ -0,0 +1,167 @@
+import json
+import time
+import platform
+from concurrent.futures import ThreadPoolExecutor
+from llm_setup import TRAVEL_TEST_PROMPTS, COMPARISON_PROMPT, estimate_tokens
+from llm_providers import get_provider
+from batch_runner import percentile
+from rate_limiter import request_priority, BACKGROUND
+
+# Prompts benchmarked when no corpus file is given
+DEFAULT_CORPUS = TRAVEL_TEST_PROMPTS + [COMPARISON_PROMPT]
+
+def load_corpus(path):
+    """
+    Load a benchmark prompt corpus.
+
+    Args:
+        path (str): A JSON file holding a list of prompts, or a text file with
+            one prompt per line
+
+    Returns:
+        list: Prompts to benchmark
+    """
+    with open(path, encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith(".json"):
+        return json.loads(content)
+    return [line.strip() for line in content.splitlines() if line.strip()]
+
+def measure_request(backend, prompt):
+    """
+    Stream one uncached response and time it.
+
+    Args:
+        backend (str): Provider name ("openai" or "llama")
+        prompt (str): Prompt to send
+
+    Returns:
+        dict: Time to first token, total latency, completion tokens and outcome
+    """
+    provider = get_provider(backend)
+    start = time.perf_counter()
+    first_token = None
+    pieces = []
+    for chunk in provider.stream_query(prompt, use_cache=False):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        pieces.append(chunk)
+    latency = time.perf_counter() - start
+
+    text = "".join(pieces)
+    ok = bool(text) and not text.startswith("Error")
+    return {
+        "ok": ok,
+        "ttft": first_token if ok else None,
+        "latency": latency,
+        "completion_tokens": estimate_tokens(text) if ok else 0,
+        "error": None if ok else text[:200]
+    }
+
+def summarize_measurements(measurements, wall_time):
+    """
+    Reduce the measurements of one backend/concurrency run to summary statistics.
+
+    Args:
+        measurements (list): Outputs of measure_request
+        wall_time (float): Wall-clock seconds for the whole run
+
+    Returns:
+        dict: Latency and TTFT percentiles, tokens/sec, throughput and error rate
+    """
+    succeeded = [m for m in measurements if m["ok"]]
+    ttfts = [m["ttft"] for m in succeeded]
+    latencies = [m["latency"] for m in succeeded]
+    generation_time = sum(m["latency"] - m["ttft"] for m in succeeded)
+    completion_tokens = sum(m["completion_tokens"] for m in succeeded)
+    summary = {
+        "requests": len(measurements),
+        "errors": len(measurements) - len(succeeded),
+        "error_rate": (len(measurements) - len(succeeded)) / len(measurements) if measurements else 0.0,
+        "wall_time": wall_time,
+        "requests_per_second": len(measurements) / wall_time if wall_time > 0 else 0.0,
+        "tokens_per_second": completion_tokens / generation_time if generation_time > 0 else None
+    }
+    for name, values in (("ttft", ttfts), ("latency", latencies)):
+        for percent in (50, 95, 99):
+            summary[f"{name}_p{percent}"] = percentile(values, percent)
+    return summary
+
+def run_benchmark(backends=("openai", "llama"), corpus=None, repetitions=3, concurrency_levels=(1,)):
+    """
+    Benchmark each backend against a prompt corpus.
+
+    Every prompt is sent `repetitions` times at each concurrency level, with
+    the response cache bypassed. Requests run at background priority so a
+    benchmark never starves real users of the shared rate limit.
+
+    Args:
+        backends (tuple): Provider names to benchmark
+        corpus (list): Prompts to send; defaults to DEFAULT_CORPUS
+        repetitions (int): Times each prompt is sent per concurrency level
+        concurrency_levels (tuple): Numbers of requests kept in flight
+
+    Returns:
+        dict: Run configuration and one summary per backend and concurrency level
+    """
+    corpus = corpus or DEFAULT_CORPUS
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "backends": list(backends),
+            "prompts": len(corpus),
+            "repetitions": repetitions,
+            "concurrency_levels": list(concurrency_levels)
+        },
+        "results": []
+    }
+
+    with request_priority(BACKGROUND):
+        for backend in backends:
+            if get_provider(backend) is None:
+                print(f"Skipping unknown backend: {backend}")
+                continue
+            for concurrency in concurrency_levels:
+                jobs = [prompt for prompt in corpus for _ in range(repetitions)]
+                print(f"Benchmarking {backend} with {len(jobs)} requests at concurrency {concurrency}...")
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    measurements = list(pool.map(lambda prompt: measure_request(backend, prompt), jobs))
+                summary = summarize_measurements(measurements, time.perf_counter() - start)
+                summary.update(backend=backend, concurrency=concurrency)
+                summary["sample_errors"] = [m["error"] for m in measurements if m["error"]][:3]
+                report["results"].append(summary)
+
+    return report
+
+def print_benchmark_report(report):
+    """
+    Print a benchmark report as a table.
+
+    Args:
+        report (dict): Output of run_benchmark
+    """
+    def fmt(value, unit="s"):
+        return "-" if value is None else f"{value:.2f}{unit}"
+
+    print("\n===== LATENCY BENCHMARK =====\n")
+    print(f"{'Backend':<8} {'Conc':>4} {'Reqs':>5} {'Err%':>6} {'TTFT p50':>9} {'TTFT p95':>9} "
+          f"{'Lat p50':>8} {'Lat p95':>8} {'Lat p99':>8} {'Tok/s':>7}")
+    for result in report["results"]:
+        print(f"{result['backend']:<8} {result['concurrency']:>4} {result['requests']:>5} "
+              f"{result['error_rate'] * 100:>5.1f}% {fmt(result['ttft_p50']):>9} {fmt(result['ttft_p95']):>9} "
+              f"{fmt(result['latency_p50']):>8} {fmt(result['latency_p95']):>8} {fmt(result['latency_p99']):>8} "
+              f"{fmt(result['tokens_per_second'], ''):>7}")
+
+def write_benchmark_report(report, output_path):
+    """
+    Save a benchmark report as JSON so runs can be diffed.
+
+    Args:
+        report (dict): Output of run_benchmark
+        output_path (str): File to write
+    """
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBenchmark results written to {output_path}")
@@ -0,0 +1,170 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_setup import response_cache
+from dialogue_system import (
+    POPULAR_DESTINATIONS, generate_travel_plan, get_destination_context, cached_travel_plan, long_trip_days
+)
+from rate_limiter import request_priority, BACKGROUND
+
+def _env_list(name, default):
+    return [value.strip() for value in os.getenv(name, default).split(",") if value.strip()]
+
+# Backends, trip lengths and budgets the popular destinations are warmed for; lengths of
+# LONG_TRIP_DAYS or more are skipped, since long trips are generated day by day and never served whole
+WARM_MODELS = _env_list("CACHE_WARM_MODELS", "openai,llama")
+WARM_DURATIONS = _env_list("CACHE_WARM_DURATIONS", "3 days,7 days")
+WARM_BUDGETS = _env_list("CACHE_WARM_BUDGETS", "$1500,$3000,$6000")
+
+# Warm-up requests in flight at once; they also queue behind interactive calls at the rate limiter
+WARM_WORKERS = int(os.getenv("CACHE_WARM_WORKERS", "4"))
+
+# Optional answers that say nothing, as a user skipping those questions gives them; the request
+# used to check that warmed plans get served carries these
+PROBE_ANSWERS = {
+    "accommodation_preference": "No preference",
+    "dietary_restrictions": "None"
+}
+
+def warm_requests(destinations=None, durations=None, budgets=None):
+    """
+    Build the baseline trip requests to pre-generate.
+
+    Only the destination, trip length and budget are filled in. The cache
+    keeps these as baseline plans: the similarity lookup serves one to
+    requests with the same destination, trip-length range and budget range
+    that give no free-text answers either. Trip lengths that are generated
+    day by day are left out.
+
+    Args:
+        destinations (list): Destination names; defaults to POPULAR_DESTINATIONS
+        durations (list): Trip lengths such as "7 days"; defaults to WARM_DURATIONS
+        budgets (list): Budgets such as "$3000"; defaults to WARM_BUDGETS
+
+    Returns:
+        list: user_responses dicts
+    """
+    destinations = destinations or [destination["name"] for destination in POPULAR_DESTINATIONS]
+    return [
+        {"travel_destination": destination, "travel_dates": duration, "budget": budget}
+        for destination in destinations
+        for duration in (durations or WARM_DURATIONS)
+        if long_trip_days({"travel_dates": duration}) is None
+        for budget in (budgets or WARM_BUDGETS)
+    ]
+
+def warm_cache(models=None, destinations=None, durations=None, budgets=None, workers=None):
+    """
+    Pre-generate baseline plans and destination overviews into the response cache.
+
+    Entries that are already cached cost nothing, so the warm-up can be rerun
+    on a schedule to replace the ones that expired.
+
+    Args:
+        models (list): Models to warm; defaults to WARM_MODELS
+        destinations (list): Destination names; defaults to POPULAR_DESTINATIONS
+        durations (list): Trip lengths; defaults to WARM_DURATIONS
+        budgets (list): Budgets; defaults to WARM_BUDGETS
+        workers (int): Requests in flight at once; defaults to WARM_WORKERS
+
+    Returns:
+        dict: Counts of warmed entries, failures and model calls made, and
+            whether a warmed plan served a realistic request afterwards
+    """
+    models = models or WARM_MODELS
+    destinations = destinations or [destination["name"] for destination in POPULAR_DESTINATIONS]
+    jobs = [(generate_travel_plan, request, model)
+            for model in models
+            for request in warm_requests(destinations, durations, budgets)]
+    jobs += [(get_destination_context, destination, model) for model in models for destination in destinations]
+
+    def run_one(function, argument, model):
+        # Warm-up yields to interactive users at the shared rate limiter
+        with request_priority(BACKGROUND):
+            return function(argument, model)
+
+    misses_before = response_cache.stats()["misses"]
+    failures = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers or WARM_WORKERS) as pool:
+        futures = {pool.submit(run_one, *job): job for job in jobs}
+        for future in as_completed(futures):
+            result = future.result()
+            if result.startswith("Error"):
+                _, argument, model = futures[future]
+                failures.append(f"{model}: {argument}: {result[:80]}")
+
+    model_calls = response_cache.stats()["misses"] - misses_before
+    return {
+        "entries": len(jobs),
+        "warmed": len(jobs) - len(failures),
+        "failed": failures,
+        "model_calls": model_calls,
+        "elapsed_seconds": round(time.monotonic() - start, 2),
+        "serves_requests": warmed_plans_serve_requests(models, destinations, durations, budgets)
+    }
+
+def warmed_plans_serve_requests(models=None, destinations=None, durations=None, budgets=None):
+    """
+    Check that a warmed plan answers a request that only gives the trip basics.
+
+    The first warmed request is sent through the cache lookup again with
+    the optional questions answered but saying nothing, as a user who skips
+    them would.
+
+    Args:
+        models (list): Warmed models; defaults to WARM_MODELS
+        destinations (list): Warmed destination names; defaults to POPULAR_DESTINATIONS
+        durations (list): Warmed trip lengths; defaults to WARM_DURATIONS
+        budgets (list): Warmed budgets; defaults to WARM_BUDGETS
+
+    Returns:
+        dict: Per model, True if the cache answered the request
+    """
+    request = dict(warm_requests(destinations, durations, budgets)[0], **PROBE_ANSWERS)
+    return {model: cached_travel_plan(request, model) is not None for model in models or WARM_MODELS}
+
+def print_warm_summary(summary):
+    """
+    Print the outcome of a warm-up run.
+
+    Args:
+        summary (dict): Output of warm_cache
+    """
+    print("\n===== CACHE WARM-UP =====\n")
+    print(f"Entries:       {summary['entries']}")
+    print(f"Warmed:        {summary['warmed']}")
+    print(f"Model calls:   {summary['model_calls']}")
+    print(f"Elapsed:       {summary['elapsed_seconds']}s")
+    for model, served in summary["serves_requests"].items():
+        print(f"Serves {model}:  {'yes' if served else 'NO - warmed plans are not being matched'}")
+    for failure in summary["failed"]:
+        print(f"Failed:        {failure}")
+
+def start_background_warming(interval=0, **options):
+    """
+    Warm the cache on a daemon thread, optionally repeating on a schedule.
+
+    Args:
+        interval (float): Seconds between runs; 0 warms once
+        **options: Passed on to warm_cache
+
+    Returns:
+        threading.Thread: The warming thread
+    """
+    def run():
+        while True:
+            try:
+                summary = warm_cache(**options)
+                print(f"Cache warm-up: {summary['warmed']}/{summary['entries']} entries, "
+                      f"{summary['model_calls']} model calls in {summary['elapsed_seconds']}s")
+            except Exception as e:
+                print(f"Error warming cache: {str(e)}")
+            if not interval:
+                return
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="cache-warmer", daemon=True)
+    thread.start()
+    return thread
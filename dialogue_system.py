@@ -1,4 +1,47 @@
-from llm_setup import query_openai_api, query_local_llama, compare_models
+import os
+import sys
+import time
+import asyncio
+import itertools
+import contextvars
+from functools import partial
+from llm_setup import (
+    compare_models, query_models_concurrently, fanout_executor, estimate_tokens, response_cache, FANOUT_WORKERS,
+    first_token_latency, circuit_breakers
+)
+from llm_providers import get_provider, PROVIDERS
+from hedging import hedged_stream, HEDGE_DISABLED
+from rate_limiter import current_priority, INTERACTIVE
+from request_normalizer import normalize_user_responses, request_fingerprint, extract_trip_days
+from itinerary import (
+    TRIP_SKELETON_SCHEMA, DAY_DETAILS_SCHEMA,
+    Itinerary, parse_itinerary, extract_json_object, parse_cost
+)
+from plan_sections import split_plan_sections, join_plan_sections, route_refinement, plan_outline, splice_section
+
+# Result labels used in comparison mode and the model each one maps to
+COMPARISON_MODELS = {
+    "OpenAI": "openai",
+    "Llama 3.2": "llama"
+}
+
+# One-click destinations offered by the frontend; cache_warmer pre-generates their plans
+POPULAR_DESTINATIONS = [
+    {"emoji": "🇫🇷", "name": "Paris, France", "description": "The city of lights, romance, and exquisite cuisine."},
+    {"emoji": "🇯🇵", "name": "Tokyo, Japan", "description": "A vibrant metropolis blending ultramodern and traditional."},
+    {"emoji": "🇮🇹", "name": "Rome, Italy", "description": "Ancient history and world-class art in every corner."},
+    {"emoji": "🇬🇷", "name": "Athens, Greece", "description": "The cradle of Western civilization with stunning ruins."},
+    {"emoji": "🇹🇭", "name": "Bangkok, Thailand", "description": "Vibrant street life and ornate shrines in Southeast Asia."},
+    {"emoji": "🇲🇽", "name": "Mexico City, Mexico", "description": "Rich culture, amazing food, and ancient pyramids nearby."}
+]
+
+# Trips at least this many days long are outlined first, then detailed a few days per call in parallel
+LONG_TRIP_DAYS = int(os.getenv("LONG_TRIP_DAYS", "10"))
+
+# Token budget for earlier refinement requests carried into each refinement prompt
+REFINEMENT_HISTORY_TOKENS = int(os.getenv("REFINEMENT_HISTORY_TOKENS", "300"))
+# Most recent refinement requests kept word for word when older ones are compacted
+REFINEMENT_RECENT_ROUNDS = int(os.getenv("REFINEMENT_RECENT_ROUNDS", "2"))
 
 def create_dialogue_stages():
     """
@@ -90,68 +133,877 @@ def construct_travel_prompt(user_responses):
     The itinerary should be well-structured, personalized to their interests, and respectful of their budget constraints.
     """
 
-def generate_travel_plan(user_responses, model="openai"):
+def generate_travel_plan(user_responses, model="openai", hedge=None):
     """
     Generate a travel plan based on user responses using the specified model.
     
     Args:
         user_responses (dict): Dictionary containing user responses
-        model (str): Model to use ("openai" or "llama")
+        model (str): Model to use ("openai", "llama" or "auto")
+        hedge (bool): Fall back to another model if this one is slow or failing;
+            by default only interactive requests with model="auto" are hedged
     
     Returns:
         str: Generated travel plan
     """
+    if should_hedge(hedge, model):
+        return "".join(stream_travel_plan(user_responses, model, hedge=True))
+    
+    # The model sees the user's own answers; canonical ones only key the cache
+    normalized = normalize_user_responses(user_responses)
     prompt = construct_travel_prompt(user_responses)
     
-    if model == "openai":
-        return query_openai_api(prompt)
-    elif model == "llama":
-        return query_local_llama(prompt)
-    else:
+    provider = get_provider(model)
+    if provider is None:
         return "Error: Invalid model specified"
+    # With model="auto", every call for this plan goes to the backend picked for its prompt
+    provider = provider.route(prompt)
+    
+    skeleton = generate_trip_skeleton(provider, user_responses, normalized)
+    if skeleton is not None:
+        return "".join(stream_day_details(provider, user_responses, normalized, *skeleton))
+    return provider.query(prompt, fingerprint=request_fingerprint(normalized),
+                          cache_text=construct_travel_prompt(normalized))
+
+def stream_travel_plan(user_responses, model="openai", hedge=None, cancel=None):
+    """
+    Stream a travel plan as the model generates it.
+    
+    Args:
+        user_responses (dict): Dictionary containing user responses
+        model (str): Model to use ("openai", "llama" or "auto")
+        hedge (bool): Fall back to another model if this one is slow or failing;
+            by default only interactive requests with model="auto" are hedged
+        cancel (threading.Event): Optional event set when the plan is no longer
+            wanted, so an unhedged long trip starts no further day calls
+    
+    Yields:
+        str: Pieces of the travel plan as they arrive
+    """
+    normalized = normalize_user_responses(user_responses)
+    hedge = should_hedge(hedge, model)
+    
+    provider = get_provider(model)
+    if provider is None:
+        yield "Error: Invalid model specified"
+        return
+    # With model="auto", every call for this plan goes to the backend picked for its prompt
+    provider = provider.route(construct_travel_prompt(user_responses))
+    model = provider.name
+    
+    if not hedge:
+        yield from stream_plan_from(provider, user_responses, normalized, cancel)
+        return
+    
+    # The chosen model first, then the others in registration order
+    candidates = [
+        (name, partial(stream_plan_from, get_provider(name), user_responses, normalized))
+        for name in [model] + [name for name in PROVIDERS if name != model]
+    ]
+    # A long trip's first chunk only comes once its outline call has finished, so it is timed against that
+    timed = model if long_trip_days(user_responses) is None else skeleton_latency_name(model)
+    yield from hedged_stream(
+        candidates,
+        first_token_latency.hedge_delay(timed),
+        allow=lambda name: name not in circuit_breakers or circuit_breakers[name].allow()
+    )
+
+def should_hedge(hedge=None, model=None):
+    """
+    Decide whether a plan request may fall back to another model.
+    
+    Args:
+        hedge (bool): Explicit choice, or None for the default
+        model (str): The model the request asked for
+    
+    Returns:
+        bool: The explicit choice; by default True for interactive requests
+            with model="auto" unless HEDGE_DISABLED is set. A user who
+            picked a model gets that model's plan, and batch and background
+            work can wait for the model they asked for
+    """
+    if hedge is not None:
+        return hedge
+    return not HEDGE_DISABLED and model == "auto" and current_priority() == INTERACTIVE
+
+def stream_plan_from(provider, user_responses, normalized, cancel=None):
+    """
+    Stream a travel plan from one provider.
+    
+    Args:
+        provider (LLMProvider): Provider to query
+        user_responses (dict): The raw user responses, which the prompts are built from
+        normalized (dict): The normalized user responses, which key the cache
+        cancel (threading.Event): Optional event set when the plan is no longer
+            wanted (e.g. another model won the hedge); no further calls are started
+    
+    Yields:
+        str: Pieces of the travel plan as they arrive
+    """
+    skeleton = generate_trip_skeleton(provider, user_responses, normalized)
+    if cancel is not None and cancel.is_set():
+        return
+    if skeleton is not None:
+        yield from stream_day_details(provider, user_responses, normalized, *skeleton, cancel=cancel)
+        return
+    yield from provider.stream_query(construct_travel_prompt(user_responses),
+                                     fingerprint=request_fingerprint(normalized),
+                                     cache_text=construct_travel_prompt(normalized))
+
+def construct_skeleton_prompt(user_responses, days):
+    """
+    Construct the prompt for the outline of a long trip.
+    
+    Args:
+        user_responses (dict): Dictionary containing user responses
+        days (int): Exact trip length in days
+    
+    Returns:
+        str: Formatted prompt for the LLM
+    """
+    return f"""
+    I need to outline a {days}-day personalized travel itinerary based on the following information:
+    
+    Personal Information: {user_responses.get('personal_info', 'Not provided')}
+    Travel Destination: {user_responses.get('travel_destination', 'Not provided')}
+    Travel Dates/Duration: {days} days
+    Budget: {user_responses.get('budget', 'Not provided')}
+    Interests: {user_responses.get('interests', 'Not provided')}
+    Accommodation Preference: {user_responses.get('accommodation_preference', 'Not provided')}
+    Dietary Restrictions: {user_responses.get('dietary_restrictions', 'Not provided')}
+    Additional Information: {user_responses.get('additional_info', 'Not provided')}
+    
+    Respond with a single JSON object in the layout below. List exactly {days} days, each with a short theme
+    as its "title", the area it covers and the activity "budget" for that day; the activities themselves are
+    planned separately. Split the budget so accommodation, dining and the daily budgets fit the total.
+    {TRIP_SKELETON_SCHEMA}
+    
+    Keep names and notes short.
+    """
+
+def construct_day_details_prompt(user_responses, skeleton, budgets, day_numbers):
+    """
+    Construct the prompt for the activities of a few days of an outlined trip.
+    
+    Args:
+        user_responses (dict): Dictionary containing user responses
+        skeleton (Itinerary): The trip outline from the skeleton call
+        budgets (dict): Activity budget per day number
+        day_numbers (list): Days to plan in this call
+    
+    Returns:
+        str: Formatted prompt for the LLM
+    """
+    outline = "\n    ".join(f"Day {day.number}: {day.title}" for day in skeleton.days)
+    requested = "\n    ".join(
+        f"Day {number}: {skeleton.get_day(number).title} (activity budget {budgets.get(number) or 'flexible'} {skeleton.currency})"
+        for number in day_numbers
+    )
+    return f"""
+    Travel Destination: {skeleton.destination or user_responses.get('travel_destination', 'Not provided')}
+    Personal Information: {user_responses.get('personal_info', 'Not provided')}
+    Interests: {user_responses.get('interests', 'Not provided')}
+    Dietary Restrictions: {user_responses.get('dietary_restrictions', 'Not provided')}
+    
+    Outline of the whole trip, so days don't repeat each other:
+    {outline}
+    
+    Plan the activities for these days only:
+    {requested}
+    
+    Respond with a single JSON object in this layout: {DAY_DETAILS_SCHEMA}
+    Give 3 to 5 activities per day with times as HH:MM and costs as plain numbers, staying within each day's budget.
+    """
+
+def long_trip_days(user_responses):
+    """
+    Return the trip length when a trip is long enough to generate day by day.
+    
+    The exact length comes from the raw answer, since normalization buckets it.
+    
+    Args:
+        user_responses (dict): The raw user responses
+    
+    Returns:
+        int: Trip length in days, or None for trips shorter than LONG_TRIP_DAYS
+    """
+    days = extract_trip_days(str(user_responses.get("travel_dates", "")))
+    return days if days and days >= LONG_TRIP_DAYS else None
 
-def compare_travel_plans(user_responses):
+def generate_trip_skeleton(provider, user_responses, normalized):
+    """
+    Outline a long trip with one fast call before its days are detailed in parallel.
+    
+    Args:
+        provider (LLMProvider): Provider to query
+        user_responses (dict): The raw user responses, which the prompt is built from
+        normalized (dict): The normalized user responses, which key the cache
+    
+    Returns:
+        tuple: (skeleton, budgets) with the outline as an Itinerary and the
+            activity budget per day, or None for short trips or when the outline
+            could not be generated (the plan is then written in one call)
+    """
+    days = long_trip_days(user_responses)
+    if days is None:
+        return None
+    start = time.monotonic()
+    response = provider.query(construct_skeleton_prompt(user_responses, days), json_mode=True,
+                              cache_text=construct_skeleton_prompt(normalized, days))
+    skeleton = parse_trip_skeleton(response, provider.name)
+    if skeleton is not None:
+        first_token_latency.record(skeleton_latency_name(provider.name), time.monotonic() - start)
+    return skeleton
+
+def skeleton_latency_name(model):
+    """
+    Name a model's outline calls are timed under in first_token_latency.
+    
+    Args:
+        model (str): Model name
+    
+    Returns:
+        str: Latency tracker key, e.g. "openai-skeleton"
+    """
+    return f"{model}-skeleton"
+
+def parse_trip_skeleton(response, model):
+    """
+    Read a skeleton call's response.
+    
+    Args:
+        response (str): The model's response
+        model (str): Model name, for the log message
+    
+    Returns:
+        tuple: (skeleton, budgets), or None if the outline is unusable
+    """
+    data = extract_json_object(response)
+    skeleton = Itinerary.from_dict(data) if data else None
+    if skeleton is None or not skeleton.days:
+        print(f"Could not outline the trip with {model}, generating it in one call: {response[:200]}")
+        return None
+    for day in skeleton.days:
+        day.activities = []
+    budgets = {}
+    for number, entry in enumerate(data.get("days") or [], 1):
+        if isinstance(entry, dict):
+            try:
+                number = int(entry.get("day") or number)
+            except (TypeError, ValueError):
+                pass
+            budgets[number] = parse_cost(entry.get("budget"))
+    return skeleton, budgets
+
+def day_groups(skeleton):
+    """
+    Split the days of an outline into one batch per detail call.
+    
+    Days are grouped so every call can start at once on the shared pool.
+    
+    Args:
+        skeleton (Itinerary): The trip outline
+    
+    Returns:
+        list: Lists of day numbers, in order
+    """
+    numbers = [day.number for day in skeleton.days]
+    size = max(1, -(-len(numbers) // FANOUT_WORKERS))
+    return [numbers[index:index + size] for index in range(0, len(numbers), size)]
+
+def apply_day_details(skeleton, day_numbers, response):
+    """
+    Copy the activities from a detail call's response into the outline.
+    
+    Args:
+        skeleton (Itinerary): The trip outline, updated in place
+        day_numbers (list): Days the call was asked to plan
+        response (str): The model's response
+    
+    Returns:
+        list: The day numbers that still have no activities
+    """
+    details = parse_itinerary(response)
+    missing = []
+    for number in day_numbers:
+        day = skeleton.get_day(number)
+        detailed = details.get_day(number) if details else None
+        if detailed is None and details and len(day_numbers) == len(details.days):
+            # Some models renumber the days they were given from 1
+            detailed = details.days[day_numbers.index(number)]
+        if detailed is None or not detailed.activities:
+            print(f"No activities generated for day {number}: {response[:200]}")
+            missing.append(number)
+            continue
+        day.activities = detailed.activities
+    return missing
+
+def retry_day_details(provider, user_responses, normalized, skeleton, budgets, day_numbers):
+    """
+    Ask once more for the days a detail call failed to plan.
+    
+    The retry bypasses the cache, which may hold the response that failed.
+    Days that still fail are rendered with a note saying so.
+    
+    Args:
+        provider (LLMProvider): Provider to query
+        user_responses (dict): The raw user responses, which the prompt is built from
+        normalized (dict): The normalized user responses, which key the cache
+        skeleton (Itinerary): The trip outline, updated in place
+        budgets (dict): Activity budget per day number
+        day_numbers (list): Days that have no activities yet
+    """
+    response = provider.query(construct_day_details_prompt(user_responses, skeleton, budgets, day_numbers),
+                              use_cache=False, json_mode=True,
+                              cache_text=construct_day_details_prompt(normalized, skeleton, budgets, day_numbers))
+    apply_day_details(skeleton, day_numbers, response)
+
+async def aretry_day_details(provider, user_responses, normalized, skeleton, budgets, day_numbers):
+    """
+    Ask once more for the days a detail call failed to plan, on the event loop.
+    
+    Args:
+        provider (LLMProvider): Provider to query
+        user_responses (dict): The raw user responses, which the prompt is built from
+        normalized (dict): The normalized user responses, which key the cache
+        skeleton (Itinerary): The trip outline, updated in place
+        budgets (dict): Activity budget per day number
+        day_numbers (list): Days that have no activities yet
+    """
+    response = await provider.generate(construct_day_details_prompt(user_responses, skeleton, budgets, day_numbers),
+                                       use_cache=False, json_mode=True,
+                                       cache_text=construct_day_details_prompt(normalized, skeleton, budgets, day_numbers))
+    apply_day_details(skeleton, day_numbers, response)
+
+def stream_day_details(provider, user_responses, normalized, skeleton, budgets, cancel=None):
+    """
+    Detail every day of an outlined trip concurrently and stream the plan in order.
+    
+    All detail calls start at once, so the plan takes about as long as the
+    outline plus one batch of days, and no single call has to fit the whole
+    trip in its token limit.
+    
+    Args:
+        provider (LLMProvider): Provider to query
+        user_responses (dict): The raw user responses, which the prompts are built from
+        normalized (dict): The normalized user responses, which key the cache
+        skeleton (Itinerary): The trip outline, filled in as the days arrive
+        budgets (dict): Activity budget per day number
+        cancel (threading.Event): Optional event set when the plan is no longer
+            wanted; detail calls that haven't started are then dropped
+    
+    Yields:
+        str: The plan's title, each day as soon as it and the days before it
+            are ready, then the accommodation, dining, cost and tip sections
+    """
+    groups = day_groups(skeleton)
+    calls = [
+        partial(provider.query, construct_day_details_prompt(user_responses, skeleton, budgets, group),
+                json_mode=True, cache_text=construct_day_details_prompt(normalized, skeleton, budgets, group))
+        for group in groups
+    ]
+    # Each call runs in a copy of the caller's context so its request priority carries over
+    futures = [fanout_executor.submit(contextvars.copy_context().run, call) for call in calls]
+    
+    try:
+        yield skeleton.title_markdown()
+        for group, call, future in zip(groups, calls, futures):
+            if cancel is not None:
+                while not future.done() and not cancel.wait(0.1):
+                    pass
+                if cancel.is_set():
+                    return
+            # A batch still waiting for a free worker is generated here instead
+            response = call() if future.cancel() else future.result()
+            missing = apply_day_details(skeleton, group, response)
+            if missing:
+                retry_day_details(provider, user_responses, normalized, skeleton, budgets, missing)
+            for number in group:
+                yield skeleton.day_markdown(skeleton.get_day(number))
+        yield skeleton.closing_markdown()
+    finally:
+        # Abandoned or cancelled plans drop the calls that haven't started yet
+        for future in futures:
+            future.cancel()
+
+def compare_travel_plans(user_responses, timeout=None):
     """
     Compare travel plans generated by both models.
     
+    Long trips go through the same outline-then-days pipeline as a single plan.
+    
     Args:
         user_responses (dict): Dictionary containing user responses
+        timeout (float or dict): Optional overall or per-model timeout in seconds
     
     Returns:
         dict: Dictionary with travel plans from both models
     """
-    prompt = construct_travel_prompt(user_responses)
-    return compare_models(prompt)
+    normalized = normalize_user_responses(user_responses)
+    if long_trip_days(user_responses) is not None:
+        def generate(model):
+            return "".join(stream_plan_from(get_provider(model), user_responses, normalized))
+        
+        # Each plan fans its day calls out to the shared pool; a worker waiting on them runs queued ones itself
+        return query_models_concurrently({
+            label: (generate, (model,)) for label, model in COMPARISON_MODELS.items()
+        }, timeout=timeout)
+    return compare_models(construct_travel_prompt(user_responses), timeout=timeout,
+                          fingerprint=request_fingerprint(normalized),
+                          cache_text=construct_travel_prompt(normalized))
 
-def refine_travel_plan(original_plan, refinement_request, model="openai"):
+def cached_travel_plan(user_responses, model="openai"):
     """
-    Refine a travel plan based on user feedback.
+    Look up the cached plan that would answer a request, without calling a model.
+    
+    Args:
+        user_responses (dict): Dictionary containing user responses
+        model (str): Model to look up ("openai" or "llama")
+    
+    Returns:
+        str: The cached plan, or None if nothing cached answers the request
+            (long trips are cached a few days at a time, so they always miss)
+    """
+    provider = get_provider(model)
+    if provider is None or long_trip_days(user_responses) is not None:
+        return None
+    normalized = normalize_user_responses(user_responses)
+    key = provider.cache_key(construct_travel_prompt(user_responses), cache_text=construct_travel_prompt(normalized))
+    return response_cache.get(key, request_fingerprint(normalized))
+
+def construct_destination_context_prompt(destination):
+    """
+    Construct a prompt for a short overview of a destination.
+    
+    Args:
+        destination (str): Normalized destination
+    
+    Returns:
+        str: Formatted prompt for the LLM
+    """
+    return f"""
+    Give a short overview of {destination} for someone planning a trip there.
+    
+    Cover, in a few bullet points each:
+    1. Best time to visit and typical weather
+    2. Neighborhoods worth staying in
+    3. Getting around and getting in from the airport
+    4. Local currency, typical daily costs and tipping
+    5. Customs and safety tips
+    
+    Keep it under 250 words and use markdown headings.
+    """
+
+def get_destination_context(destination, model="openai", cached_only=False):
+    """
+    Get a short overview of a destination.
+    
+    Args:
+        destination (str): Destination as the user would enter it
+        model (str): Model to use ("openai" or "llama")
+        cached_only (bool): Only return an overview that is already cached
+    
+    Returns:
+        str: Destination overview, or None if cached_only is set and nothing is cached
+    """
+    # Aliases such as "Rome" and "Rome, Italy" share one cache entry
+    normalized = normalize_user_responses({"travel_destination": destination}).get("travel_destination", destination)
+    prompt = construct_destination_context_prompt(destination)
+    cache_text = construct_destination_context_prompt(normalized)
+    
+    provider = get_provider(model)
+    if provider is None:
+        return None if cached_only else "Error: Invalid model specified"
+    if cached_only:
+        return response_cache.get(provider.cache_key(prompt, cache_text=cache_text))
+    return provider.query(prompt, cache_text=cache_text)
+
+def create_refinement_history():
+    """
+    Start an empty record of the refinements applied to a plan.
+    
+    Returns:
+        dict: {"summary": str, "rounds": list} where summary condenses the
+            compacted older requests and rounds holds the recent ones verbatim
+    """
+    return {"summary": "", "rounds": []}
+
+def format_refinement_history(history):
+    """
+    Render earlier refinements for inclusion in a refinement prompt.
+    
+    Args:
+        history (dict): Output of create_refinement_history, or None
+    
+    Returns:
+        str: Prompt lines, or an empty string when there is no history
+    """
+    if not history or not (history["summary"] or history["rounds"]):
+        return ""
+    lines = ["Earlier refinements (already applied; keep honoring them):"]
+    if history["summary"]:
+        lines.append(f"Summary of older requests: {history['summary']}")
+    lines.extend(f"- {request}" for request in history["rounds"])
+    return "\n    ".join(lines) + "\n    "
+
+def construct_history_summary_prompt(summary, requests):
+    """
+    Construct the prompt asking an LLM to fold refinement requests into a summary.
+    
+    Args:
+        summary (str): The current summary of older requests
+        requests (list): Requests to fold in, oldest first
+    
+    Returns:
+        str: Formatted prompt for the LLM
+    """
+    numbered = "\n    ".join(f"{number}. {request}" for number, request in enumerate(requests, 1))
+    return f"""
+    Current summary of a traveller's earlier change requests:
+    {summary or 'None'}
+    
+    Newer change requests, oldest first:
+    {numbered}
+    
+    Combine these into one short summary of the preferences the travel plan must keep honoring.
+    Later requests override earlier ones. Use at most {REFINEMENT_HISTORY_TOKENS // 3} words and return only the summary.
+    """
+
+def compact_refinement_history(history, model="openai"):
+    """
+    Fold all but the most recent refinement requests into the running summary.
+    
+    Args:
+        history (dict): Output of create_refinement_history, updated in place
+        model (str): Model used to write the summary
+    """
+    older = history["rounds"][:-REFINEMENT_RECENT_ROUNDS] if REFINEMENT_RECENT_ROUNDS else history["rounds"]
+    if not older:
+        return
+    
+    provider = get_provider(model)
+    summary = provider.query(construct_history_summary_prompt(history["summary"], older)) if provider else "Error"
+    if summary.startswith("Error"):
+        # Without a model, keep the requests themselves and let the cap below trim the oldest
+        summary = "; ".join(filter(None, [history["summary"]] + older))
+    
+    # Cap the summary at half the budget so the recent rounds always fit
+    max_chars = REFINEMENT_HISTORY_TOKENS * 2
+    summary = " ".join(summary.split())
+    if len(summary) > max_chars:
+        summary = "..." + summary[-max_chars:].split(" ", 1)[-1]
+    history["summary"] = summary
+    history["rounds"] = history["rounds"][len(older):]
+
+def add_refinement_round(history, refinement_request, model="openai"):
+    """
+    Record a refinement request once it has been applied.
+    
+    When the recorded requests would take more than REFINEMENT_HISTORY_TOKENS
+    of a prompt, the older ones are compacted into a running summary, so the
+    prompt stays the same size however many rounds a user goes through.
+    
+    Args:
+        history (dict): Output of create_refinement_history, updated in place
+        refinement_request (str): The request that was applied
+        model (str): Model used to write the summary when compacting
+    
+    Returns:
+        dict: The updated history
+    """
+    history["rounds"].append(refinement_request.strip())
+    if estimate_tokens(format_refinement_history(history)) > REFINEMENT_HISTORY_TOKENS:
+        compact_refinement_history(history, model)
+    return history
+
+def construct_refinement_prompt(original_plan, refinement_request, history=None):
+    """
+    Construct the prompt asking an LLM to refine an existing travel plan.
     
     Args:
         original_plan (str): The original travel plan
         refinement_request (str): User's refinement request
-        model (str): Model to use for refinement
+        history (dict): Optional earlier refinements, from create_refinement_history
     
     Returns:
-        str: Refined travel plan
+        str: Formatted prompt for the LLM
     """
-    prompt = f"""
+    return f"""
     Original travel plan:
     {original_plan}
-    
+    {format_refinement_history(history)}
     User requested refinements:
     {refinement_request}
     
     Please provide an improved travel plan addressing these specific requests while maintaining the original structure.
     Make the changes seamlessly so the plan still reads as a cohesive whole.
     """
+
+def construct_section_refinement_prompt(outline, section, refinement_request, history=None):
+    """
+    Construct the prompt asking an LLM to rewrite one section of a travel plan.
+    
+    Args:
+        outline (str): The plan's opening and section headings, for context
+        section (dict): The section to rewrite, from split_plan_sections
+        refinement_request (str): User's refinement request
+        history (dict): Optional earlier refinements, from create_refinement_history
+    
+    Returns:
+        str: Formatted prompt for the LLM
+    """
+    return f"""
+    Travel plan outline:
+    {outline}
+    
+    Section to update ({section['title']}):
+    {section['text'].strip()}
+    {format_refinement_history(history)}
+    User requested refinements:
+    {refinement_request}
+    
+    Rewrite only this section so it addresses the requests, keeping its format and level of detail.
+    Return just the content under the heading, without repeating the heading or the rest of the plan.
+    """
+
+def plan_refinement(original_plan, refinement_request, history=None):
+    """
+    Work out how to refine a plan: rewrite a few sections, or the whole plan.
+    
+    Args:
+        original_plan (str): The original travel plan
+        refinement_request (str): User's refinement request
+        history (dict): Optional earlier refinements, from create_refinement_history
+    
+    Returns:
+        tuple: (sections, prompts) where prompts maps the key of each section to
+            rewrite to its prompt, or (None, prompt) for a whole-plan rewrite
+    """
+    sections = split_plan_sections(original_plan)
+    targets = route_refinement(sections, refinement_request)
+    if targets is None:
+        return None, construct_refinement_prompt(original_plan, refinement_request, history)
+    
+    outline = plan_outline(sections)
+    return sections, {
+        section["key"]: construct_section_refinement_prompt(outline, section, refinement_request, history)
+        for section in sections if section["key"] in targets
+    }
+
+def prefetch_sections(provider, prompts):
+    """
+    Start generating every section but the first on the shared pool.
+    
+    Args:
+        provider (LLMProvider): Provider to query
+        prompts (dict): Section prompts keyed by section key, in plan order
     
-    if model == "openai":
-        return query_openai_api(prompt)
-    elif model == "llama":
-        return query_local_llama(prompt)
-    else:
+    Returns:
+        dict: Futures keyed by section key
+    """
+    # Each call runs in a copy of the caller's context so its request priority carries over
+    return {
+        key: fanout_executor.submit(contextvars.copy_context().run, provider.query, prompt)
+        for key, prompt in list(prompts.items())[1:]
+    }
+
+def refine_travel_plan(original_plan, refinement_request, model="openai", history=None):
+    """
+    Refine a travel plan based on user feedback.
+    
+    Requests that concern particular days or topics only regenerate those
+    sections, which are spliced back into the original plan; anything
+    broader rewrites the whole plan.
+    
+    Args:
+        original_plan (str): The original travel plan
+        refinement_request (str): User's refinement request
+        model (str): Model to use for refinement
+        history (dict): Optional earlier refinements, from create_refinement_history
+    
+    Returns:
+        str: Refined travel plan
+    """
+    provider = get_provider(model)
+    if provider is None:
         return "Error: Invalid model specified"
+    
+    sections, prompts = plan_refinement(original_plan, refinement_request, history)
+    if sections is None:
+        return provider.query(prompts)
+    
+    futures = prefetch_sections(provider, prompts)
+    rewritten = {}
+    for key, prompt in prompts.items():
+        future = futures.get(key)
+        # A section still waiting for a free worker is generated here instead
+        if future is None or future.cancel():
+            rewritten[key] = provider.query(prompt)
+        else:
+            rewritten[key] = future.result()
+        if rewritten[key].startswith("Error"):
+            return rewritten[key]
+    
+    for section in sections:
+        if section["key"] in rewritten:
+            section["text"] = "".join(splice_section(section, [rewritten[section["key"]]]))
+    return join_plan_sections(sections)
+
+def stream_refined_travel_plan(original_plan, refinement_request, model="openai", history=None):
+    """
+    Stream a refined travel plan as the model generates it.
+    
+    Untouched sections are passed through as they are, and the regenerated
+    sections stream in their place. A section whose rewrite fails keeps its
+    original text.
+    
+    Args:
+        original_plan (str): The original travel plan
+        refinement_request (str): User's refinement request
+        model (str): Model to use for refinement
+        history (dict): Optional earlier refinements, from create_refinement_history
+    
+    Yields:
+        str: Pieces of the refined plan as they arrive
+    """
+    provider = get_provider(model)
+    if provider is None:
+        yield "Error: Invalid model specified"
+        return
+    
+    sections, prompts = plan_refinement(original_plan, refinement_request, history)
+    if sections is None:
+        yield from provider.stream_query(prompts)
+        return
+    
+    futures = prefetch_sections(provider, prompts)
+    for section in sections:
+        key = section["key"]
+        if key not in prompts:
+            yield section["text"]
+            continue
+        
+        future = futures.get(key)
+        if future is None or future.cancel():
+            chunks = iter(provider.stream_query(prompts[key]))
+        else:
+            chunks = iter([future.result()])
+        
+        first = next(chunks, "")
+        if first.startswith("Error"):
+            print(f"Keeping the original {section['title']} section: {first}")
+            yield section["text"]
+            continue
+        yield from splice_section(section, itertools.chain([first], chunks))
+
+async def agenerate_travel_plan(user_responses, model="openai"):
+    """
+    Generate a travel plan on the event loop instead of a blocked thread.
+    
+    Args:
+        user_responses (dict): Dictionary containing user responses
+        model (str): Model to use ("openai", "llama" or "auto")
+    
+    Returns:
+        str: Generated travel plan
+    """
+    normalized = normalize_user_responses(user_responses)
+    prompt = construct_travel_prompt(user_responses)
+    
+    provider = get_provider(model)
+    if provider is None:
+        return "Error: Invalid model specified"
+    # With model="auto", every call for this plan goes to the backend picked for its prompt
+    provider = provider.route(prompt)
+    
+    days = long_trip_days(user_responses)
+    if days is not None:
+        response = await provider.generate(construct_skeleton_prompt(user_responses, days), json_mode=True,
+                                           cache_text=construct_skeleton_prompt(normalized, days))
+        skeleton = parse_trip_skeleton(response, provider.name)
+        if skeleton is not None:
+            skeleton, budgets = skeleton
+            groups = day_groups(skeleton)
+            responses = await asyncio.gather(*(
+                provider.generate(construct_day_details_prompt(user_responses, skeleton, budgets, group),
+                                  json_mode=True,
+                                  cache_text=construct_day_details_prompt(normalized, skeleton, budgets, group))
+                for group in groups
+            ))
+            for group, response in zip(groups, responses):
+                missing = apply_day_details(skeleton, group, response)
+                if missing:
+                    await aretry_day_details(provider, user_responses, normalized, skeleton, budgets, missing)
+            return skeleton.to_markdown()
+    return await provider.generate(prompt, fingerprint=request_fingerprint(normalized),
+                                   cache_text=construct_travel_prompt(normalized))
+
+async def acompare_travel_plans(user_responses):
+    """
+    Generate plans from every comparison model concurrently on the event loop.
+    
+    Args:
+        user_responses (dict): Dictionary containing user responses
+    
+    Returns:
+        dict: Dictionary with travel plans from both models
+    """
+    labels = list(COMPARISON_MODELS)
+    plans = await asyncio.gather(*(
+        agenerate_travel_plan(user_responses, COMPARISON_MODELS[label]) for label in labels
+    ))
+    return dict(zip(labels, plans))
+
+async def arefine_travel_plan(original_plan, refinement_request, model="openai", history=None):
+    """
+    Refine a travel plan on the event loop instead of a blocked thread.
+    
+    Args:
+        original_plan (str): The original travel plan
+        refinement_request (str): User's refinement request
+        model (str): Model to use for refinement
+        history (dict): Optional earlier refinements, from create_refinement_history
+    
+    Returns:
+        str: Refined travel plan
+    """
+    provider = get_provider(model)
+    if provider is None:
+        return "Error: Invalid model specified"
+    
+    sections, prompts = plan_refinement(original_plan, refinement_request, history)
+    if sections is None:
+        return await provider.generate(prompts)
+    
+    keys = list(prompts)
+    results = await asyncio.gather(*(provider.generate(prompts[key]) for key in keys))
+    rewritten = dict(zip(keys, results))
+    for key in keys:
+        if rewritten[key].startswith("Error"):
+            return rewritten[key]
+    
+    for section in sections:
+        if section["key"] in rewritten:
+            section["text"] = "".join(splice_section(section, [rewritten[section["key"]]]))
+    return join_plan_sections(sections)
+
+def print_stream(chunks):
+    """
+    Print streamed text to the terminal as it arrives.
+    
+    Args:
+        chunks (iterable): Pieces of text to print
+    
+    Returns:
+        str: The complete text
+    """
+    pieces = []
+    for chunk in chunks:
+        pieces.append(chunk)
+        sys.stdout.write(chunk)
+        sys.stdout.flush()
+    print()
+    return "".join(pieces)
 
 def run_cli_dialogue():
     """
@@ -160,8 +1012,12 @@ def run_cli_dialogue():
     print("=== Personal Travel Assistant ===")
     print("Let's plan your perfect trip!\n")
     
+    # Imported here because speculation builds on this module
+    from speculation import update_speculation, stream_plan
+    
     dialogue_stages = create_dialogue_stages()
     user_responses = {}
+    speculation = None
     
     # Introduction
     print(dialogue_stages[0]["prompt"])
@@ -177,16 +1033,22 @@ def run_cli_dialogue():
             user_input = input("> ")
         
         user_responses[stage["name"]] = user_input
+        # Start generating once the required answers are in, while the optional ones are collected
+        speculation = update_speculation(speculation, user_responses, list(COMPARISON_MODELS.values()))
     
     # Generate travel plans
     print("\nThank you for providing all the information! Generating your personalized travel plans...")
     
-    plans = compare_travel_plans(user_responses)
+    # Generate the Llama plan in the background while the OpenAI plan streams to the terminal
+    llama_future = fanout_executor.submit(
+        lambda: "".join(stream_plan(speculation, user_responses, "llama", hedge=False))
+    )
     
     print("\n=== Your OpenAI Travel Plan ===\n")
-    print(plans["OpenAI"])
+    plans = {"OpenAI": print_stream(stream_plan(speculation, user_responses, "openai", hedge=False))}
     
     print("\n=== Your Llama 3.2 Travel Plan ===\n")
+    plans["Llama 3.2"] = llama_future.result()
     print(plans["Llama 3.2"])
     
     # Get preference
@@ -196,19 +1058,24 @@ def run_cli_dialogue():
     selected_plan = plans["OpenAI"] if preference == "1" else plans["Llama 3.2"]
     selected_model = "openai" if preference == "1" else "llama"
     
-    # Offer refinement
+    # Offer refinement until the user is happy with the plan
+    history = create_refinement_history()
     print("\nWould you like to refine the selected plan? (yes/no)")
     refine_choice = input("> ")
     
-    if refine_choice.lower() in ["yes", "y"]:
+    while refine_choice.lower() in ["yes", "y"]:
         print("\nWhat aspects would you like to change or add to the plan?")
         refinement = input("> ")
         
         print("\nRefining your travel plan...")
-        refined_plan = refine_travel_plan(selected_plan, refinement, selected_model)
-        
         print("\n=== Your Refined Travel Plan ===\n")
-        print(refined_plan)
+        refined_plan = print_stream(stream_refined_travel_plan(selected_plan, refinement, selected_model, history))
+        if not refined_plan.startswith("Error"):
+            selected_plan = refined_plan
+            add_refinement_round(history, refinement, selected_model)
+        
+        print("\nWould you like to refine it further? (yes/no)")
+        refine_choice = input("> ")
     
     print("\nThank you for using the Personal Travel Assistant!")
 
@@ -0,0 +1,452 @@
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Canned itinerary returned when no responses file is given; {destination} and {days} are filled in
+CANNED_ITINERARY = """# {days}-Day Itinerary for {destination}
+
+## Overview
+A balanced trip mixing the highlights of {destination} with quieter local experiences.
+
+{day_sections}
+
+## Accommodation
+- **Central boutique hotel** - walkable to the main sights, about $150 per night.
+- **Budget alternative** - well-reviewed guesthouse, about $70 per night.
+
+## Dining
+- **Local market lunch** - regional specialities, about $15 per person.
+- **Family-run bistro** - seasonal dinner menu, about $40 per person.
+
+## Estimated Costs
+- Accommodation: ${lodging}
+- Food: ${food}
+- Activities and transport: ${activities}
+
+## Travel Tips
+- Buy a public transport pass on arrival.
+- Book popular museums a few days ahead.
+- Carry some cash for small shops and markets.
+"""
+
+CANNED_DAY = """## Day {number}: Exploring {destination}
+- **Morning (9:00)** - Guided walk through the historic centre, about $20.
+- **Afternoon (14:00)** - Museum visit and coffee in a local square, about $25.
+- **Evening (19:00)** - Dinner in a neighbourhood favourite, about $40."""
+
+class FakeLLMConfig:
+    """
+    Behaviour of the stand-in server: latency, token rate, errors and canned bodies.
+    """
+
+    def __init__(self, latency_dist="fixed", latency_mean=0.3, latency_jitter=0.1,
+                 tokens_per_second=50.0, error_rate_429=0.0, error_rate_500=0.0,
+                 timeout_rate=0.0, timeout_seconds=300.0, retry_after=1.0,
+                 responses=None, seed=None):
+        """
+        Args:
+            latency_dist (str): "fixed", "uniform", "normal" or "lognormal"
+            latency_mean (float): Mean seconds before the first token
+            latency_jitter (float): Spread of the latency distribution in seconds
+            tokens_per_second (float): Rate tokens are emitted after the first one
+            error_rate_429 (float): Fraction of requests answered with 429
+            error_rate_500 (float): Fraction of requests answered with 500
+            timeout_rate (float): Fraction of requests that hang without answering
+            timeout_seconds (float): How long a hanging request hangs
+            retry_after (float): Retry-After seconds sent with 429 responses
+            responses (list): Canned response bodies to cycle through
+            seed (int): Random seed for reproducible runs
+        """
+        self.latency_dist = latency_dist
+        self.latency_mean = latency_mean
+        self.latency_jitter = latency_jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate_429 = error_rate_429
+        self.error_rate_500 = error_rate_500
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        self.retry_after = retry_after
+        self.responses = responses
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._response_index = 0
+
+    def sample_latency(self):
+        """
+        Draw the time before the first token.
+
+        Returns:
+            float: Seconds
+        """
+        with self._lock:
+            if self.latency_dist == "uniform":
+                value = self.random.uniform(self.latency_mean - self.latency_jitter,
+                                            self.latency_mean + self.latency_jitter)
+            elif self.latency_dist == "normal":
+                value = self.random.gauss(self.latency_mean, self.latency_jitter)
+            elif self.latency_dist == "lognormal":
+                # Heavy right tail, like real model servers under load
+                sigma = self.latency_jitter / self.latency_mean if self.latency_mean else 0.0
+                value = self.latency_mean * self.random.lognormvariate(0, sigma)
+            else:
+                value = self.latency_mean
+        return max(0.0, value)
+
+    def sample_fault(self):
+        """
+        Decide whether this request should fail and how.
+
+        Returns:
+            str: "429", "500", "timeout" or None
+        """
+        with self._lock:
+            roll = self.random.random()
+        for fault, rate in (("429", self.error_rate_429), ("500", self.error_rate_500),
+                            ("timeout", self.timeout_rate)):
+            if roll < rate:
+                return fault
+            roll -= rate
+        return None
+
+    def response_for(self, prompt, json_mode=False):
+        """
+        Pick the canned body for a prompt.
+
+        Args:
+            prompt (str): The prompt that was sent
+            json_mode (bool): Answer with a structured itinerary as JSON
+
+        Returns:
+            str: Response text
+        """
+        if self.responses:
+            with self._lock:
+                body = self.responses[self._response_index % len(self.responses)]
+                self._response_index += 1
+            return body
+
+        destination = re.search(r"Travel Destination:\s*(.+)", prompt)
+        destination = destination.group(1).strip() if destination else "your destination"
+        # Use the upper end of ranges such as "4-7 days"
+        days = re.search(r"(\d+)(?:\s*-\s*(\d+))?\s*days?", prompt)
+        days = min(int(days.group(2) or days.group(1)), 21) if days else 3
+        if json_mode:
+            itinerary = canned_structured_itinerary(destination, days)
+            # Detail calls for an outlined trip list the days they want as "Day N: theme"
+            requested = prompt.split("for these days only:", 1)
+            if len(requested) == 2:
+                numbers = [int(n) for n in re.findall(r"^\s*Day (\d+):", requested[1], re.MULTILINE)]
+                template = itinerary["days"][0]
+                return json.dumps({"days": [dict(template, day=number) for number in numbers]})
+            if "outline" in prompt:
+                for day in itinerary["days"]:
+                    day["budget"] = sum(activity["cost"] for activity in day.pop("activities"))
+            return json.dumps(itinerary)
+        return CANNED_ITINERARY.format(
+            destination=destination,
+            days=days,
+            day_sections="\n\n".join(CANNED_DAY.format(number=n, destination=destination)
+                                     for n in range(1, days + 1)),
+            lodging=150 * days,
+            food=55 * days,
+            activities=85 * days
+        )
+
+def canned_structured_itinerary(destination, days):
+    """
+    Build the JSON counterpart of CANNED_ITINERARY for JSON-mode requests.
+
+    Args:
+        destination (str): Destination named in the prompt
+        days (int): Trip length in days
+
+    Returns:
+        dict: Outline in the layout of itinerary.TRIP_SKELETON_SCHEMA, with every day's activities
+    """
+    return {
+        "destination": destination,
+        "currency": "USD",
+        "nights": days,
+        "days": [
+            {"day": number, "title": f"Exploring {destination}", "activities": [
+                {"time": "09:00", "name": "Guided walk", "location": "Historic centre", "cost": 20,
+                 "notes": "Covers the main landmarks."},
+                {"time": "14:00", "name": "Museum visit", "location": "Museum quarter", "cost": 25,
+                 "notes": "Coffee in a local square afterwards."},
+                {"time": "19:00", "name": "Dinner", "location": "Neighbourhood favourite", "cost": 40,
+                 "notes": "Reserve ahead at weekends."}
+            ]}
+            for number in range(1, days + 1)
+        ],
+        "accommodation": [
+            {"name": "Central boutique hotel", "location": "Old town", "cost_per_night": 150,
+             "notes": "Walkable to the main sights."},
+            {"name": "Budget guesthouse", "location": "Residential area", "cost_per_night": 70,
+             "notes": "Well reviewed."}
+        ],
+        "dining": [
+            {"name": "Local market", "location": "Central market", "cuisine": "Regional", "cost": 15,
+             "notes": "Good for lunch."},
+            {"name": "Family-run bistro", "location": "Old town", "cuisine": "Seasonal", "cost": 40,
+             "notes": "Vegetarian options."}
+        ],
+        "tips": ["Buy a public transport pass on arrival.", "Book popular museums a few days ahead."]
+    }
+
+def tokenize(text):
+    """
+    Split text into word-sized tokens that concatenate back to the original.
+
+    Args:
+        text (str): Text to split
+
+    Returns:
+        list: Tokens
+    """
+    return re.findall(r"\s*\S+|\s+$", text)
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """
+    Request handler speaking the Ollama and OpenAI chat-completions protocols.
+    """
+
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        # Keep load tests quiet
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _apply_fault(self, openai_style):
+        # Returns True if the request was answered with an injected fault
+        fault = self.config.sample_fault()
+        if fault == "timeout":
+            time.sleep(self.config.timeout_seconds)
+            self.close_connection = True
+            return True
+        if fault == "429":
+            message = "Rate limit reached (injected by fake server)"
+            payload = {"error": {"message": message, "type": "rate_limit_error"}} if openai_style else {"error": message}
+            self._send_json(429, payload, {"Retry-After": str(self.config.retry_after)})
+            return True
+        if fault == "500":
+            message = "Internal server error (injected by fake server)"
+            payload = {"error": {"message": message, "type": "server_error"}} if openai_style else {"error": message}
+            self._send_json(500, payload)
+            return True
+        return False
+
+    def _emit_tokens(self, tokens, write):
+        # First token after the sampled latency, then at the configured rate
+        time.sleep(self.config.sample_latency())
+        delay = 1.0 / self.config.tokens_per_second if self.config.tokens_per_second > 0 else 0.0
+        for index, token in enumerate(tokens):
+            if index and delay:
+                time.sleep(delay)
+            write(token)
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self._send_json(200, {"models": [{"name": "llama3.2:latest"}]})
+        elif self.path == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-3.5-turbo", "object": "model"}]})
+        elif self.path.startswith("/v1/models/"):
+            self._send_json(200, {"id": self.path.rsplit("/", 1)[-1], "object": "model"})
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path == "/api/generate":
+            self._ollama_generate()
+        elif self.path in ("/v1/chat/completions", "/chat/completions"):
+            self._openai_chat()
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _ollama_generate(self):
+        request = self._read_json()
+        if self._apply_fault(openai_style=False):
+            return
+
+        model = request.get("model", "llama3.2")
+        tokens = tokenize(self.config.response_for(request.get("prompt", ""),
+                                                   json_mode=request.get("format") == "json"))
+        final = {"model": model, "response": "", "done": True, "done_reason": "stop",
+                 "prompt_eval_count": len(tokenize(request.get("prompt", ""))), "eval_count": len(tokens)}
+
+        if request.get("stream", True):
+            self._start_chunked("application/x-ndjson")
+            self._emit_tokens(tokens, lambda token: self._write_chunk(
+                (json.dumps({"model": model, "response": token, "done": False}) + "\n").encode("utf-8")
+            ))
+            self._write_chunk((json.dumps(final) + "\n").encode("utf-8"))
+            self._end_chunked()
+        else:
+            pieces = []
+            self._emit_tokens(tokens, pieces.append)
+            final["response"] = "".join(pieces)
+            self._send_json(200, final)
+
+    def _openai_chat(self):
+        request = self._read_json()
+        if self._apply_fault(openai_style=True):
+            return
+
+        model = request.get("model", "gpt-3.5-turbo")
+        prompt = "\n".join(str(message.get("content", "")) for message in request.get("messages", []))
+        json_mode = (request.get("response_format") or {}).get("type") == "json_object"
+        tokens = tokenize(self.config.response_for(prompt, json_mode=json_mode))
+        max_tokens = request.get("max_tokens")
+        finish_reason = "stop"
+        if max_tokens and len(tokens) > max_tokens:
+            tokens = tokens[:max_tokens]
+            finish_reason = "length"
+        completion_id = f"chatcmpl-fake{int(time.time() * 1000)}"
+        created = int(time.time())
+
+        if request.get("stream"):
+            def chunk(delta, reason=None):
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                           "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": reason}]}
+                self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+
+            self._start_chunked("text/event-stream")
+            chunk({"role": "assistant", "content": ""})
+            self._emit_tokens(tokens, lambda token: chunk({"content": token}))
+            chunk({}, finish_reason)
+            if (request.get("stream_options") or {}).get("include_usage"):
+                # Like the real API, usage comes in a final chunk with no choices
+                prompt_tokens = len(tokenize(prompt))
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                           "model": model, "choices": [],
+                           "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                                     "total_tokens": prompt_tokens + len(tokens)}}
+                self._write_chunk(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self._end_chunked()
+        else:
+            pieces = []
+            self._emit_tokens(tokens, pieces.append)
+            prompt_tokens = len(tokenize(prompt))
+            self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(pieces)},
+                             "finish_reason": finish_reason}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(tokens),
+                          "total_tokens": prompt_tokens + len(tokens)}
+            })
+
+class FakeLLMServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a backlog large enough for load tests.
+    """
+
+    daemon_threads = True
+    request_queue_size = 512
+
+def start_fake_server(config=None, host="127.0.0.1", port=0):
+    """
+    Start the stand-in server on a background thread.
+
+    Args:
+        config (FakeLLMConfig): Server behaviour; defaults to FakeLLMConfig()
+        host (str): Interface to bind
+        port (int): Port to bind (0 picks a free port)
+
+    Returns:
+        FakeLLMServer: The running server; its base URL is
+            f"http://{host}:{server.server_address[1]}"
+    """
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {"config": config or FakeLLMConfig()})
+    server = FakeLLMServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="fake-llm-server", daemon=True).start()
+    return server
+
+def main():
+    """
+    Run the stand-in server from the command line.
+    """
+    parser = argparse.ArgumentParser(description="Stand-in Ollama/OpenAI server for load and latency testing")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to bind")
+    parser.add_argument("--port", type=int, default=8765, help="Port to bind")
+    parser.add_argument("--latency-dist", choices=["fixed", "uniform", "normal", "lognormal"], default="fixed",
+                        help="Distribution of the time to first token")
+    parser.add_argument("--latency-mean", type=float, default=0.3, help="Mean seconds before the first token")
+    parser.add_argument("--latency-jitter", type=float, default=0.1, help="Spread of the latency distribution")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="Token emission rate")
+    parser.add_argument("--error-rate-429", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--error-rate-500", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--timeout-rate", type=float, default=0.0, help="Fraction of requests that hang")
+    parser.add_argument("--timeout-seconds", type=float, default=300.0, help="How long hanging requests hang")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--responses-file", help="JSON list of canned response bodies to cycle through")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible runs")
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses_file:
+        with open(args.responses_file, encoding="utf-8") as f:
+            responses = json.load(f)
+
+    config = FakeLLMConfig(
+        latency_dist=args.latency_dist,
+        latency_mean=args.latency_mean,
+        latency_jitter=args.latency_jitter,
+        tokens_per_second=args.tokens_per_second,
+        error_rate_429=args.error_rate_429,
+        error_rate_500=args.error_rate_500,
+        timeout_rate=args.timeout_rate,
+        timeout_seconds=args.timeout_seconds,
+        retry_after=args.retry_after,
+        responses=responses,
+        seed=args.seed
+    )
+    handler = type("ConfiguredFakeLLMHandler", (FakeLLMHandler,), {"config": config})
+    server = FakeLLMServer((args.host, args.port), handler)
+    base_url = f"http://{args.host}:{args.port}"
+    print(f"Fake LLM server listening on {base_url}")
+    print(f"  OLLAMA_BASE_URL={base_url}")
+    print(f"  OPENAI_BASE_URL={base_url}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down fake LLM server")
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,23 @@
 import streamlit as st
 import os
-import pandas as pd
-import matplotlib.pyplot as plt
 import time
-from dialogue_system import create_dialogue_stages, construct_travel_prompt, generate_travel_plan, compare_travel_plans, refine_travel_plan
+import uuid
+import queue
+import hashlib
+import functools
+import threading
+import contextvars
+from dotenv import load_dotenv
+
+# Settings in .env configure the modules imported below, so it is read first. Reruns read
+# it again, which is cheap and never overrides variables that are already set
+load_dotenv()
+
+from llm_setup import OPENAI_MAX_TOKENS
+from speculation import update_speculation, stream_plan
+from dialogue_system import create_dialogue_stages, stream_refined_travel_plan, create_refinement_history, add_refinement_round, get_destination_context, COMPARISON_MODELS, POPULAR_DESTINATIONS
+from cache_warmer import start_background_warming, WARM_MODELS
+from session_store import SessionStore, encode_state
 
 # Set up the Streamlit app
 st.set_page_config(
@@ -13,91 +27,15 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS to improve appearance
-st.markdown("""
-<style>
-    .main {
-        padding: 20px;
-    }
-    .stButton>button {
-        width: 100%;
-        border-radius: 5px;
-        font-weight: 500;
-        transition: all 0.3s ease;
-    }
-    .stButton>button:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 4px 8px rgba(0,0,0,0.1);
-    }
-    .stTextArea>div>div>textarea {
-        height: 150px;
-        border-radius: 5px;
-        border: 1px solid #ddd;
-    }
-    h1, h2, h3 {
-        color: #1E88E5;
-    }
-    .highlight {
-        background-color: #f0f7ff;
-        padding: 20px;
-        border-radius: 10px;
-        margin-bottom: 20px;
-        border-left: 5px solid #1E88E5;
-    }
-    .destination-card {
-        padding: 15px;
-        border-radius: 10px;
-        background-color: white;
-        box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-        margin-bottom: 10px;
-        cursor: pointer;
-        transition: all 0.3s ease;
-    }
-    .destination-card:hover {
-        transform: translateY(-2px);
-        box-shadow: 0 5px 15px rgba(0,0,0,0.1);
-    }
-    .card {
-        padding: 20px;
-        border-radius: 10px;
-        background-color: white;
-        box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-        margin-bottom: 15px;
-    }
-    .progress-container {
-        margin-top: 15px;
-        margin-bottom: 15px;
-    }
-    .footer {
-        margin-top: 50px;
-        text-align: center;
-        color: #666;
-        font-size: 0.8em;
-    }
-    /* Theme toggle styles */
-    .dark-mode {
-        background-color: #262730;
-        color: #f1f1f1;
-    }
-    .light-mode {
-        background-color: #ffffff;
-        color: #262730;
-    }
-    /* Animated loading */
-    @keyframes pulse {
-        0% { opacity: 0.6; }
-        50% { opacity: 1; }
-        100% { opacity: 0.6; }
-    }
-    .loading-animation {
-        animation: pulse 1.5s infinite;
-        background-color: #f0f7ff;
-        padding: 20px;
-        border-radius: 10px;
-        text-align: center;
-    }
-</style>
-""", unsafe_allow_html=True)
+# Custom CSS to improve appearance; served as a static file the browser caches, so a rerun only sends the link
+st.markdown('<link rel="stylesheet" href="app/static/style.css">', unsafe_allow_html=True)
+
+# Dialogue stages never change, so they are built once per server process
+@st.cache_resource
+def get_dialogue_stages():
+    return create_dialogue_stages()
+
+dialogue_stages = get_dialogue_stages()
 
 # Initialize session state variables
 if 'user_responses' not in st.session_state:
@@ -116,6 +54,76 @@ if 'dark_mode' not in st.session_state:
     st.session_state['dark_mode'] = False
 if 'feedback' not in st.session_state:
     st.session_state['feedback'] = {}
+if 'refinement_history' not in st.session_state:
+    st.session_state['refinement_history'] = create_refinement_history()
+if 'speculation' not in st.session_state:
+    st.session_state['speculation'] = None
+if 'full_run' not in st.session_state:
+    st.session_state['full_run'] = False
+
+# Sessions and feedback are kept in a store every server process can share
+@st.cache_resource
+def get_session_store():
+    return SessionStore.from_env()
+
+session_store = get_session_store()
+
+# Session state saved to the store after every run
+PERSISTED_FIELDS = ('user_responses', 'current_stage', 'travel_plan', 'comparison_mode', 'selected_model',
+                    'show_examples', 'dark_mode', 'feedback', 'refinement_history')
+# Large fields a shared store holds between runs instead of every live session's memory
+OFFLOADED_FIELDS = ('travel_plan', 'refinement_history')
+
+# The session id travels in the URL, so a reload, a restart or another replica resumes the session
+if 'session_id' not in st.session_state:
+    session_id = st.query_params.get("session") or uuid.uuid4().hex
+    st.query_params["session"] = session_id
+    saved = session_store.load(session_id) or {}
+    for field in PERSISTED_FIELDS:
+        if field in saved:
+            st.session_state[field] = saved[field]
+    st.session_state['session_id'] = session_id
+    st.session_state['saved_digest'] = None
+    st.session_state['offloaded'] = False
+
+# Read the offloaded fields back from the store before they are used
+def restore_session():
+    if not st.session_state['offloaded']:
+        return
+    saved = session_store.load(st.session_state['session_id']) or {}
+    st.session_state['travel_plan'] = saved.get('travel_plan')
+    st.session_state['refinement_history'] = saved.get('refinement_history') or create_refinement_history()
+    st.session_state['offloaded'] = False
+    # An expired session has lost its plan, so go back to generating one, unless one was just requested
+    if (st.session_state['travel_plan'] is None and not st.session_state.get('pending_generation')
+            and st.session_state['current_stage'] > len(dialogue_stages)):
+        st.session_state['current_stage'] = len(dialogue_stages)
+
+# Save the session if it changed, then drop the offloaded fields from memory
+def persist_session():
+    if st.session_state['offloaded']:
+        return
+    blob = encode_state({field: st.session_state[field] for field in PERSISTED_FIELDS})
+    digest = hashlib.sha256(blob).hexdigest()
+    if digest != st.session_state['saved_digest']:
+        session_store.save_encoded(st.session_state['session_id'], blob)
+        st.session_state['saved_digest'] = digest
+    if session_store.path:
+        for field in OFFLOADED_FIELDS:
+            st.session_state[field] = None
+        st.session_state['offloaded'] = True
+
+# Fragment that restores the session when it starts; on its own reruns it also saves it when done
+def session_fragment(render):
+    @st.fragment
+    @functools.wraps(render)
+    def fragment(*args, **kwargs):
+        restore_session()
+        render(*args, **kwargs)
+        # During a full run main saves the session once everything has rendered
+        if not st.session_state['full_run']:
+            persist_session()
+    return fragment
 
 # Function to move to the next stage
 def next_stage():
@@ -126,22 +134,117 @@ def prev_stage():
     if st.session_state['current_stage'] > 0:
         st.session_state['current_stage'] -= 1
 
-# Function to generate travel plan with simulated loading
+# Render one or more plan streams, with progress bars driven by the generation itself
+def render_streams(streams, expected_tokens=OPENAI_MAX_TOKENS):
+    labels = list(streams)
+    columns = st.columns(len(labels)) if len(labels) > 1 else [st.container()]
+    progress_bars, placeholders, pieces, last_render = {}, {}, {}, {}
+    
+    for label, column in zip(labels, columns):
+        with column:
+            if len(labels) > 1:
+                st.markdown(f"#### {label}")
+            progress_bars[label] = st.progress(0, text="Sending request...")
+            placeholders[label] = st.empty()
+        pieces[label] = []
+        last_render[label] = 0.0
+    
+    # Each stream is drained on its own thread, so long streams never tie up the shared
+    # fanout pool the plans' own calls run on; only this thread touches the UI
+    updates = queue.Queue()
+    
+    def pump(label, chunks):
+        try:
+            for chunk in chunks:
+                updates.put((label, chunk))
+        except Exception as e:
+            updates.put((label, f"Error: {str(e)}"))
+        finally:
+            updates.put((label, None))
+    
+    for label in labels:
+        # In a copy of this run's context so the request priority carries over
+        context = contextvars.copy_context()
+        threading.Thread(
+            target=context.run, args=(pump, label, streams[label]), name=f"stream-{label}", daemon=True
+        ).start()
+    
+    remaining = len(labels)
+    while remaining:
+        label, chunk = updates.get()
+        if chunk is None:
+            remaining -= 1
+            placeholders[label].markdown("".join(pieces[label]))
+            progress_bars[label].progress(100, text="Complete")
+            continue
+        
+        pieces[label].append(chunk)
+        received = len(pieces[label])
+        now = time.monotonic()
+        # Re-render at most every 50ms so long plans don't spend their time redrawing
+        if received == 1 or now - last_render[label] >= 0.05:
+            percent = min(95, 10 + int(85 * received / expected_tokens))
+            progress_bars[label].progress(percent, text=f"Received {received} of ~{expected_tokens} tokens")
+            placeholders[label].markdown("".join(pieces[label]))
+            last_render[label] = now
+    
+    return {label: "".join(pieces[label]) for label in labels}
+
+# Function to generate travel plan, streaming it as it is written
 def generate_plan():
     with st.spinner("Creating your personalized travel itinerary..."):
-        # Simulate processing time for better UX
-        progress_bar = st.progress(0)
-        for i in range(100):
-            time.sleep(0.02)  # Adjust for desired loading time
-            progress_bar.progress(i + 1)
-            
+        user_responses = st.session_state['user_responses']
+        # A new plan starts a new refinement conversation
+        st.session_state['refinement_history'] = create_refinement_history()
+        # Start from the plan speculatively generated while the optional questions were answered
+        speculation = st.session_state['speculation']
+        st.session_state['speculation'] = None
         if st.session_state['comparison_mode']:
-            plans = compare_travel_plans(st.session_state['user_responses'])
-            st.session_state['travel_plan'] = plans
+            st.session_state['travel_plan'] = render_streams({
+                label: stream_plan(speculation, user_responses, model, hedge=False)
+                for label, model in COMPARISON_MODELS.items()
+            })
         else:
             model = st.session_state['selected_model']
-            plan = generate_travel_plan(st.session_state['user_responses'], model)
-            st.session_state['travel_plan'] = {model: plan}
+            plans = render_streams({model: stream_plan(speculation, user_responses, model)})
+            st.session_state['travel_plan'] = plans
+
+# Refine the current plan, streaming the result
+def refine_plan(refinement):
+    history = st.session_state['refinement_history']
+    with st.spinner("Refining your travel plan..."):
+        if st.session_state['comparison_mode']:
+            # If in comparison mode, refine both plans concurrently
+            model_type = st.session_state['selected_model']
+            st.session_state['travel_plan'] = render_streams({
+                label: stream_refined_travel_plan(
+                    st.session_state['travel_plan'].get(label, ""),
+                    refinement,
+                    model,
+                    history
+                )
+                for label, model in COMPARISON_MODELS.items()
+            })
+        else:
+            # Refine only the selected plan
+            selected_model = next(iter(st.session_state['travel_plan']))
+            model_type = COMPARISON_MODELS.get(selected_model, selected_model)
+            
+            st.session_state['travel_plan'] = render_streams({
+                selected_model: stream_refined_travel_plan(
+                    st.session_state['travel_plan'][selected_model],
+                    refinement,
+                    model_type,
+                    history
+                )
+            })
+        
+        if not any(plan.startswith("Error") for plan in st.session_state['travel_plan'].values()):
+            add_refinement_round(history, refinement, model_type)
+
+# Queue a refinement for the plan view's next run
+def request_refinement():
+    st.session_state['pending_refinement'] = st.session_state['refinement_request']
 
 # Function to reset the app
 def reset_app():
@@ -150,8 +253,21 @@ def reset_app():
     st.session_state['travel_plan'] = None
     st.session_state['comparison_mode'] = False
     st.session_state['selected_model'] = "openai"
+    st.session_state['refinement_history'] = create_refinement_history()
+    if st.session_state['speculation'] is not None:
+        st.session_state['speculation'].cancel()
+        st.session_state['speculation'] = None
+    # The reset values replace the offloaded ones still in the store
+    st.session_state['offloaded'] = False
     # Keep feedback data
 
+# Keep one plan from a comparison
+def choose_plan(label, model):
+    restore_session()
+    st.session_state['travel_plan'] = {model: st.session_state['travel_plan'].get(label, "")}
+    st.session_state['comparison_mode'] = False
+    st.session_state['selected_model'] = model
+
 # Function to toggle dark mode
 def toggle_theme():
     st.session_state['dark_mode'] = not st.session_state['dark_mode']
@@ -163,6 +279,8 @@ def submit_feedback(rating, comment):
         'comment': comment,
         'timestamp': time.strftime("%Y-%m-%d %H:%M:%S")
     }
+    # Every submission is kept in the store, not just the latest
+    session_store.add_feedback(st.session_state['session_id'], st.session_state['feedback'])
     return st.success("Thank you for your feedback! We appreciate your input.")
 
 # Render destination card
@@ -176,17 +294,389 @@ def destination_card(emoji, name, description):
     return st.markdown(html, unsafe_allow_html=True)
 
 # Popular destinations with brief descriptions
-destinations = [
-    {"emoji": "🇫🇷", "name": "Paris, France", "description": "The city of lights, romance, and exquisite cuisine."},
-    {"emoji": "🇯🇵", "name": "Tokyo, Japan", "description": "A vibrant metropolis blending ultramodern and traditional."},
-    {"emoji": "🇮🇹", "name": "Rome, Italy", "description": "Ancient history and world-class art in every corner."},
-    {"emoji": "🇬🇷", "name": "Athens, Greece", "description": "The cradle of Western civilization with stunning ruins."},
-    {"emoji": "🇹🇭", "name": "Bangkok, Thailand", "description": "Vibrant street life and ornate shrines in Southeast Asia."},
-    {"emoji": "🇲🇽", "name": "Mexico City, Mexico", "description": "Rich culture, amazing food, and ancient pyramids nearby."}
-]
+destinations = POPULAR_DESTINATIONS
+
+# Warm the popular destinations into the cache once per server process, if enabled
+@st.cache_resource
+def start_cache_warming():
+    return start_background_warming(float(os.getenv("CACHE_WARM_INTERVAL", "0")))
+
+if os.getenv("CACHE_WARM_ON_STARTUP") == "1":
+    start_cache_warming()
+
+# Fill in a popular destination picked from the sidebar
+def pick_destination(name):
+    st.session_state['user_responses']['travel_destination'] = name
+    # Drop the typed answer so the form shows the pick the next time it is drawn
+    st.session_state.pop('input_travel_destination', None)
+
+# Whether the form on screen is asking for the destination
+def asking_destination():
+    stage = st.session_state['current_stage']
+    return stage < len(dialogue_stages) and dialogue_stages[stage]["name"] == "travel_destination"
+
+# Show the cached overview of a popular destination without waiting on a model call
+def destination_overview(name):
+    for model in WARM_MODELS:
+        context = get_destination_context(name, model, cached_only=True)
+        if context:
+            with st.expander(f"About {name}"):
+                st.markdown(context)
+            return
+
+# Popular destinations and the picked one's overview
+def render_destinations():
+    st.subheader("Popular Destinations")
+    
+    # More visually appealing destination selection
+    col1, col2 = st.columns(2)
+    
+    for index, destination in enumerate(destinations):
+        with (col1 if index % 2 == 0 else col2):
+            st.button(f"{destination['emoji']} {destination['name']}", help=destination['description'],
+                      on_click=pick_destination, args=(destination['name'],))
+    
+    selected_destination = st.session_state['user_responses'].get('travel_destination')
+    if selected_destination in [destination['name'] for destination in destinations]:
+        destination_overview(selected_destination)
+
+# The same, rerunning on its own when a pick only changes the overview
+render_destinations_fragment = session_fragment(render_destinations)
+
+# Sidebar: theme, popular destinations, progress and help
+def render_sidebar():
+    st.title("✈️ Travel Assistant")
+    st.markdown("---")
+    
+    # Theme toggle; callbacks run before the rerun the click triggers, so no second rerun is needed
+    theme_label = "🌙 Switch to Light Mode" if st.session_state['dark_mode'] else "🌞 Switch to Dark Mode"
+    st.button(theme_label, on_click=toggle_theme)
+    
+    st.markdown("---")
+    
+    # A pick made while the form asks for the destination has to redraw the form too
+    if asking_destination():
+        render_destinations()
+    else:
+        render_destinations_fragment()
+    
+    st.markdown("---")
+    
+    # Show current progress
+    if st.session_state['current_stage'] < len(dialogue_stages):
+        progress_percent = int((st.session_state['current_stage'] / len(dialogue_stages)) * 100)
+        st.markdown(f"### Planning Progress: {progress_percent}%")
+        st.progress(progress_percent / 100)
+    
+    # Reset button
+    st.button("🔄 Start Over", on_click=reset_app)
+    
+    # Help & FAQ accordion
+    with st.expander("❓ Help & FAQ"):
+        st.markdown("""
+        **How does this work?**
+        
+        Our Travel Assistant uses AI to create personalized travel plans based on your preferences.
+        
+        **Is my data secure?**
+        
+        Yes, we don't store your personal information permanently.
+        
+        **Can I modify my plan after it's generated?**
+        
+        Absolutely! Once your plan is generated, you can refine it with specific requests.
+        """)
+
+# Answer form for one dialogue stage; typing and toggling examples only rerun the form
+@session_fragment
+def render_stage_form(current_stage):
+    # Show input fields for other stages
+    st.markdown(f"""
+    <div class="highlight">
+        <h2>Step {st.session_state['current_stage']} of {len(dialogue_stages)-1}</h2>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    st.markdown(f"### {current_stage['prompt']}")
+    
+    # Show examples toggle with a more subtle design
+    show_examples = st.checkbox("💡 Show me examples", value=st.session_state['show_examples'])
+    st.session_state['show_examples'] = show_examples
+    
+    # Display examples if requested
+    if show_examples:
+        if current_stage["name"] == "personal_info":
+            st.info("Example: My name is Alex, I'm 32 years old, and I'll be traveling with my partner.")
+        elif current_stage["name"] == "travel_destination":
+            st.info("Example: I'd like to visit Barcelona, Spain.")
+        elif current_stage["name"] == "travel_dates":
+            st.info("Example: Planning to travel for 10 days in August 2025.")
+        elif current_stage["name"] == "budget":
+            st.info("Example: My budget is around $3000 for the entire trip excluding flights.")
+        elif current_stage["name"] == "interests":
+            st.info("Example: I'm interested in historical sites, local cuisine, and beach activities.")
+        elif current_stage["name"] == "accommodation_preference":
+            st.info("Example: I prefer boutique hotels with character, ideally in central locations.")
+        elif current_stage["name"] == "dietary_restrictions":
+            st.info("Example: I'm vegetarian and my partner has a gluten allergy.")
+        elif current_stage["name"] == "additional_info":
+            st.info("Example: We'd like to avoid tourist traps and experience authentic local culture.")
+    
+    # Get user input with a more prominent design - create a unique key for each stage to prevent input persistence
+    prev_response = st.session_state['user_responses'].get(current_stage["name"], "")
+    st.text_area("Your response:", value=prev_response, 
+                 placeholder="Type your answer here...",
+                 key=f"input_{current_stage['name']}")
+
+# Save the answer to a stage and move on, or flag it if a required answer is missing
+def submit_answer(current_stage):
+    user_input = st.session_state.get(f"input_{current_stage['name']}", "")
+    if current_stage["required"] and not user_input.strip():
+        st.session_state['answer_missing'] = True
+        return
+    st.session_state['user_responses'][current_stage["name"]] = user_input
+    # Start generating once the required answers are in, while the optional ones are collected
+    st.session_state['speculation'] = update_speculation(
+        st.session_state['speculation'], st.session_state['user_responses']
+    )
+    next_stage()
+
+# Navigation under the answer form; outside the form's fragment, since moving on changes the whole page
+def render_stage_navigation(current_stage):
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        if st.session_state['current_stage'] > 1:  # Skip back button on first non-intro stage
+            st.button("⬅️ Back", on_click=prev_stage)
+    
+    with col2:
+        st.button("Continue ➡️", on_click=submit_answer, args=(current_stage,))
+        if st.session_state.pop('answer_missing', False):
+            st.error("⚠️ This information is required to continue. Please provide a response.")
+
+# Preference summary and model choice
+@session_fragment
+def render_model_selection():
+    # Model selection phase
+    st.markdown("""
+    <div class="highlight">
+        <h2>🎯 Create Your Perfect Travel Plan</h2>
+        <p>We've collected all your preferences. Now it's time to generate your personalized travel itinerary!</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Display summary of collected information in a card format
+    st.markdown("### 📋 Your Travel Preferences")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.markdown("""
+        <div class="card">
+            <h3>Personal Details</h3>
+        """, unsafe_allow_html=True)
+        
+        if "personal_info" in st.session_state['user_responses']:
+            st.write(f"**Who**: {st.session_state['user_responses']['personal_info']}")
+        
+        if "travel_destination" in st.session_state['user_responses']:
+            st.write(f"**Destination**: {st.session_state['user_responses']['travel_destination']}")
+        
+        if "travel_dates" in st.session_state['user_responses']:
+            st.write(f"**When**: {st.session_state['user_responses']['travel_dates']}")
+        
+        if "budget" in st.session_state['user_responses']:
+            st.write(f"**Budget**: {st.session_state['user_responses']['budget']}")
+        
+        st.markdown("</div>", unsafe_allow_html=True)
+    
+    with col2:
+        st.markdown("""
+        <div class="card">
+            <h3>Preferences</h3>
+        """, unsafe_allow_html=True)
+        
+        if "interests" in st.session_state['user_responses']:
+            st.write(f"**Interests**: {st.session_state['user_responses']['interests']}")
+        
+        if "accommodation_preference" in st.session_state['user_responses']:
+            st.write(f"**Accommodation**: {st.session_state['user_responses']['accommodation_preference']}")
+        
+        if "dietary_restrictions" in st.session_state['user_responses']:
+            st.write(f"**Dietary Needs**: {st.session_state['user_responses']['dietary_restrictions']}")
+        
+        if "additional_info" in st.session_state['user_responses']:
+            st.write(f"**Additional Info**: {st.session_state['user_responses']['additional_info']}")
+        
+        st.markdown("</div>", unsafe_allow_html=True)
+    
+    st.markdown("---")
+    
+    # Model selection options with more information
+    st.markdown("""
+    <div class="card">
+        <h3>🤖 Choose Your AI Travel Planner</h3>
+        <p>Select which AI model will create your travel plan. Each has different strengths!</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    comparison = st.checkbox("🔍 Compare both AI models side by side", value=False, 
+                           help="Generate plans from both models to compare approaches")
+    st.session_state['comparison_mode'] = comparison
+    
+    if not comparison:
+        model = st.radio("Select a model for your travel plan:", 
+                        ["OpenAI (More concise)", "Llama (More detailed)", "Auto (Fastest right now)"],
+                        captions=["Generates shorter, focused plans with key highlights", 
+                                "Creates detailed, comprehensive itineraries with more suggestions",
+                                "Uses whichever model can answer soonest under the current load"])
+        
+        st.session_state['selected_model'] = "openai" if "OpenAI" in model else "llama" if "Llama" in model else "auto"
+
+# Queue the plan for the plan view, which streams it in as it is written
+def request_plan():
+    st.session_state['pending_generation'] = True
+    next_stage()
+
+# Generated plan with refinement, export and feedback
+@session_fragment
+def render_plan_view():
+    # Display travel plan phase with enhanced presentation
+    st.markdown("""
+    <div class="highlight">
+        <h2>🎉 Your Personalized Travel Plan</h2>
+        <p>Here's your custom travel itinerary based on your preferences!</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # A plan requested by the last click streams in here, then the plan below shows the result
+    if st.session_state.pop('pending_generation', False):
+        progress = st.empty()
+        with progress.container():
+            generate_plan()
+        progress.empty()
+    
+    # Likewise for a refinement
+    refinement = st.session_state.pop('pending_refinement', None)
+    if refinement:
+        progress = st.empty()
+        with progress.container():
+            refine_plan(refinement)
+        progress.empty()
+    
+    if st.session_state['comparison_mode']:
+        # Show comparison tabs with enhanced design
+        st.markdown("### Compare AI-Generated Travel Plans")
+        st.write("Review both plans and choose the one you prefer.")
+        
+        tab1, tab2 = st.tabs(["📝 OpenAI Plan", "📋 Llama Plan"])
+        
+        with tab1:
+            st.markdown("""
+            <div class="card">
+                <h3>OpenAI-Generated Plan</h3>
+            </div>
+            """, unsafe_allow_html=True)
+            
+            st.markdown(st.session_state['travel_plan'].get("OpenAI", "Plan not available"))
+            st.button("✅ Choose OpenAI Plan", on_click=choose_plan, args=("OpenAI", "openai"))
+        
+        with tab2:
+            st.markdown("""
+            <div class="card">
+                <h3>Llama-Generated Plan</h3>
+            </div>
+            """, unsafe_allow_html=True)
+            
+            st.markdown(st.session_state['travel_plan'].get("Llama 3.2", "Plan not available"))
+            st.button("✅ Choose Llama Plan", on_click=choose_plan, args=("Llama 3.2", "llama"))
+    
+    else:
+        # Show selected plan with better formatting
+        selected_model = next(iter(st.session_state['travel_plan']))
+        plan_text = st.session_state['travel_plan'][selected_model]
+        
+        st.markdown("""
+        <div class="card">
+            <h3>Your Custom Travel Itinerary</h3>
+        </div>
+        """, unsafe_allow_html=True)
+        
+        st.markdown(plan_text)
+        
+        # Export options with more choices
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            st.download_button(
+                label="📄 Export Plan as Text",
+                data=plan_text,
+                file_name="travel_plan.txt",
+                mime="text/plain"
+            )
+        
+        with col2:
+            # Export as formatted PDF (this would require additional backend implementation)
+            st.button("📊 Export as PDF", disabled=True, help="PDF export coming soon!")
+    
+    # Refinement options with better guidance
+    st.markdown("---")
+    st.markdown("""
+    <div class="card">
+        <h3>✏️ Refine Your Plan</h3>
+        <p>Want to adjust something? Tell us what you'd like to change, and we'll update your plan.</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Earlier rounds are carried into every refinement so they are not undone
+    history = st.session_state['refinement_history']
+    if history['summary'] or history['rounds']:
+        with st.expander("Refinements so far"):
+            if history['summary']:
+                st.write(f"**Earlier:** {history['summary']}")
+            for request in history['rounds']:
+                st.write(f"- {request}")
+    
+    st.text_area("What would you like to change or add to your plan?", key="refinement_request",
+                 placeholder="Examples:\n- Add more family-friendly activities\n- Include budget dining options\n- Add a day trip to a nearby city\n- Focus more on outdoor activities\n- Include local transportation options")
+    
+    st.button("🔄 Refine My Plan", on_click=request_refinement)
+    
+    # Feedback section
+    st.markdown("---")
+    st.markdown("""
+    <div class="card">
+        <h3>💬 Share Your Feedback</h3>
+        <p>How was your experience? Your feedback helps us improve!</p>
+    </div>
+    """, unsafe_allow_html=True)
+    
+    col1, col2 = st.columns([1, 2])
+    
+    with col1:
+        rating = st.slider("Rate your experience:", 1, 5, 5)
+    
+    with col2:
+        feedback_text = st.text_input("Comments or suggestions:", 
+                                   placeholder="Tell us what you liked or how we can improve...")
+    
+    if st.button("📤 Submit Feedback"):
+        submit_feedback(rating, feedback_text)
+    
+    # Display feedback success message if submitted
+    if 'feedback' in st.session_state and st.session_state['feedback']:
+        st.success("Thank you for your feedback! We appreciate your input.")
+
+# Start over, under the plan view; outside its fragment, since it changes the whole page
+def render_new_trip_button():
+    st.markdown("---")
+    st.button("🔄 Create A New Trip Plan", on_click=reset_app)
 
 # Main app
 def main():
+    st.session_state['full_run'] = True
+    restore_session()
+    
     # Apply theme if dark mode is enabled
     if st.session_state['dark_mode']:
         st.markdown("""
@@ -204,78 +694,11 @@ def main():
     
     # Sidebar
     with st.sidebar:
-        st.title("✈️ Travel Assistant")
-        st.markdown("---")
-        
-        # Theme toggle
-        theme_label = "🌙 Switch to Light Mode" if st.session_state['dark_mode'] else "🌞 Switch to Dark Mode"
-        if st.button(theme_label):
-            toggle_theme()
-            st.experimental_rerun()
-        
-        st.markdown("---")
-        
-        # Popular Destinations section
-        st.subheader("Popular Destinations")
-        
-        # More visually appealing destination selection
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            if st.button(f"{destinations[0]['emoji']} {destinations[0]['name']}", help=destinations[0]['description']):
-                st.session_state['user_responses']['travel_destination'] = destinations[0]['name']
-            
-            if st.button(f"{destinations[2]['emoji']} {destinations[2]['name']}", help=destinations[2]['description']):
-                st.session_state['user_responses']['travel_destination'] = destinations[2]['name']
-            
-            if st.button(f"{destinations[4]['emoji']} {destinations[4]['name']}", help=destinations[4]['description']):
-                st.session_state['user_responses']['travel_destination'] = destinations[4]['name']
-        
-        with col2:
-            if st.button(f"{destinations[1]['emoji']} {destinations[1]['name']}", help=destinations[1]['description']):
-                st.session_state['user_responses']['travel_destination'] = destinations[1]['name']
-            
-            if st.button(f"{destinations[3]['emoji']} {destinations[3]['name']}", help=destinations[3]['description']):
-                st.session_state['user_responses']['travel_destination'] = destinations[3]['name']
-            
-            if st.button(f"{destinations[5]['emoji']} {destinations[5]['name']}", help=destinations[5]['description']):
-                st.session_state['user_responses']['travel_destination'] = destinations[5]['name']
-        
-        st.markdown("---")
-        
-        # Show current progress
-        if st.session_state['current_stage'] < len(create_dialogue_stages()):
-            progress_percent = int((st.session_state['current_stage'] / len(create_dialogue_stages())) * 100)
-            st.markdown(f"### Planning Progress: {progress_percent}%")
-            st.progress(progress_percent / 100)
-        
-        # Reset button
-        if st.button("🔄 Start Over"):
-            reset_app()
-            st.experimental_rerun()
-        
-        # Help & FAQ accordion
-        with st.expander("❓ Help & FAQ"):
-            st.markdown("""
-            **How does this work?**
-            
-            Our Travel Assistant uses AI to create personalized travel plans based on your preferences.
-            
-            **Is my data secure?**
-            
-            Yes, we don't store your personal information permanently.
-            
-            **Can I modify my plan after it's generated?**
-            
-            Absolutely! Once your plan is generated, you can refine it with specific requests.
-            """)
-
+        render_sidebar()
+    
     # Main content
     st.title("🌍 Personal Travel Assistant")
     
-    # Get dialogue stages
-    dialogue_stages = create_dialogue_stages()
-    
     # Display appropriate content based on current stage
     if st.session_state['current_stage'] < len(dialogue_stages):
         # Collection phase
@@ -318,305 +741,21 @@ def main():
                 </div>
                 """, unsafe_allow_html=True)
             
-            if st.button("🚀 Let's Get Started!"):
-                next_stage()
-                st.experimental_rerun()
+            # Callbacks run before the rerun the click triggers, so no second rerun is needed
+            st.button("🚀 Let's Get Started!", on_click=next_stage)
         
         else:
-            # Show input fields for other stages
-            st.markdown(f"""
-            <div class="highlight">
-                <h2>Step {st.session_state['current_stage']} of {len(dialogue_stages)-1}</h2>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown(f"### {current_stage['prompt']}")
-            
-            # Show examples toggle with a more subtle design
-            show_examples = st.checkbox("💡 Show me examples", value=st.session_state['show_examples'])
-            st.session_state['show_examples'] = show_examples
-            
-            # Display examples if requested
-            if show_examples:
-                if current_stage["name"] == "personal_info":
-                    st.info("Example: My name is Alex, I'm 32 years old, and I'll be traveling with my partner.")
-                elif current_stage["name"] == "travel_destination":
-                    st.info("Example: I'd like to visit Barcelona, Spain.")
-                elif current_stage["name"] == "travel_dates":
-                    st.info("Example: Planning to travel for 10 days in August 2025.")
-                elif current_stage["name"] == "budget":
-                    st.info("Example: My budget is around $3000 for the entire trip excluding flights.")
-                elif current_stage["name"] == "interests":
-                    st.info("Example: I'm interested in historical sites, local cuisine, and beach activities.")
-                elif current_stage["name"] == "accommodation_preference":
-                    st.info("Example: I prefer boutique hotels with character, ideally in central locations.")
-                elif current_stage["name"] == "dietary_restrictions":
-                    st.info("Example: I'm vegetarian and my partner has a gluten allergy.")
-                elif current_stage["name"] == "additional_info":
-                    st.info("Example: We'd like to avoid tourist traps and experience authentic local culture.")
-            
-            # Get user input with a more prominent design - create a unique key for each stage to prevent input persistence
-            prev_response = st.session_state['user_responses'].get(current_stage["name"], "")
-            user_input = st.text_area("Your response:", value=prev_response, 
-                                     placeholder="Type your answer here...",
-                                     key=f"input_{current_stage['name']}")
-            
-            # Navigation buttons with improved styling
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                if st.session_state['current_stage'] > 1:  # Skip back button on first non-intro stage
-                    if st.button("⬅️ Back"):
-                        prev_stage()
-                        st.experimental_rerun()
-            
-            with col2:
-                continue_button = st.button("Continue ➡️")
-                if continue_button:
-                    if current_stage["required"] and not user_input.strip():
-                        st.error("⚠️ This information is required to continue. Please provide a response.")
-                    else:
-                        st.session_state['user_responses'][current_stage["name"]] = user_input
-                        next_stage()
-                        st.experimental_rerun()
+            render_stage_form(current_stage)
+            render_stage_navigation(current_stage)
     
     elif st.session_state['current_stage'] == len(dialogue_stages):
-        # Model selection phase
-        st.markdown("""
-        <div class="highlight">
-            <h2>🎯 Create Your Perfect Travel Plan</h2>
-            <p>We've collected all your preferences. Now it's time to generate your personalized travel itinerary!</p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        # Display summary of collected information in a card format
-        st.markdown("### 📋 Your Travel Preferences")
-        
-        col1, col2 = st.columns(2)
-        
-        with col1:
-            st.markdown("""
-            <div class="card">
-                <h3>Personal Details</h3>
-            """, unsafe_allow_html=True)
-            
-            if "personal_info" in st.session_state['user_responses']:
-                st.write(f"**Who**: {st.session_state['user_responses']['personal_info']}")
-            
-            if "travel_destination" in st.session_state['user_responses']:
-                st.write(f"**Destination**: {st.session_state['user_responses']['travel_destination']}")
-            
-            if "travel_dates" in st.session_state['user_responses']:
-                st.write(f"**When**: {st.session_state['user_responses']['travel_dates']}")
-            
-            if "budget" in st.session_state['user_responses']:
-                st.write(f"**Budget**: {st.session_state['user_responses']['budget']}")
-            
-            st.markdown("</div>", unsafe_allow_html=True)
-        
-        with col2:
-            st.markdown("""
-            <div class="card">
-                <h3>Preferences</h3>
-            """, unsafe_allow_html=True)
-            
-            if "interests" in st.session_state['user_responses']:
-                st.write(f"**Interests**: {st.session_state['user_responses']['interests']}")
-            
-            if "accommodation_preference" in st.session_state['user_responses']:
-                st.write(f"**Accommodation**: {st.session_state['user_responses']['accommodation_preference']}")
-            
-            if "dietary_restrictions" in st.session_state['user_responses']:
-                st.write(f"**Dietary Needs**: {st.session_state['user_responses']['dietary_restrictions']}")
-            
-            if "additional_info" in st.session_state['user_responses']:
-                st.write(f"**Additional Info**: {st.session_state['user_responses']['additional_info']}")
-            
-            st.markdown("</div>", unsafe_allow_html=True)
-        
-        st.markdown("---")
-        
-        # Model selection options with more information
-        st.markdown("""
-        <div class="card">
-            <h3>🤖 Choose Your AI Travel Planner</h3>
-            <p>Select which AI model will create your travel plan. Each has different strengths!</p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        comparison = st.checkbox("🔍 Compare both AI models side by side", value=False, 
-                               help="Generate plans from both models to compare approaches")
-        st.session_state['comparison_mode'] = comparison
-        
-        if not comparison:
-            model = st.radio("Select a model for your travel plan:", 
-                            ["OpenAI (More concise)", "Llama (More detailed)"],
-                            captions=["Generates shorter, focused plans with key highlights", 
-                                    "Creates detailed, comprehensive itineraries with more suggestions"])
-            
-            st.session_state['selected_model'] = "openai" if "OpenAI" in model else "llama"
-        
+        render_model_selection()
         # Generate plan button with animation
-        if st.button("✨ Generate My Travel Plan"):
-            generate_plan()
-            next_stage()
-            st.experimental_rerun()
+        st.button("✨ Generate My Travel Plan", on_click=request_plan)
     
     else:
-        # Display travel plan phase with enhanced presentation
-        st.markdown("""
-        <div class="highlight">
-            <h2>🎉 Your Personalized Travel Plan</h2>
-            <p>Here's your custom travel itinerary based on your preferences!</p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        if st.session_state['comparison_mode']:
-            # Show comparison tabs with enhanced design
-            st.markdown("### Compare AI-Generated Travel Plans")
-            st.write("Review both plans and choose the one you prefer.")
-            
-            tab1, tab2 = st.tabs(["📝 OpenAI Plan", "📋 Llama Plan"])
-            
-            with tab1:
-                st.markdown("""
-                <div class="card">
-                    <h3>OpenAI-Generated Plan</h3>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                st.markdown(st.session_state['travel_plan'].get("OpenAI", "Plan not available"))
-                if st.button("✅ Choose OpenAI Plan"):
-                    st.session_state['travel_plan'] = {"openai": st.session_state['travel_plan'].get("OpenAI", "")}
-                    st.session_state['comparison_mode'] = False
-                    st.session_state['selected_model'] = "openai"
-                    st.experimental_rerun()
-            
-            with tab2:
-                st.markdown("""
-                <div class="card">
-                    <h3>Llama-Generated Plan</h3>
-                </div>
-                """, unsafe_allow_html=True)
-                
-                st.markdown(st.session_state['travel_plan'].get("Llama 3.2", "Plan not available"))
-                if st.button("✅ Choose Llama Plan"):
-                    st.session_state['travel_plan'] = {"llama": st.session_state['travel_plan'].get("Llama 3.2", "")}
-                    st.session_state['comparison_mode'] = False
-                    st.session_state['selected_model'] = "llama"
-                    st.experimental_rerun()
-        
-        else:
-            # Show selected plan with better formatting
-            selected_model = next(iter(st.session_state['travel_plan']))
-            plan_text = st.session_state['travel_plan'][selected_model]
-            
-            st.markdown("""
-            <div class="card">
-                <h3>Your Custom Travel Itinerary</h3>
-            </div>
-            """, unsafe_allow_html=True)
-            
-            st.markdown(plan_text)
-            
-            # Export options with more choices
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                st.download_button(
-                    label="📄 Export Plan as Text",
-                    data=plan_text,
-                    file_name="travel_plan.txt",
-                    mime="text/plain"
-                )
-            
-            with col2:
-                # Export as formatted PDF (this would require additional backend implementation)
-                st.button("📊 Export as PDF", disabled=True, help="PDF export coming soon!")
-        
-        # Refinement options with better guidance
-        st.markdown("---")
-        st.markdown("""
-        <div class="card">
-            <h3>✏️ Refine Your Plan</h3>
-            <p>Want to adjust something? Tell us what you'd like to change, and we'll update your plan.</p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        refinement = st.text_area("What would you like to change or add to your plan?", 
-                                placeholder="Examples:\n- Add more family-friendly activities\n- Include budget dining options\n- Add a day trip to a nearby city\n- Focus more on outdoor activities\n- Include local transportation options")
-        
-        if st.button("🔄 Refine My Plan"):
-            with st.spinner("Refining your travel plan..."):
-                # Simulate processing with progress bar
-                progress_bar = st.progress(0)
-                for i in range(100):
-                    time.sleep(0.01)
-                    progress_bar.progress(i + 1)
-                
-                if st.session_state['comparison_mode']:
-                    # If in comparison mode, refine both plans
-                    refined_openai = refine_travel_plan(
-                        st.session_state['travel_plan'].get("OpenAI", ""),
-                        refinement,
-                        "openai"
-                    )
-                    
-                    refined_llama = refine_travel_plan(
-                        st.session_state['travel_plan'].get("Llama 3.2", ""),
-                        refinement,
-                        "llama"
-                    )
-                    
-                    st.session_state['travel_plan'] = {
-                        "OpenAI": refined_openai,
-                        "Llama 3.2": refined_llama
-                    }
-                else:
-                    # Refine only the selected plan
-                    selected_model = next(iter(st.session_state['travel_plan']))
-                    model_type = "openai" if selected_model == "openai" or selected_model == "OpenAI" else "llama"
-                    
-                    refined_plan = refine_travel_plan(
-                        st.session_state['travel_plan'][selected_model],
-                        refinement,
-                        model_type
-                    )
-                    
-                    st.session_state['travel_plan'] = {selected_model: refined_plan}
-                
-            st.experimental_rerun()
-        
-        # Feedback section
-        st.markdown("---")
-        st.markdown("""
-        <div class="card">
-            <h3>💬 Share Your Feedback</h3>
-            <p>How was your experience? Your feedback helps us improve!</p>
-        </div>
-        """, unsafe_allow_html=True)
-        
-        col1, col2 = st.columns([1, 2])
-        
-        with col1:
-            rating = st.slider("Rate your experience:", 1, 5, 5)
-        
-        with col2:
-            feedback_text = st.text_input("Comments or suggestions:", 
-                                       placeholder="Tell us what you liked or how we can improve...")
-        
-        if st.button("📤 Submit Feedback"):
-            submit_feedback(rating, feedback_text)
-        
-        # Display feedback success message if submitted
-        if 'feedback' in st.session_state and st.session_state['feedback']:
-            st.success("Thank you for your feedback! We appreciate your input.")
-        
-        # Start over button
-        st.markdown("---")
-        if st.button("🔄 Create A New Trip Plan"):
-            reset_app()
-            st.experimental_rerun()
+        render_plan_view()
+        render_new_trip_button()
     
     # Footer
     st.markdown("""
@@ -624,6 +763,9 @@ def main():
         <p>© 2025 Personal Travel Assistant | Built with Streamlit | COMP8420 Assignment</p>
     </div>
     """, unsafe_allow_html=True)
+    
+    persist_session()
+    st.session_state['full_run'] = False
 
 # Run the Streamlit app
 if __name__ == "__main__":
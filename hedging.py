@@ -0,0 +1,318 @@
+import os
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from single_flight import AbortScope, abort_scope
+
+# Percentile of a backend's recent first-token latency after which the next backend is asked as well
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+# First-token timings a backend needs before its percentile is trusted; until then HEDGE_DEFAULT_DELAY is used
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "5"))
+# Shortest hedge delay, so a backend that is usually fast isn't hedged on every small hiccup
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+# Set to 1 to always wait for the chosen backend
+HEDGE_DISABLED = os.getenv("HEDGE_DISABLED", "").lower() in ("1", "true", "yes")
+# Threads shared by every hedged request; each running candidate holds one until it ends or is dropped
+HEDGE_WORKERS = int(os.getenv("HEDGE_WORKERS", "32"))
+hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="hedge")
+
+class LatencyTracker:
+    """
+    Rolling window of recent first-token latencies per backend.
+    """
+
+    def __init__(self, window=200):
+        """
+        Args:
+            window (int): Timings kept per backend
+        """
+        self.window = window
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        """
+        Record how long a backend took to produce its first token.
+
+        Args:
+            name (str): Backend name
+            seconds (float): Time to first token
+        """
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+
+    def percentile(self, name, percentile, min_samples=1):
+        """
+        Return a percentile of a backend's recent first-token latency.
+
+        Args:
+            name (str): Backend name
+            percentile (float): Percentile between 0 and 100
+            min_samples (int): Timings required before answering
+
+        Returns:
+            float: Latency in seconds, or None with fewer than min_samples timings
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(name, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(round(percentile / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def hedge_delay(self, name):
+        """
+        Seconds to wait for a backend's first token before hedging to another one.
+
+        Args:
+            name (str): Backend name
+
+        Returns:
+            float: The backend's HEDGE_PERCENTILE first-token latency, at least
+                HEDGE_MIN_DELAY, or HEDGE_DEFAULT_DELAY while there are too few timings
+        """
+        latency = self.percentile(name, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+        return HEDGE_DEFAULT_DELAY if latency is None else max(HEDGE_MIN_DELAY, latency)
+
+    def stats(self):
+        """
+        Report the median and tail first-token latency of every backend.
+
+        Returns:
+            dict: Samples, p50, p95 and p99 in seconds per backend
+        """
+        with self._lock:
+            names = list(self._samples)
+        return {
+            name: {
+                "samples": len(self._samples[name]),
+                "p50": self.percentile(name, 50),
+                "p95": self.percentile(name, 95),
+                "p99": self.percentile(name, 99)
+            }
+            for name in names
+        }
+
+class CircuitBreaker:
+    """
+    Stops routing requests to a backend that keeps failing.
+
+    After failure_threshold consecutive failures the circuit opens and the
+    backend is skipped. Once cooldown seconds have passed a single request
+    is let through as a probe: a success closes the circuit, another failure
+    keeps it open for a further cooldown.
+    """
+
+    def __init__(self, failure_threshold=3, cooldown=30.0):
+        """
+        Args:
+            failure_threshold (int): Consecutive failures that open the circuit
+            cooldown (float): Seconds the circuit stays open before a probe
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+        self.trips = 0
+
+    @classmethod
+    def from_env(cls, prefix):
+        """
+        Build a breaker from <prefix>_CIRCUIT_FAILURES and <prefix>_CIRCUIT_COOLDOWN.
+
+        Args:
+            prefix (str): Environment variable prefix, e.g. "OPENAI"
+
+        Returns:
+            CircuitBreaker: The configured breaker
+        """
+        return cls(
+            failure_threshold=int(os.getenv(f"{prefix}_CIRCUIT_FAILURES", "3")),
+            cooldown=float(os.getenv(f"{prefix}_CIRCUIT_COOLDOWN", "30"))
+        )
+
+    def allow(self):
+        """
+        Check whether a request may be sent to the backend.
+
+        Returns:
+            bool: False while the circuit is open; True when closed, or for
+                the one probe let through after each cooldown
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.cooldown:
+                return False
+            # Let this request probe the backend; the rest wait for the next cooldown
+            self._opened_at = now
+            return True
+
+    def is_open(self):
+        """
+        Check whether the backend is being skipped, without using up a probe.
+
+        Returns:
+            bool: True while the circuit is open and its cooldown hasn't passed
+        """
+        with self._lock:
+            return self._opened_at is not None and time.monotonic() - self._opened_at < self.cooldown
+
+    def record_success(self):
+        """
+        Close the circuit after a successful response.
+        """
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        """
+        Count a failed response, opening the circuit at the threshold.
+        """
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    self.trips += 1
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        """
+        Report the breaker's state.
+
+        Returns:
+            dict: Whether the circuit is open, consecutive failures and times it opened
+        """
+        with self._lock:
+            return {"open": self._opened_at is not None, "failures": self._failures, "trips": self.trips}
+
+def _pump(name, chunks, events, stop, scope):
+    # Feed a candidate's chunks to the shared queue until it ends or is told to stop
+    try:
+        with abort_scope(scope):
+            for chunk in chunks:
+                if stop.is_set():
+                    break
+                events.put((name, "chunk", chunk))
+    except Exception as e:
+        events.put((name, "error", e))
+        return
+    finally:
+        # Closing a generator stops the request behind it
+        if hasattr(chunks, "close"):
+            chunks.close()
+    events.put((name, "end", None))
+
+def hedged_stream(candidates, delay, allow=None):
+    """
+    Stream from the first candidate, asking the next one too if it is slow or fails.
+
+    If the current candidate hasn't produced a first chunk within delay
+    seconds, the next candidate is started alongside it. A candidate whose
+    first chunk is an error hands over to the next one straight away. The
+    first candidate to produce a real first chunk wins and is streamed to
+    the end; the others are told to stop and their requests are dropped at
+    once, closing any response they are still waiting on.
+
+    Args:
+        candidates (list): (name, factory) tuples in order of preference, where
+            factory(stop) returns the candidate's chunks; stop is a
+            threading.Event set once the candidate has lost or failed, so
+            it can abandon work it hasn't started yet
+        delay (float): Seconds to wait for a first chunk before hedging, or
+            None to only move on after an error
+        allow (callable): Optional check taking a candidate name; candidates
+            it rejects (e.g. with an open circuit) are skipped
+
+    Yields:
+        str: The winning candidate's chunks, or the most preferred candidate's
+            error if every candidate failed
+    """
+    events = queue.Queue()
+    pending = list(candidates)
+    stops = {}
+    scopes = {}
+    errors = {}
+
+    def start_next():
+        while pending:
+            name, factory = pending.pop(0)
+            if allow is not None and not allow(name):
+                print(f"Skipping {name}: its circuit is open")
+                continue
+            stops[name] = threading.Event()
+            scopes[name] = AbortScope()
+            # Each candidate runs in a copy of the caller's context so its request priority carries over
+            context = contextvars.copy_context()
+            hedge_executor.submit(context.run, _pump, name, factory(stops[name]), events, stops[name], scopes[name])
+            return True
+        return False
+
+    def drop(name):
+        stops[name].set()
+        scopes[name].abort()
+
+    if not start_next():
+        # Every circuit is open; try the preferred candidate anyway rather than fail outright
+        pending = list(candidates[:1])
+        allow = None
+        start_next()
+
+    winner = None
+    running = 1
+    failed = set()
+    try:
+        while winner is None:
+            try:
+                name, kind, value = events.get(timeout=delay if pending else None)
+            except queue.Empty:
+                print(f"No first token after {delay:.2f}s, hedging to {pending[0][0]}")
+                running += start_next()
+                continue
+            if name in failed:
+                continue
+            if kind == "chunk" and not value.startswith("Error"):
+                winner, first = name, value
+                break
+            # Failed before its first chunk: stop waiting for it and hand over to the next candidate
+            if kind == "chunk":
+                errors[name] = value
+            elif kind == "error":
+                errors[name] = f"Error: {str(value)}"
+            else:
+                errors[name] = f"Error: {name} returned an empty response"
+            print(f"{name} failed before its first token: {errors[name][:200]}")
+            failed.add(name)
+            drop(name)
+            running -= 1
+            if start_next():
+                running += 1
+            elif running == 0:
+                # Report the most preferred candidate's error
+                yield next(errors[name] for name, _ in candidates if name in errors)
+                return
+
+        for name in stops:
+            if name != winner:
+                drop(name)
+        yield first
+        while True:
+            name, kind, value = events.get()
+            if name != winner:
+                continue
+            if kind == "chunk":
+                yield value
+            elif kind == "error":
+                raise value
+            else:
+                return
+    finally:
+        for name in stops:
+            drop(name)
@@ -0,0 +1,390 @@
+import re
+import json
+from dataclasses import dataclass
+
+# Layout of the outline of a long trip, whose days are then detailed separately
+TRIP_SKELETON_SCHEMA = """{
+  "destination": "City, Country",
+  "currency": "USD",
+  "nights": 13,
+  "days": [{"day": 1, "title": "Short theme of the day", "area": "Neighbourhood or nearby town", "budget": 60}],
+  "accommodation": [{"name": "Hotel", "location": "Area", "cost_per_night": 150, "notes": "Why it fits"}],
+  "dining": [{"name": "Restaurant", "location": "Area", "cuisine": "Local", "cost": 40, "notes": "Dietary fit"}],
+  "tips": ["Practical tip"]
+}"""
+
+# Layout of the activities for a few days of an outlined trip
+DAY_DETAILS_SCHEMA = """{"days": [{"day": 1, "title": "Theme", "activities": [{"time": "09:00", "name": "Activity", "location": "Place", "cost": 20, "notes": "One short sentence"}]}]}"""
+
+COST_PATTERN = re.compile(r"\d[\d,]*(?:\.\d+)?")
+
+def parse_cost(value):
+    """
+    Read an estimated cost the model may have written as a number or as text.
+
+    Args:
+        value: A number, or text such as "$25", "20-30 EUR" or "Free"
+
+    Returns:
+        float: The cost (the midpoint for a range), or 0.0 when none is given
+    """
+    if isinstance(value, bool) or value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    amounts = [float(match.replace(",", "")) for match in COST_PATTERN.findall(str(value))]
+    if not amounts:
+        return 0.0
+    return (amounts[0] + amounts[1]) / 2 if len(amounts) > 1 else amounts[0]
+
+def format_cost(amount, currency):
+    """
+    Format a cost for display.
+
+    Args:
+        amount (float): The cost
+        currency (str): ISO currency code
+
+    Returns:
+        str: e.g. "$1,050" or "1,050 EUR"
+    """
+    rounded = f"{amount:,.0f}" if amount == int(amount) else f"{amount:,.2f}"
+    return f"${rounded}" if currency in ("USD", "$", "") else f"{rounded} {currency}"
+
+@dataclass
+class Activity:
+    """
+    One scheduled activity.
+    """
+
+    __slots__ = ("time", "name", "location", "cost", "notes")
+    time: str
+    name: str
+    location: str
+    cost: float
+    notes: str
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            time=str(data.get("time") or ""),
+            name=str(data.get("name") or data.get("activity") or ""),
+            location=str(data.get("location") or ""),
+            cost=parse_cost(data.get("cost")),
+            notes=str(data.get("notes") or data.get("description") or "")
+        )
+
+    def to_dict(self):
+        return {"time": self.time, "name": self.name, "location": self.location,
+                "cost": self.cost, "notes": self.notes}
+
+@dataclass
+class Day:
+    """
+    One day of the itinerary and its activities in order.
+    """
+
+    __slots__ = ("number", "title", "activities")
+    number: int
+    title: str
+    activities: list
+
+    @classmethod
+    def from_dict(cls, data, default_number):
+        try:
+            number = int(data.get("day") or default_number)
+        except (TypeError, ValueError):
+            number = default_number
+        return cls(
+            number=number,
+            title=str(data.get("title") or ""),
+            activities=[Activity.from_dict(entry) for entry in data.get("activities") or []
+                        if isinstance(entry, dict)]
+        )
+
+    def to_dict(self):
+        return {"day": self.number, "title": self.title,
+                "activities": [activity.to_dict() for activity in self.activities]}
+
+    def cost(self):
+        """
+        Add up the day's activity costs.
+
+        Returns:
+            float: Sum of the day's activity costs
+        """
+        return sum(activity.cost for activity in self.activities)
+
+@dataclass
+class Accommodation:
+    """
+    A recommended place to stay.
+    """
+
+    __slots__ = ("name", "location", "cost_per_night", "notes")
+    name: str
+    location: str
+    cost_per_night: float
+    notes: str
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=str(data.get("name") or ""),
+            location=str(data.get("location") or ""),
+            cost_per_night=parse_cost(data.get("cost_per_night", data.get("cost"))),
+            notes=str(data.get("notes") or "")
+        )
+
+    def to_dict(self):
+        return {"name": self.name, "location": self.location,
+                "cost_per_night": self.cost_per_night, "notes": self.notes}
+
+@dataclass
+class DiningOption:
+    """
+    A recommended restaurant, market or cafe.
+    """
+
+    __slots__ = ("name", "location", "cuisine", "cost", "notes")
+    name: str
+    location: str
+    cuisine: str
+    cost: float
+    notes: str
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            name=str(data.get("name") or ""),
+            location=str(data.get("location") or ""),
+            cuisine=str(data.get("cuisine") or ""),
+            cost=parse_cost(data.get("cost")),
+            notes=str(data.get("notes") or "")
+        )
+
+    def to_dict(self):
+        return {"name": self.name, "location": self.location, "cuisine": self.cuisine,
+                "cost": self.cost, "notes": self.notes}
+
+@dataclass
+class Itinerary:
+    """
+    A structured travel plan.
+
+    Long trips are outlined and detailed as JSON into an itinerary, which is
+    then rendered day by day in the same layout as a free-text plan, with
+    its costs totalled locally.
+    """
+
+    __slots__ = ("destination", "currency", "nights", "days", "accommodation", "dining", "tips")
+    destination: str
+    currency: str
+    nights: int
+    days: list
+    accommodation: list
+    dining: list
+    tips: list
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Build an itinerary from the model's JSON, tolerating missing or loosely typed fields.
+
+        Args:
+            data (dict): Decoded JSON following TRIP_SKELETON_SCHEMA or DAY_DETAILS_SCHEMA
+
+        Returns:
+            Itinerary: The parsed itinerary
+        """
+        days = [Day.from_dict(entry, number) for number, entry in enumerate(data.get("days") or [], 1)
+                if isinstance(entry, dict)]
+        days.sort(key=lambda day: day.number)
+        try:
+            nights = int(data.get("nights") or len(days))
+        except (TypeError, ValueError):
+            nights = len(days)
+        return cls(
+            destination=str(data.get("destination") or ""),
+            currency=str(data.get("currency") or "USD"),
+            nights=nights,
+            days=days,
+            accommodation=[Accommodation.from_dict(entry) for entry in data.get("accommodation") or []
+                           if isinstance(entry, dict)],
+            dining=[DiningOption.from_dict(entry) for entry in data.get("dining") or []
+                    if isinstance(entry, dict)],
+            tips=[str(tip) for tip in data.get("tips") or [] if tip]
+        )
+
+    def to_dict(self):
+        """
+        Convert the itinerary to plain data.
+
+        Returns:
+            dict: JSON-serializable form that from_dict reads back
+        """
+        return {
+            "destination": self.destination,
+            "currency": self.currency,
+            "nights": self.nights,
+            "days": [day.to_dict() for day in self.days],
+            "accommodation": [entry.to_dict() for entry in self.accommodation],
+            "dining": [entry.to_dict() for entry in self.dining],
+            "tips": list(self.tips)
+        }
+
+    def get_day(self, number):
+        """
+        Look up a day by its number.
+
+        Args:
+            number (int): Day number, starting at 1
+
+        Returns:
+            Day: The day, or None if the itinerary has no such day
+        """
+        for day in self.days:
+            if day.number == number:
+                return day
+        return None
+
+    def cost_breakdown(self):
+        """
+        Add up the estimated costs.
+
+        Accommodation is the first (recommended) option for every night, and
+        each dining recommendation is counted once.
+
+        Returns:
+            dict: Costs for "activities", "accommodation", "dining" and the "total"
+        """
+        activities = sum(day.cost() for day in self.days)
+        accommodation = self.accommodation[0].cost_per_night * self.nights if self.accommodation else 0.0
+        dining = sum(entry.cost for entry in self.dining)
+        return {
+            "activities": activities,
+            "accommodation": accommodation,
+            "dining": dining,
+            "total": activities + accommodation + dining
+        }
+
+    def _money(self, amount):
+        return format_cost(amount, self.currency)
+
+    def title_markdown(self):
+        """
+        Render the itinerary's title.
+
+        Returns:
+            str: The itinerary's title heading
+        """
+        return f"# {len(self.days)}-Day Itinerary for {self.destination}".rstrip() + "\n\n"
+
+    def day_markdown(self, day):
+        """
+        Render one day's section.
+
+        Args:
+            day (Day): A day of this itinerary
+
+        Returns:
+            str: The day's heading and timed activities, or a note that none could be planned
+        """
+        lines = [f"## Day {day.number}: {day.title}".rstrip(": ")]
+        if not day.activities:
+            lines.append("- _No activities could be planned for this day. Ask for a refinement to fill it in._")
+        for activity in day.activities:
+            when = f"**{activity.time}** - " if activity.time else ""
+            where = f" ({activity.location})" if activity.location else ""
+            cost = f", about {self._money(activity.cost)}" if activity.cost else ""
+            notes = f" {activity.notes}" if activity.notes else ""
+            lines.append(f"- {when}{activity.name}{where}{cost}.{notes}")
+        return "\n".join(lines) + "\n\n"
+
+    def closing_markdown(self):
+        """
+        Render the sections that follow the days.
+
+        Returns:
+            str: Accommodation, dining, estimated cost and tip sections
+        """
+        lines = []
+        if self.accommodation:
+            lines.append("## Accommodation")
+            for entry in self.accommodation:
+                where = f" - {entry.location}" if entry.location else ""
+                cost = f", about {self._money(entry.cost_per_night)} per night" if entry.cost_per_night else ""
+                notes = f". {entry.notes}" if entry.notes else ""
+                lines.append(f"- **{entry.name}**{where}{cost}{notes}")
+            lines.append("")
+
+        if self.dining:
+            lines.append("## Dining")
+            for entry in self.dining:
+                details = ", ".join(filter(None, [entry.cuisine, entry.location]))
+                cost = f", about {self._money(entry.cost)} per person" if entry.cost else ""
+                notes = f". {entry.notes}" if entry.notes else ""
+                lines.append(f"- **{entry.name}**{' - ' + details if details else ''}{cost}{notes}")
+            lines.append("")
+
+        costs = self.cost_breakdown()
+        lines.extend([
+            "## Estimated Costs",
+            f"- Activities: {self._money(costs['activities'])}",
+            f"- Accommodation ({self.nights} nights): {self._money(costs['accommodation'])}",
+            f"- Dining: {self._money(costs['dining'])}",
+            f"- **Total: {self._money(costs['total'])}**",
+            ""
+        ])
+
+        if self.tips:
+            lines.append("## Travel Tips")
+            lines.extend(f"- {tip}" for tip in self.tips)
+            lines.append("")
+        return "\n".join(lines)
+
+    def to_markdown(self):
+        """
+        Render the itinerary in the same layout as a free-text plan.
+
+        Returns:
+            str: Markdown itinerary with day, accommodation, dining, cost and tip sections
+        """
+        return self.title_markdown() + "".join(self.day_markdown(day) for day in self.days) + self.closing_markdown()
+
+def extract_json_object(text):
+    """
+    Decode the JSON object in a model's response.
+
+    Code fences and text around the object are ignored.
+
+    Args:
+        text (str): The model's response
+
+    Returns:
+        dict: The decoded object, or None if the response holds none
+    """
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def parse_itinerary(text):
+    """
+    Parse a model's JSON response into an Itinerary.
+
+    Args:
+        text (str): The model's response
+
+    Returns:
+        Itinerary: The parsed itinerary, or None if the response holds no usable itinerary
+    """
+    data = extract_json_object(text)
+    if data is None:
+        return None
+    itinerary = Itinerary.from_dict(data)
+    return itinerary if itinerary.days else None
@@ -0,0 +1,247 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from request_normalizer import SimilarityIndex
+
+def normalize_prompt(prompt):
+    """
+    Normalize a prompt so cosmetic whitespace differences share a cache entry.
+
+    Args:
+        prompt (str): The prompt sent to the model
+
+    Returns:
+        str: The prompt with runs of whitespace collapsed to single spaces
+    """
+    return " ".join(prompt.split())
+
+def make_cache_key(backend, model, temperature, max_tokens, prompt):
+    """
+    Build the cache key for a single model request.
+
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        temperature (float): Sampling temperature, or None for the backend default
+        max_tokens (int): Completion token limit, or None for the backend default
+        prompt (str): The prompt sent to the model
+
+    Returns:
+        str: Cache key
+    """
+    prompt_hash = hashlib.sha256(normalize_prompt(prompt).encode("utf-8")).hexdigest()
+    return f"{backend}|{model}|{temperature}|{max_tokens}|{prompt_hash}"
+
+def _scope(key):
+    # Everything but the prompt hash: similar requests only match within a backend/model/settings scope
+    return key.rsplit("|", 1)[0]
+
+class ResponseCache:
+    """
+    Two-tier cache for LLM responses.
+
+    The first tier is an in-process LRU; the second is a SQLite file shared by
+    every process on the machine. Both tiers expire entries after a TTL and
+    evict the least recently used entries once they reach their size limit.
+    """
+
+    def __init__(self, path, memory_size=256, disk_size=5000, ttl=86400, enabled=True,
+                 similarity_threshold=0.9):
+        """
+        Args:
+            path (str): SQLite file for the on-disk tier, or None for memory only
+            memory_size (int): Maximum number of entries kept in memory
+            disk_size (int): Maximum number of entries kept on disk
+            ttl (float): Seconds before an entry expires
+            enabled (bool): Set to False to bypass the cache entirely
+            similarity_threshold (float): Minimum similarity for serving a close
+                match when there is no exact hit (0 disables similarity lookups)
+        """
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_size = disk_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._similar = SimilarityIndex(similarity_threshold) if similarity_threshold else None
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a cache configured from LLM_CACHE_* environment variables.
+
+        Returns:
+            ResponseCache: The configured cache
+        """
+        return cls(
+            path=os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3") or None,
+            memory_size=int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256")),
+            disk_size=int(os.getenv("LLM_CACHE_DISK_SIZE", "5000")),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "86400")),
+            enabled=os.getenv("LLM_CACHE_DISABLED", "").lower() not in ("1", "true", "yes"),
+            similarity_threshold=float(os.getenv("LLM_CACHE_SIMILARITY", "0.9"))
+        )
+
+    def _db(self):
+        # Open the SQLite file on first use so importing the module stays cheap
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key, fingerprint=None):
+        """
+        Look up a cached response.
+
+        Args:
+            key (str): Key from make_cache_key
+            fingerprint (tuple): Optional request fingerprint from
+                request_normalizer.request_fingerprint; on an exact miss the
+                response for the closest similar request is returned instead
+
+        Returns:
+            str: The cached response, or None on a miss
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None and fingerprint is not None and self._similar is not None:
+                # The index lives in memory; exact hits on disk entries rebuild it after a restart
+                self._similar.add(_scope(key), fingerprint, key)
+            if value is None and fingerprint is not None and self._similar is not None:
+                similar_key = self._similar.find(_scope(key), fingerprint)
+                if similar_key is not None:
+                    value = self._lookup(similar_key)
+                    if value is not None:
+                        self.similar_hits += 1
+
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    def _lookup(self, key):
+        # Caller holds the lock
+        now = time.time()
+        entry = self._memory.get(key)
+        if entry is not None:
+            value, created = entry
+            if now - created < self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return value
+            del self._memory[key]
+
+        if self.path:
+            try:
+                db = self._db()
+                row = db.execute(
+                    "SELECT value, created FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created = row
+                    if now - created < self.ttl:
+                        db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        db.commit()
+                        self._remember(key, value, created)
+                        self.disk_hits += 1
+                        return value
+                    db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    db.commit()
+            except sqlite3.Error as e:
+                print(f"Error reading LLM response cache: {str(e)}")
+        return None
+
+    def set(self, key, value, fingerprint=None):
+        """
+        Store a response in both tiers.
+
+        Args:
+            key (str): Key from make_cache_key
+            value (str): The model's response
+            fingerprint (tuple): Optional request fingerprint used for
+                similarity lookups
+        """
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            if fingerprint is not None and self._similar is not None:
+                self._similar.add(_scope(key), fingerprint, key)
+
+            if self.path:
+                try:
+                    db = self._db()
+                    db.execute(
+                        "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                        (key, value, now, now)
+                    )
+                    # Drop expired entries, then anything beyond the size limit
+                    db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+                    db.execute(
+                        "DELETE FROM responses WHERE key IN ("
+                        "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                        (self.disk_size,)
+                    )
+                    db.commit()
+                except sqlite3.Error as e:
+                    print(f"Error writing LLM response cache: {str(e)}")
+
+    def _remember(self, key, value, created):
+        # Caller holds the lock
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def clear(self):
+        """
+        Remove every entry from both tiers and reset the counters.
+        """
+        with self._lock:
+            self._memory.clear()
+            if self.path:
+                db = self._db()
+                db.execute("DELETE FROM responses")
+                db.commit()
+            self.hits = self.memory_hits = self.disk_hits = self.similar_hits = self.misses = 0
+
+    def stats(self):
+        """
+        Report cache effectiveness.
+
+        Returns:
+            dict: Hit/miss counters, hit rate and the number of in-memory entries
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory)
+            }
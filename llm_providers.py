@@ -0,0 +1,561 @@
+import os
+import json
+import asyncio
+from llm_setup import (
+    query_openai_api, query_local_llama, stream_openai_api, stream_local_llama,
+    response_cache, request_flights, make_cache_key, estimate_tokens, is_complete_response, streamed_tokens,
+    read_stream_usage, openai_rate_limiter, model_router, circuit_breakers, acall_backend, astream_backend,
+    record_cache_hit, load_env,
+    OPENAI_BASE_URL, OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS, OPENAI_MAX_RETRIES,
+    OLLAMA_BASE_URL, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT
+)
+from rate_limiter import retry_after_seconds
+
+# Upper bound on concurrent connections each async client keeps open
+ASYNC_MAX_CONNECTIONS = int(os.getenv("LLM_ASYNC_MAX_CONNECTIONS", "200"))
+
+class LLMProvider:
+    """
+    Base class for a model backend.
+
+    Every provider offers blocking calls (query, stream_query) for the
+    thread-based code paths and coroutine-based calls (generate, stream,
+    health) so a single event loop can drive many generations at once.
+    """
+
+    # Name used to select the provider, e.g. generate_travel_plan(..., model="openai")
+    name = None
+    # Display name used for comparison results
+    label = None
+
+    def __init__(self):
+        self._async_client = None
+        self._async_client_loop = None
+
+    def query(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        """
+        Generate a complete response, blocking the calling thread.
+
+        Args:
+            prompt (str): The prompt to send
+            use_cache (bool): Set to False to bypass the response cache
+            fingerprint (tuple): Optional request fingerprint for similarity lookups
+            json_mode (bool): Ask the backend for a JSON object instead of free text
+            cache_text (str): Optional text the cache key is built from instead of the prompt
+
+        Returns:
+            str: The model's response
+        """
+        raise NotImplementedError
+
+    def stream_query(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        """
+        Stream a response, blocking the calling thread between chunks.
+
+        Args:
+            prompt (str): The prompt to send
+            use_cache (bool): Set to False to bypass the response cache
+            fingerprint (tuple): Optional request fingerprint for similarity lookups
+            cache_text (str): Optional text the cache key is built from instead of the prompt
+
+        Returns:
+            generator: Pieces of the model's response as they arrive
+        """
+        raise NotImplementedError
+
+    async def generate(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        """
+        Generate a complete response without blocking the event loop.
+
+        Args:
+            prompt (str): The prompt to send
+            use_cache (bool): Set to False to bypass the response cache
+            fingerprint (tuple): Optional request fingerprint for similarity lookups
+            json_mode (bool): Ask the backend for a JSON object instead of free text
+            cache_text (str): Optional text the cache key is built from instead of the prompt
+
+        Returns:
+            str: The model's response
+        """
+        pieces = []
+        async for chunk in self.stream(prompt, use_cache=use_cache, fingerprint=fingerprint, cache_text=cache_text):
+            pieces.append(chunk)
+        return "".join(pieces)
+
+    async def stream(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        """
+        Stream a response without blocking the event loop.
+
+        Args:
+            prompt (str): The prompt to send
+            use_cache (bool): Set to False to bypass the response cache
+            fingerprint (tuple): Optional request fingerprint for similarity lookups
+            cache_text (str): Optional text the cache key is built from instead of the prompt
+
+        Yields:
+            str: Pieces of the model's response as they arrive
+        """
+        raise NotImplementedError
+        yield
+
+    async def health(self):
+        """
+        Check whether the backend is reachable.
+
+        Returns:
+            dict: {"ok": bool, "detail": str}
+        """
+        raise NotImplementedError
+
+    def cache_key(self, prompt, json_mode=False, cache_text=None):
+        """
+        Build the response cache key for a prompt sent to this provider.
+
+        Args:
+            prompt (str): The prompt to send
+            json_mode (bool): Whether the request asks for a JSON object
+            cache_text (str): Optional text the key is built from instead of the prompt
+
+        Returns:
+            str: Cache key shared with the blocking code path
+        """
+        raise NotImplementedError
+
+    def route(self, prompt):
+        """
+        Return the provider that will actually serve a prompt.
+
+        Args:
+            prompt (str): The prompt to send
+
+        Returns:
+            LLMProvider: This provider; AutoProvider returns the backend it picks
+        """
+        return self
+
+    async def aclose(self):
+        """
+        Close the async HTTP client and its connections.
+
+        Call it on the loop the client was used on before that loop ends,
+        e.g. when the API server shuts down; the next async call opens a
+        new client.
+        """
+        client, self._async_client, self._async_client_loop = self._async_client, None, None
+        if client is not None:
+            await self._close_client(client)
+
+    async def _close_client(self, client):
+        await client.aclose()
+
+    def _client_for_loop(self, factory):
+        # Async HTTP clients are bound to the loop they were created on
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            if self._async_client is not None and self._async_client_loop.is_running():
+                # Its connections belong to the other loop, so they are closed there
+                asyncio.run_coroutine_threadsafe(self._close_client(self._async_client), self._async_client_loop)
+            # A client whose loop has ended is dropped; its connections close with it
+            self._async_client = factory()
+            self._async_client_loop = loop
+        return self._async_client
+
+class OpenAIProvider(LLMProvider):
+    """
+    OpenAI chat completions backend.
+    """
+
+    name = "openai"
+    label = "OpenAI"
+
+    def __init__(self, model="gpt-3.5-turbo"):
+        super().__init__()
+        self.model = model
+
+    def _client(self):
+        import httpx
+        from openai import AsyncOpenAI
+
+        def create():
+            # OPENAI_API_KEY usually comes from .env
+            load_env()
+            return AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY"),
+                base_url=OPENAI_BASE_URL,
+                max_retries=0,
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS)
+                )
+            )
+
+        return self._client_for_loop(create)
+
+    async def _close_client(self, client):
+        await client.close()
+
+    async def _create(self, prompt, stream=False, json_mode=False):
+        # Async counterpart of llm_setup.create_openai_completion, sharing its rate limiter
+        from openai import RateLimitError, APIConnectionError, InternalServerError
+        
+        reserved_tokens = estimate_tokens(prompt) + OPENAI_MAX_TOKENS
+        extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+        if stream:
+            # The last chunk then reports the token usage, so the reservation can be corrected;
+            # sent as a raw body field, which the pinned client has no argument for
+            extra["extra_body"] = {"stream_options": {"include_usage": True}}
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            # Queues on the event loop; a cancelled request leaves the queue without using the budget
+            await openai_rate_limiter.aacquire(reserved_tokens)
+            try:
+                response = await self._client().chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=OPENAI_TEMPERATURE,
+                    max_tokens=OPENAI_MAX_TOKENS,
+                    stream=stream,
+                    **extra
+                )
+                return response, reserved_tokens
+            except RateLimitError as e:
+                if attempt == OPENAI_MAX_RETRIES:
+                    raise
+                openai_rate_limiter.penalize(retry_after_seconds(e, attempt))
+            except (APIConnectionError, InternalServerError) as e:
+                if attempt == OPENAI_MAX_RETRIES:
+                    raise
+                await asyncio.sleep(retry_after_seconds(e, attempt, base=0.5))
+
+    def cache_key(self, prompt, json_mode=False, cache_text=None):
+        return make_cache_key("openai-json" if json_mode else "openai", self.model, OPENAI_TEMPERATURE,
+                              OPENAI_MAX_TOKENS, prompt if cache_text is None else cache_text)
+
+    def query(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        return query_openai_api(prompt, self.model, use_cache=use_cache, fingerprint=fingerprint,
+                                json_mode=json_mode, cache_text=cache_text)
+
+    def stream_query(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        return stream_openai_api(prompt, self.model, use_cache=use_cache, fingerprint=fingerprint,
+                                 cache_text=cache_text)
+
+    async def generate(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        cache_key = self.cache_key(prompt, json_mode, cache_text)
+        if use_cache:
+            cached = await asyncio.to_thread(response_cache.get, cache_key, fingerprint)
+            if cached is not None:
+                record_cache_hit(self.name, self.model)
+                return cached
+
+        async def fetch(usage):
+            try:
+                response, reserved_tokens = await self._create(prompt, json_mode=json_mode)
+                if response.usage is not None:
+                    openai_rate_limiter.record_usage(reserved_tokens, response.usage.total_tokens)
+                    usage["prompt_tokens"] = response.usage.prompt_tokens
+                    usage["completion_tokens"] = response.usage.completion_tokens
+                usage["finish_reason"] = response.choices[0].finish_reason
+                content = response.choices[0].message.content
+                if use_cache and is_complete_response(content, usage["finish_reason"]):
+                    await asyncio.to_thread(response_cache.set, cache_key, content, fingerprint)
+                return content
+            except Exception as e:
+                print(f"Error querying OpenAI API: {str(e)}")
+                return f"Error: {str(e)}"
+
+        # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+        if not use_cache:
+            return await acall_backend(self.name, self.model, prompt, fetch)
+        return await request_flights.ado(cache_key, acall_backend, self.name, self.model, prompt, fetch)
+
+    async def stream(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        cache_key = self.cache_key(prompt, cache_text=cache_text)
+        if use_cache:
+            cached = await asyncio.to_thread(response_cache.get, cache_key, fingerprint)
+            if cached is not None:
+                record_cache_hit(self.name, self.model)
+                yield cached
+                return
+
+        async def fetch(usage):
+            try:
+                stream, reserved_tokens = await self._create(prompt, stream=True)
+            except Exception as e:
+                print(f"Error streaming from OpenAI API: {str(e)}")
+                yield f"Error: {str(e)}"
+                return
+            pieces = []
+            try:
+                async for chunk in stream:
+                    read_stream_usage(chunk, usage)
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        usage["finish_reason"] = chunk.choices[0].finish_reason
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        pieces.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+                # A stream that ended without a finish reason was cut off
+                if use_cache and is_complete_response("".join(pieces), usage.get("finish_reason")):
+                    await asyncio.to_thread(response_cache.set, cache_key, "".join(pieces), fingerprint)
+            except Exception as e:
+                print(f"Error streaming from OpenAI API: {str(e)}")
+                yield f"Error: {str(e)}"
+            finally:
+                # Also runs for a stream that was dropped or failed part way
+                openai_rate_limiter.record_usage(reserved_tokens, streamed_tokens(prompt, pieces, usage))
+
+        # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+        if not use_cache:
+            async for chunk in astream_backend(self.name, self.model, prompt, fetch):
+                yield chunk
+            return
+        # Keyed like the blocking stream, so threads and coroutines share one upstream call
+        async for chunk in request_flights.astream("stream|" + cache_key, astream_backend, self.name,
+                                                   self.model, prompt, fetch):
+            yield chunk
+
+    async def health(self):
+        try:
+            await self._client().models.retrieve(self.model)
+            return {"ok": True, "detail": f"{self.model} available"}
+        except Exception as e:
+            return {"ok": False, "detail": str(e)}
+
+class OllamaProvider(LLMProvider):
+    """
+    Local Ollama backend.
+    """
+
+    name = "llama"
+    label = "Llama 3.2"
+
+    def __init__(self, model_name="llama3.2"):
+        super().__init__()
+        self.model_name = model_name
+
+    def _client(self):
+        import httpx
+        return self._client_for_loop(lambda: httpx.AsyncClient(
+            base_url=OLLAMA_BASE_URL,
+            timeout=httpx.Timeout(OLLAMA_READ_TIMEOUT, connect=OLLAMA_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS)
+        ))
+
+    def cache_key(self, prompt, json_mode=False, cache_text=None):
+        return make_cache_key("llama-json" if json_mode else "llama", self.model_name, None, None,
+                              prompt if cache_text is None else cache_text)
+
+    def query(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        return query_local_llama(prompt, self.model_name, use_cache=use_cache, fingerprint=fingerprint,
+                                 json_mode=json_mode, cache_text=cache_text)
+
+    def stream_query(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        return stream_local_llama(prompt, self.model_name, use_cache=use_cache, fingerprint=fingerprint,
+                                  cache_text=cache_text)
+
+    async def generate(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        cache_key = self.cache_key(prompt, json_mode, cache_text)
+        if use_cache:
+            cached = await asyncio.to_thread(response_cache.get, cache_key, fingerprint)
+            if cached is not None:
+                record_cache_hit(self.name, self.model_name)
+                return cached
+
+        async def fetch(usage):
+            try:
+                payload = {
+                    "model": self.model_name,
+                    "prompt": prompt,
+                    "stream": False
+                }
+                if json_mode:
+                    payload["format"] = "json"
+                response = await self._client().post("/api/generate", json=payload)
+                if response.status_code != 200:
+                    return f"Error: Status code {response.status_code}, {response.text}"
+                result = response.json()
+                usage["prompt_tokens"] = result.get("prompt_eval_count")
+                usage["completion_tokens"] = result.get("eval_count")
+                usage["finish_reason"] = result.get("done_reason")
+                if "response" not in result:
+                    return f"Unexpected response format: {json.dumps(result)}"
+                # Older Ollama versions report done without a reason
+                if use_cache and is_complete_response(result["response"], result.get("done_reason") or "stop"):
+                    await asyncio.to_thread(response_cache.set, cache_key, result["response"], fingerprint)
+                return result["response"]
+            except Exception as e:
+                print(f"Error querying local Llama model: {str(e)}")
+                return f"Error: {str(e)}"
+
+        # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+        if not use_cache:
+            return await acall_backend(self.name, self.model_name, prompt, fetch)
+        return await request_flights.ado(cache_key, acall_backend, self.name, self.model_name, prompt, fetch)
+
+    async def stream(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        cache_key = self.cache_key(prompt, cache_text=cache_text)
+        if use_cache:
+            cached = await asyncio.to_thread(response_cache.get, cache_key, fingerprint)
+            if cached is not None:
+                record_cache_hit(self.name, self.model_name)
+                yield cached
+                return
+
+        async def fetch(usage):
+            try:
+                async with self._client().stream("POST", "/api/generate", json={
+                    "model": self.model_name,
+                    "prompt": prompt,
+                    "stream": True
+                }) as response:
+                    if response.status_code != 200:
+                        body = await response.aread()
+                        yield f"Error: Status code {response.status_code}, {body.decode(errors='replace')}"
+                        return
+
+                    pieces = []
+                    done = False
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        result = json.loads(line)
+                        if "error" in result:
+                            yield f"Error: {result['error']}"
+                            return
+                        if result.get("response"):
+                            pieces.append(result["response"])
+                            yield result["response"]
+                        if result.get("done"):
+                            usage["prompt_tokens"] = result.get("prompt_eval_count")
+                            usage["completion_tokens"] = result.get("eval_count")
+                            usage["finish_reason"] = result.get("done_reason")
+                            done = True
+                            break
+
+                    # A stream that ended before its done line was cut off
+                    if use_cache and done and is_complete_response("".join(pieces), usage["finish_reason"] or "stop"):
+                        await asyncio.to_thread(response_cache.set, cache_key, "".join(pieces), fingerprint)
+            except Exception as e:
+                print(f"Error streaming from local Llama model: {str(e)}")
+                yield f"Error: {str(e)}"
+
+        # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+        if not use_cache:
+            async for chunk in astream_backend(self.name, self.model_name, prompt, fetch):
+                yield chunk
+            return
+        # Keyed like the blocking stream, so threads and coroutines share one upstream call
+        async for chunk in request_flights.astream("stream|" + cache_key, astream_backend, self.name,
+                                                   self.model_name, prompt, fetch):
+            yield chunk
+
+    async def health(self):
+        try:
+            response = await self._client().get("/api/tags")
+            if response.status_code != 200:
+                return {"ok": False, "detail": f"Status code {response.status_code}"}
+            models = [entry.get("name", "") for entry in response.json().get("models", [])]
+            if not any(name.split(":")[0] == self.model_name for name in models):
+                return {"ok": False, "detail": f"{self.model_name} is not pulled"}
+            return {"ok": True, "detail": f"{self.model_name} available"}
+        except Exception as e:
+            return {"ok": False, "detail": str(e)}
+
+class AutoProvider(LLMProvider):
+    """
+    Sends each request to the registered backend expected to finish it soonest.
+
+    The choice is made per prompt by model_router from recent latency,
+    error rates and calls in flight, plus the OpenAI rate-limit queue, so
+    the local model takes over while OpenAI is throttled and the reverse
+    while the local machine is saturated. Backends with an open circuit are
+    left out.
+    """
+
+    name = "auto"
+    label = "Auto"
+
+    def route(self, prompt):
+        tokens = estimate_tokens(prompt)
+        candidates = [
+            name for name in PROVIDERS
+            if name not in circuit_breakers or not circuit_breakers[name].is_open()
+        ] or list(PROVIDERS)
+        waits = {"openai": openai_rate_limiter.estimated_wait(tokens + OPENAI_MAX_TOKENS)}
+        return PROVIDERS[model_router.choose(tokens, candidates, waits)]
+
+    def cache_key(self, prompt, json_mode=False, cache_text=None):
+        return self.route(prompt).cache_key(prompt, json_mode, cache_text)
+
+    def query(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        return self.route(prompt).query(prompt, use_cache=use_cache, fingerprint=fingerprint, json_mode=json_mode,
+                                        cache_text=cache_text)
+
+    def stream_query(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        return self.route(prompt).stream_query(prompt, use_cache=use_cache, fingerprint=fingerprint,
+                                               cache_text=cache_text)
+
+    async def generate(self, prompt, use_cache=True, fingerprint=None, json_mode=False, cache_text=None):
+        return await self.route(prompt).generate(prompt, use_cache=use_cache, fingerprint=fingerprint,
+                                                 json_mode=json_mode, cache_text=cache_text)
+
+    async def stream(self, prompt, use_cache=True, fingerprint=None, cache_text=None):
+        async for chunk in self.route(prompt).stream(prompt, use_cache=use_cache, fingerprint=fingerprint,
+                                                     cache_text=cache_text):
+            yield chunk
+
+    async def health(self):
+        results = await check_providers_health()
+        healthy = [name for name, result in results.items() if result["ok"]]
+        if not healthy:
+            return {"ok": False, "detail": "no backend available"}
+        return {"ok": True, "detail": f"routing between {', '.join(healthy)}"}
+
+# Model name that lets the router pick the backend for each request
+AUTO_MODEL = AutoProvider.name
+
+# Registered providers, keyed by the model name callers pass around
+PROVIDERS = {}
+
+def register_provider(provider):
+    """
+    Make a provider selectable by its name.
+
+    Args:
+        provider (LLMProvider): The provider to register
+    """
+    PROVIDERS[provider.name] = provider
+
+def get_provider(name):
+    """
+    Look up a registered provider.
+
+    Args:
+        name (str): Provider name ("openai", "llama" or "auto")
+
+    Returns:
+        LLMProvider: The provider, or None if no provider has that name
+    """
+    if name == AUTO_MODEL:
+        return auto_provider
+    return PROVIDERS.get(name)
+
+async def close_providers():
+    """
+    Close the async HTTP clients of every registered provider.
+    """
+    await asyncio.gather(*(provider.aclose() for provider in PROVIDERS.values()))
+
+async def check_providers_health():
+    """
+    Check every registered provider concurrently.
+
+    Returns:
+        dict: Health result for each provider name
+    """
+    names = list(PROVIDERS)
+    results = await asyncio.gather(*(PROVIDERS[name].health() for name in names))
+    return dict(zip(names, results))
+
+register_provider(OpenAIProvider())
+register_provider(OllamaProvider())
+
+# Not registered, so it never shows up among the backends it routes between
+auto_provider = AutoProvider()
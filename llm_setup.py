@@ -1,130 +1,910 @@
 import os
-import requests
+import time
+import contextvars
+import random
+import threading
 import json
-from openai import OpenAI
-from dotenv import load_dotenv
+import socket
+from functools import partial
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from llm_cache import ResponseCache, make_cache_key
+from single_flight import SingleFlight, abortable, aborted
+from hedging import LatencyTracker, CircuitBreaker
+from model_router import ModelRouter
+from metrics import registry, record_llm_call, record_cache_hit
+from rate_limiter import RateLimiter, retry_after_seconds, request_priority, current_priority, BACKGROUND, PRIORITY_NAMES
 
-# Load environment variables
-load_dotenv()
+# OPENAI_BASE_URL can point at a compatible server such as fake_llm_server.py
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL") or None
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# OpenAI client shared by every caller in the process, created on first use
+_openai_client = None
+_openai_client_lock = threading.Lock()
 
-def query_openai_api(prompt, model="gpt-3.5-turbo"):
+# Whether the .env file has been read into the environment yet
+_env_loaded = False
+
+# Generation settings for OpenAI requests
+OPENAI_TEMPERATURE = 0.7
+OPENAI_MAX_TOKENS = 1000
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "3"))
+
+# Process-wide requests/min and tokens/min budget shared by every OpenAI call
+openai_rate_limiter = RateLimiter.from_env("OPENAI")
+
+# Shared response cache in front of both backends
+response_cache = ResponseCache.from_env()
+
+# Identical requests in flight at the same time share one upstream call
+request_flights = SingleFlight(
+    enabled=os.getenv("LLM_SINGLE_FLIGHT_DISABLED", "").lower() not in ("1", "true", "yes")
+)
+
+# Time to first token of each backend, which decides when a slow request is hedged
+first_token_latency = LatencyTracker()
+
+# Backends that keep failing are skipped until a probe gets through
+circuit_breakers = {
+    "openai": CircuitBreaker.from_env("OPENAI"),
+    "llama": CircuitBreaker.from_env("OLLAMA")
+}
+
+# Recent timings, errors and load per backend, used to route model="auto" requests
+model_router = ModelRouter.from_env({"openai": "OPENAI", "llama": "OLLAMA"})
+
+def collect_llm_state():
+    """
+    Report the shared LLM machinery's current state for the metrics endpoint.
+    
+    Returns:
+        list: (name, type, help, samples) tuples as expected by MetricsRegistry.add_collector
+    """
+    limiter = openai_rate_limiter.stats()
+    cache = response_cache.stats()
+    flights = request_flights.stats()
+    routed = model_router.stats()
+    return [
+        ("llm_rate_limit_queue_depth", "gauge", "OpenAI calls waiting for the rate limiter",
+         [({"backend": "openai"}, limiter["queue_depth"])]),
+        ("llm_rate_limit_throttled_total", "counter", "OpenAI calls that had to wait for the rate limiter",
+         [({"backend": "openai"}, limiter["throttled"])]),
+        ("llm_cache_lookups_total", "counter", "Response cache lookups by result",
+         [({"result": "hit"}, cache["hits"]), ({"result": "miss"}, cache["misses"])]),
+        ("llm_single_flight_coalesced_total", "counter", "Calls that shared an identical call already in flight",
+         [({}, flights["coalesced"])]),
+        ("llm_in_flight", "gauge", "Upstream calls in flight per backend",
+         [({"backend": name}, state["in_flight"]) for name, state in routed.items()]),
+        ("llm_circuit_open", "gauge", "1 while a backend's circuit breaker is skipping it",
+         [({"backend": name}, int(breaker.is_open())) for name, breaker in circuit_breakers.items()])
+    ]
+
+registry.add_collector(collect_llm_state)
+
+# Shared thread pool used to send the same work to several backends at once
+FANOUT_WORKERS = int(os.getenv("LLM_FANOUT_WORKERS", "8"))
+fanout_executor = ThreadPoolExecutor(
+    max_workers=FANOUT_WORKERS,
+    thread_name_prefix="llm-fanout"
+)
+
+# Local Ollama connection settings
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434").rstrip("/")
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", str(FANOUT_WORKERS)))
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "3.05"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120"))
+OLLAMA_MAX_RETRIES = int(os.getenv("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.getenv("OLLAMA_RETRY_BACKOFF", "0.5"))
+
+# Keep-alive session shared by every caller in the process (CLI, tests, Streamlit sessions)
+_ollama_session = None
+_ollama_session_lock = threading.Lock()
+
+def load_env():
+    """
+    Read the .env file into the environment, once.
+    
+    Deferred until a credential is first needed, so importing this module
+    doesn't search for and parse the file. Entry points that want every
+    setting taken from .env call it before importing the other modules.
+    Variables already set in the environment are never overridden.
+    """
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def get_openai_client():
+    """
+    Return the process-wide OpenAI client, creating it on first use.
+    
+    The openai package is only imported here, so Llama-only runs never pay
+    for it. Retries are disabled on the client and handled in
+    create_openai_completion so they go through the shared rate limiter.
+    
+    Returns:
+        OpenAI: The shared client
+    """
+    global _openai_client
+    with _openai_client_lock:
+        if _openai_client is None:
+            from openai import OpenAI
+            # OPENAI_API_KEY usually comes from .env
+            load_env()
+            _openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL, max_retries=0)
+    return _openai_client
+
+def get_ollama_session():
+    """
+    Return the process-wide pooled HTTP session for talking to Ollama.
+    
+    Returns:
+        requests.Session: Session with a keep-alive connection pool
+    """
+    global _ollama_session
+    with _ollama_session_lock:
+        if _ollama_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=OLLAMA_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _ollama_session = session
+    return _ollama_session
+
+def post_to_ollama(path, payload, stream=False):
+    """
+    POST to the Ollama API, retrying connection resets and 5xx responses.
+    
+    Retries use exponential backoff with full jitter so concurrent callers
+    don't hammer a recovering server in lockstep.
+    
+    Args:
+        path (str): API path, e.g. "/api/generate"
+        payload (dict): JSON request body
+        stream (bool): Whether to stream the response body
+    
+    Returns:
+        requests.Response: The final response
+    """
+    from requests.exceptions import ConnectionError as RequestsConnectionError
+    
+    url = f"{OLLAMA_BASE_URL}{path}"
+    for attempt in range(OLLAMA_MAX_RETRIES + 1):
+        try:
+            response = get_ollama_session().post(
+                url,
+                json=payload,
+                stream=stream,
+                timeout=(OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT)
+            )
+        except RequestsConnectionError:
+            if attempt == OLLAMA_MAX_RETRIES:
+                raise
+        else:
+            if response.status_code < 500 or attempt == OLLAMA_MAX_RETRIES:
+                return response
+            response.close()
+        time.sleep(random.uniform(0, OLLAMA_RETRY_BACKOFF * 2 ** attempt))
+
+def drop_stream(response):
+    """
+    Drop a streamed HTTP response from another thread.
+    
+    Closing a response doesn't wake a read already blocked on its socket, so
+    the socket is shut down instead; the reading thread then fails straight
+    away and closes the response itself.
+    
+    Args:
+        response: The httpx.Response behind an OpenAI stream, or the
+            requests.Response of an Ollama stream
+    """
+    if hasattr(response, "extensions"):
+        network_stream = response.extensions.get("network_stream")
+        sock = network_stream.get_extra_info("socket") if network_stream is not None else None
+    else:
+        sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is None:
+        return
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        # Already closed
+        pass
+
+def is_complete_response(response, finish_reason):
+    """
+    Decide whether a response is whole enough to cache.
+    
+    Args:
+        response (str): The full response
+        finish_reason (str): Why generation stopped, as the backend reported it
+    
+    Returns:
+        bool: True only for a non-empty response that ended with "stop",
+            rather than being cut off by the token limit, filtered or dropped
+    """
+    return bool(response and response.strip()) and finish_reason == "stop"
+
+def read_stream_usage(chunk, usage):
+    """
+    Copy the token counts from an OpenAI stream's usage chunk.
+    
+    Args:
+        chunk: A streamed chat completion chunk
+        usage (dict): Filled with prompt_tokens and completion_tokens if the chunk reports them
+    """
+    reported = getattr(chunk, "usage", None)
+    if not reported:
+        return
+    # Clients that predate the usage chunk keep it as a plain dict
+    if not isinstance(reported, dict):
+        reported = {"prompt_tokens": reported.prompt_tokens, "completion_tokens": reported.completion_tokens}
+    usage["prompt_tokens"] = reported.get("prompt_tokens")
+    usage["completion_tokens"] = reported.get("completion_tokens")
+
+def streamed_tokens(prompt, pieces, usage):
+    """
+    Count the tokens a streamed call used, for correcting its rate-limit reservation.
+    
+    Args:
+        prompt (str): The prompt that was sent
+        pieces (list): Response pieces received so far
+        usage (dict): Token counts the backend reported, if it got that far
+    
+    Returns:
+        int: Reported prompt plus completion tokens, or an estimate of them
+    """
+    if usage.get("prompt_tokens") is not None and usage.get("completion_tokens") is not None:
+        return usage["prompt_tokens"] + usage["completion_tokens"]
+    return estimate_tokens(prompt) + estimate_tokens("".join(pieces))
+
+def estimate_tokens(text):
+    """
+    Roughly estimate the number of tokens in a piece of text.
+    
+    Args:
+        text (str): Text to measure
+    
+    Returns:
+        int: Estimated token count (about four characters per token)
+    """
+    return len(text) // 4 + 1
+
+def create_openai_completion(prompt, model, stream=False, json_mode=False):
+    """
+    Send a chat completion request through the shared rate limiter.
+    
+    Throttled (429) requests pause the limiter for the server's Retry-After
+    and are queued again instead of failing; connection errors and 5xx
+    responses are retried with jittered backoff.
+    
+    Args:
+        prompt (str): The user prompt to send to the API
+        model (str): The model to use for generation
+        stream (bool): Whether to request a streamed response
+        json_mode (bool): Constrain the response to a JSON object
+    
+    Returns:
+        tuple: (response, reserved_tokens) where reserved_tokens is the
+            estimate charged against the tokens/min budget
+    """
+    from openai import RateLimitError, APIConnectionError, InternalServerError
+    
+    reserved_tokens = estimate_tokens(prompt) + OPENAI_MAX_TOKENS
+    extra = {"response_format": {"type": "json_object"}} if json_mode else {}
+    if stream:
+        # The last chunk then reports the token usage, so the reservation can be corrected;
+        # sent as a raw body field, which the pinned client has no argument for
+        extra["extra_body"] = {"stream_options": {"include_usage": True}}
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        openai_rate_limiter.acquire(reserved_tokens)
+        try:
+            response = get_openai_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=OPENAI_TEMPERATURE,
+                max_tokens=OPENAI_MAX_TOKENS,
+                stream=stream,
+                **extra
+            )
+            return response, reserved_tokens
+        except RateLimitError as e:
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            openai_rate_limiter.penalize(retry_after_seconds(e, attempt))
+        except (APIConnectionError, InternalServerError) as e:
+            if attempt == OPENAI_MAX_RETRIES:
+                raise
+            time.sleep(retry_after_seconds(e, attempt, base=0.5))
+
+def record_call(backend, model, prompt, response, usage, seconds, first_token=None):
+    """
+    Report a finished upstream call to the router and the metrics.
+    
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        prompt (str): The prompt that was sent
+        response (str): The full response
+        usage (dict): Token counts and finish reason the backend reported, if any
+        seconds (float): Time until the whole response had arrived
+        first_token (float): Time until the first token, for streamed calls
+    
+    Returns:
+        bool: Whether the call succeeded
+    """
+    ok = bool(response) and not response.startswith("Error")
+    prompt_tokens = estimate_tokens(prompt)
+    output_tokens = estimate_tokens(response)
+    model_router.finished(backend, prompt_tokens, seconds, first_token=first_token,
+                          output_tokens=output_tokens, ok=ok)
+    record_llm_call(
+        backend, model, "ok" if ok else "error", seconds,
+        first_token=first_token,
+        prompt_tokens=usage.get("prompt_tokens") or prompt_tokens,
+        completion_tokens=usage.get("completion_tokens") or (output_tokens if ok else 0),
+        finish_reason=usage.get("finish_reason"),
+        priority=PRIORITY_NAMES.get(current_priority())
+    )
+    return ok
+
+def record_abandoned_call(backend, model, seconds):
+    """
+    Report an upstream call that was dropped before it completed.
+    
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        seconds (float): Time until it was dropped
+    """
+    # Its timing says nothing about the backend, so the router only releases it
+    model_router.abandoned(backend)
+    record_llm_call(backend, model, "abandoned", seconds, priority=PRIORITY_NAMES.get(current_priority()))
+
+# Semaphores capping in-flight calls per backend for the current thread or task, e.g. a batch run's
+_backend_limits = contextvars.ContextVar("llm_backend_limits", default=None)
+
+@contextmanager
+def backend_concurrency(limits):
+    """
+    Run a block of code with a cap on its in-flight calls to each backend.
+    
+    The cap is taken where each blocking call is sent, so it applies to the
+    backend a model="auto" request was routed to and counts every call a
+    plan makes, such as the day calls of a long trip. Calls started on
+    other threads carry it over in their copy of the caller's context.
+    
+    Args:
+        limits (dict): threading.Semaphore per backend name ("openai" or
+            "llama"), shared by every thread the cap covers; backends without
+            one are not limited
+    """
+    token = _backend_limits.set(limits)
+    try:
+        yield
+    finally:
+        _backend_limits.reset(token)
+
+def backend_slot(backend):
+    """
+    Return the semaphore capping in-flight calls to a backend in the current context.
+    
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+    
+    Returns:
+        threading.Semaphore: The cap, or None when the backend isn't limited
+    """
+    return (_backend_limits.get() or {}).get(backend)
+
+def call_backend(backend, model, prompt, fetch):
+    """
+    Make an upstream call and report its outcome to the backend's circuit breaker, the router and the metrics.
+    
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        prompt (str): The prompt being sent
+        fetch (callable): Makes the call and returns the response; it is passed
+            a dict to fill with the prompt_tokens, completion_tokens and
+            finish_reason the backend reports
+    
+    Returns:
+        str: The response
+    """
+    slot = backend_slot(backend)
+    if slot is not None:
+        slot.acquire()
+    try:
+        start = time.monotonic()
+        usage = {}
+        model_router.started(backend)
+        try:
+            response = fetch(usage)
+        except BaseException:
+            record_abandoned_call(backend, model, time.monotonic() - start)
+            raise
+        if record_call(backend, model, prompt, response, usage, time.monotonic() - start):
+            circuit_breakers[backend].record_success()
+        else:
+            circuit_breakers[backend].record_failure()
+        return response
+    finally:
+        if slot is not None:
+            slot.release()
+
+async def acall_backend(backend, model, prompt, fetch):
+    """
+    Coroutine counterpart of call_backend.
+    
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        prompt (str): The prompt being sent
+        fetch (callable): Coroutine function that makes the call and returns the
+            response; it is passed a dict to fill with reported usage
+    
+    Returns:
+        str: The response
+    """
+    start = time.monotonic()
+    usage = {}
+    model_router.started(backend)
+    try:
+        response = await fetch(usage)
+    except BaseException:
+        record_abandoned_call(backend, model, time.monotonic() - start)
+        raise
+    if record_call(backend, model, prompt, response, usage, time.monotonic() - start):
+        circuit_breakers[backend].record_success()
+    else:
+        circuit_breakers[backend].record_failure()
+    return response
+
+def stream_backend(backend, model, prompt, fetch):
+    """
+    Stream an upstream call, timing its first token and reporting its outcome.
+    
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        prompt (str): The prompt being sent
+        fetch (callable): Generator function that streams the response; it is
+            passed a dict to fill with reported usage
+    
+    Yields:
+        str: Pieces of the response as they arrive
+    """
+    slot = backend_slot(backend)
+    if slot is not None:
+        slot.acquire()
+    try:
+        start = time.monotonic()
+        first_token = None
+        usage = {}
+        pieces = []
+        model_router.started(backend)
+        try:
+            for chunk in fetch(usage):
+                if first_token is None:
+                    first_token = time.monotonic() - start
+                    if not chunk.startswith("Error"):
+                        circuit_breakers[backend].record_success()
+                        first_token_latency.record(backend, first_token)
+                    else:
+                        circuit_breakers[backend].record_failure()
+                pieces.append(chunk)
+                yield chunk
+        except BaseException:
+            # Dropped part way (e.g. a hedge that lost)
+            record_abandoned_call(backend, model, time.monotonic() - start)
+            raise
+        if aborted():
+            # Its response was closed under it, which says nothing about the backend
+            record_abandoned_call(backend, model, time.monotonic() - start)
+            return
+        record_call(backend, model, prompt, "".join(pieces), usage, time.monotonic() - start, first_token)
+    finally:
+        if slot is not None:
+            slot.release()
+
+async def astream_backend(backend, model, prompt, fetch):
+    """
+    Async generator counterpart of stream_backend.
+    
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        prompt (str): The prompt being sent
+        fetch (callable): Async generator function that streams the response;
+            it is passed a dict to fill with reported usage
+    
+    Yields:
+        str: Pieces of the response as they arrive
+    """
+    start = time.monotonic()
+    first_token = None
+    usage = {}
+    pieces = []
+    model_router.started(backend)
+    try:
+        async for chunk in fetch(usage):
+            if first_token is None:
+                first_token = time.monotonic() - start
+                if not chunk.startswith("Error"):
+                    circuit_breakers[backend].record_success()
+                    first_token_latency.record(backend, first_token)
+                else:
+                    circuit_breakers[backend].record_failure()
+            pieces.append(chunk)
+            yield chunk
+    except BaseException:
+        record_abandoned_call(backend, model, time.monotonic() - start)
+        raise
+    record_call(backend, model, prompt, "".join(pieces), usage, time.monotonic() - start, first_token)
+
+def query_openai_api(prompt, model="gpt-3.5-turbo", use_cache=True, fingerprint=None, json_mode=False,
+                     cache_text=None):
     """
     Function to query OpenAI's API with a prompt using the updated client.
     
     Args:
         prompt (str): The user prompt to send to the API
         model (str): The model to use for generation
+        use_cache (bool): Set to False to bypass the response cache
+        fingerprint (tuple): Optional request fingerprint that lets a close
+            enough cached request answer this one
+        json_mode (bool): Ask for a JSON object instead of free text
+        cache_text (str): Text the cache key is built from instead of the
+            prompt, so requests that only differ cosmetically share an entry
     
     Returns:
         str: The model's response
     """
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-            max_tokens=1000
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        print(f"Error querying OpenAI API: {str(e)}")
-        return f"Error: {str(e)}"
-
-def query_local_llama(prompt, model_name="llama3.2"):
+    cache_key = make_cache_key("openai-json" if json_mode else "openai", model, OPENAI_TEMPERATURE,
+                               OPENAI_MAX_TOKENS, prompt if cache_text is None else cache_text)
+    if use_cache:
+        cached = response_cache.get(cache_key, fingerprint)
+        if cached is not None:
+            record_cache_hit("openai", model)
+            return cached
+    
+    def fetch(usage):
+        try:
+            response, reserved_tokens = create_openai_completion(prompt, model, json_mode=json_mode)
+            if response.usage is not None:
+                openai_rate_limiter.record_usage(reserved_tokens, response.usage.total_tokens)
+                usage["prompt_tokens"] = response.usage.prompt_tokens
+                usage["completion_tokens"] = response.usage.completion_tokens
+            usage["finish_reason"] = response.choices[0].finish_reason
+            content = response.choices[0].message.content
+            if use_cache and is_complete_response(content, usage["finish_reason"]):
+                response_cache.set(cache_key, content, fingerprint)
+            return content
+        except Exception as e:
+            print(f"Error querying OpenAI API: {str(e)}")
+            return f"Error: {str(e)}"
+    
+    # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+    if not use_cache:
+        return call_backend("openai", model, prompt, fetch)
+    return request_flights.do(cache_key, call_backend, "openai", model, prompt, fetch)
+
+def query_local_llama(prompt, model_name="llama3.2", use_cache=True, fingerprint=None, json_mode=False,
+                      cache_text=None):
     """
     Function to query local Llama 3.2 via Ollama with revised API handling.
     
     Args:
         prompt (str): The user prompt
         model_name (str): The name of your locally installed model
+        use_cache (bool): Set to False to bypass the response cache
+        fingerprint (tuple): Optional request fingerprint that lets a close
+            enough cached request answer this one
+        json_mode (bool): Ask for a JSON object instead of free text
+        cache_text (str): Text the cache key is built from instead of the
+            prompt, so requests that only differ cosmetically share an entry
     
     Returns:
         str: The model's response
     """
-    try:
-        # Using Ollama API with streaming disabled
-        response = requests.post(
-            "http://localhost:11434/api/generate",
-            json={
+    cache_key = make_cache_key("llama-json" if json_mode else "llama", model_name, None, None,
+                               prompt if cache_text is None else cache_text)
+    if use_cache:
+        cached = response_cache.get(cache_key, fingerprint)
+        if cached is not None:
+            record_cache_hit("llama", model_name)
+            return cached
+    
+    def fetch(usage):
+        try:
+            # Using Ollama API with streaming disabled
+            payload = {
                 "model": model_name,
                 "prompt": prompt,
                 "stream": False
-            },
-            timeout=120
-        )
-        
-        if response.status_code == 200:
-            # Parse the response carefully
-            result = response.json()
-            if "response" in result:
-                return result["response"]
+            }
+            if json_mode:
+                payload["format"] = "json"
+            response = post_to_ollama("/api/generate", payload)
+            
+            if response.status_code == 200:
+                # Parse the response carefully
+                result = response.json()
+                usage["prompt_tokens"] = result.get("prompt_eval_count")
+                usage["completion_tokens"] = result.get("eval_count")
+                usage["finish_reason"] = result.get("done_reason")
+                if "response" in result:
+                    # Older Ollama versions report done without a reason
+                    if use_cache and is_complete_response(result["response"], result.get("done_reason") or "stop"):
+                        response_cache.set(cache_key, result["response"], fingerprint)
+                    return result["response"]
+                else:
+                    return f"Unexpected response format: {json.dumps(result)}"
             else:
-                return f"Unexpected response format: {json.dumps(result)}"
-        else:
-            return f"Error: Status code {response.status_code}, {response.text}"
-    except Exception as e:
-        print(f"Error querying local Llama model: {str(e)}")
-        return f"Error: {str(e)}"
+                return f"Error: Status code {response.status_code}, {response.text}"
+        except Exception as e:
+            print(f"Error querying local Llama model: {str(e)}")
+            return f"Error: {str(e)}"
+    
+    # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+    if not use_cache:
+        return call_backend("llama", model_name, prompt, fetch)
+    return request_flights.do(cache_key, call_backend, "llama", model_name, prompt, fetch)
 
-def compare_models(prompt):
+def stream_openai_api(prompt, model="gpt-3.5-turbo", use_cache=True, fingerprint=None, cache_text=None):
+    """
+    Stream a response from OpenAI's API chunk by chunk.
+    
+    A cached response is yielded as a single chunk.
+    
+    Args:
+        prompt (str): The user prompt to send to the API
+        model (str): The model to use for generation
+        use_cache (bool): Set to False to bypass the response cache
+        fingerprint (tuple): Optional request fingerprint that lets a close
+            enough cached request answer this one
+        cache_text (str): Text the cache key is built from instead of the
+            prompt, so requests that only differ cosmetically share an entry
+    
+    Yields:
+        str: Pieces of the model's response as they arrive
+    """
+    cache_key = make_cache_key("openai", model, OPENAI_TEMPERATURE, OPENAI_MAX_TOKENS,
+                               prompt if cache_text is None else cache_text)
+    if use_cache:
+        cached = response_cache.get(cache_key, fingerprint)
+        if cached is not None:
+            record_cache_hit("openai", model)
+            yield cached
+            return
+    
+    def fetch(usage):
+        try:
+            stream, reserved_tokens = create_openai_completion(prompt, model, stream=True)
+        except Exception as e:
+            print(f"Error streaming from OpenAI API: {str(e)}")
+            yield f"Error: {str(e)}"
+            return
+        pieces = []
+        try:
+            with abortable(partial(drop_stream, stream.response)):
+                for chunk in stream:
+                    read_stream_usage(chunk, usage)
+                    if chunk.choices and chunk.choices[0].finish_reason:
+                        usage["finish_reason"] = chunk.choices[0].finish_reason
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        pieces.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            # A stream that ended without a finish reason was cut off
+            if use_cache and is_complete_response("".join(pieces), usage.get("finish_reason")):
+                response_cache.set(cache_key, "".join(pieces), fingerprint)
+        except Exception as e:
+            if aborted():
+                return
+            print(f"Error streaming from OpenAI API: {str(e)}")
+            yield f"Error: {str(e)}"
+        finally:
+            # Also runs for a stream that was dropped or failed part way
+            openai_rate_limiter.record_usage(reserved_tokens, streamed_tokens(prompt, pieces, usage))
+    
+    # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+    if not use_cache:
+        yield from stream_backend("openai", model, prompt, fetch)
+        return
+    yield from request_flights.stream("stream|" + cache_key, stream_backend, "openai", model, prompt, fetch)
+
+def stream_local_llama(prompt, model_name="llama3.2", use_cache=True, fingerprint=None, cache_text=None):
+    """
+    Stream a response from the local Llama model via Ollama's NDJSON API.
+    
+    A cached response is yielded as a single chunk.
+    
+    Args:
+        prompt (str): The user prompt
+        model_name (str): The name of your locally installed model
+        use_cache (bool): Set to False to bypass the response cache
+        fingerprint (tuple): Optional request fingerprint that lets a close
+            enough cached request answer this one
+        cache_text (str): Text the cache key is built from instead of the
+            prompt, so requests that only differ cosmetically share an entry
+    
+    Yields:
+        str: Pieces of the model's response as they arrive
+    """
+    cache_key = make_cache_key("llama", model_name, None, None, prompt if cache_text is None else cache_text)
+    if use_cache:
+        cached = response_cache.get(cache_key, fingerprint)
+        if cached is not None:
+            record_cache_hit("llama", model_name)
+            yield cached
+            return
+    
+    def fetch(usage):
+        try:
+            with post_to_ollama(
+                "/api/generate",
+                {
+                    "model": model_name,
+                    "prompt": prompt,
+                    "stream": True
+                },
+                stream=True
+            ) as response, abortable(partial(drop_stream, response)):
+                if response.status_code != 200:
+                    yield f"Error: Status code {response.status_code}, {response.text}"
+                    return
+                
+                # Each line is a JSON object carrying the next piece of the response
+                pieces = []
+                done = False
+                for line in response.iter_lines():
+                    if not line:
+                        continue
+                    result = json.loads(line)
+                    if "error" in result:
+                        yield f"Error: {result['error']}"
+                        return
+                    if result.get("response"):
+                        pieces.append(result["response"])
+                        yield result["response"]
+                    if result.get("done"):
+                        usage["prompt_tokens"] = result.get("prompt_eval_count")
+                        usage["completion_tokens"] = result.get("eval_count")
+                        usage["finish_reason"] = result.get("done_reason")
+                        done = True
+                        break
+                
+                # A stream that ended before its done line was cut off
+                if use_cache and done and is_complete_response("".join(pieces), usage["finish_reason"] or "stop"):
+                    response_cache.set(cache_key, "".join(pieces), fingerprint)
+        except Exception as e:
+            if aborted():
+                return
+            print(f"Error streaming from local Llama model: {str(e)}")
+            yield f"Error: {str(e)}"
+    
+    # Bypassing the cache asks for a fresh response, so it never shares another caller's call
+    if not use_cache:
+        yield from stream_backend("llama", model_name, prompt, fetch)
+        return
+    yield from request_flights.stream("stream|" + cache_key, stream_backend, "llama", model_name, prompt, fetch)
+
+def query_models_concurrently(calls, timeout=None):
+    """
+    Run several backend calls at the same time and collect their responses.
+    
+    Every call is submitted to the shared pool before any result is awaited, so
+    the wall time is that of the slowest backend rather than the sum. A backend
+    that misses its deadline gets an error string instead of holding back the
+    others.
+    
+    Args:
+        calls (dict): Maps a result label to a (function, args) tuple
+        timeout (float or dict): Seconds to wait for every call, or a dict of
+            per-label timeouts (labels missing from the dict wait indefinitely)
+    
+    Returns:
+        dict: Dictionary with the response for each label
+    """
+    start = time.monotonic()
+    # Each call runs in a copy of the caller's context so its request priority carries over
+    futures = {
+        label: fanout_executor.submit(contextvars.copy_context().run, function, *args)
+        for label, (function, args) in calls.items()
+    }
+    
+    results = {}
+    for label, future in futures.items():
+        limit = timeout.get(label) if isinstance(timeout, dict) else timeout
+        remaining = None if limit is None else max(0.0, start + limit - time.monotonic())
+        try:
+            results[label] = future.result(timeout=remaining)
+        except FutureTimeoutError:
+            # The worker keeps running in the background; we just stop waiting for it
+            future.cancel()
+            print(f"{label} did not respond within {limit} seconds")
+            results[label] = f"Error: {label} did not respond within {limit} seconds"
+        except Exception as e:
+            print(f"Error querying {label}: {str(e)}")
+            results[label] = f"Error: {str(e)}"
+    
+    return results
+
+def compare_models(prompt, timeout=None, fingerprint=None, cache_text=None):
     """
     Compare responses from both models for the same prompt.
     
+    Both backends are queried concurrently.
+    
     Args:
         prompt (str): The prompt to send to both models
+        timeout (float or dict): Optional overall or per-model timeout in seconds
+        fingerprint (tuple): Optional request fingerprint for similarity cache lookups
+        cache_text (str): Optional text the cache keys are built from instead of the prompt
     
     Returns:
         dict: Dictionary with model responses
     """
-    openai_response = query_openai_api(prompt)
-    llama_response = query_local_llama(prompt)
-    
-    return {
-        "OpenAI": openai_response,
-        "Llama 3.2": llama_response
-    }
+    return query_models_concurrently({
+        "OpenAI": (partial(query_openai_api, fingerprint=fingerprint, cache_text=cache_text), (prompt,)),
+        "Llama 3.2": (partial(query_local_llama, fingerprint=fingerprint, cache_text=cache_text), (prompt,))
+    }, timeout=timeout)
+
+# Set of travel-related test prompts
+TRAVEL_TEST_PROMPTS = [
+    "What are the top 3 tourist attractions in Barcelona that are off the beaten path?",
+    "Create a 3-day itinerary for Tokyo for a first-time visitor.",
+    "What's the best time of year to visit New Zealand and why?",
+    "Suggest some budget-friendly accommodations in Bali.",
+    "What cultural considerations should I be aware of when visiting Morocco?"
+]
+
+# A specific travel planning prompt used to compare the two models
+COMPARISON_PROMPT = """
+    I'm planning a 7-day trip to Italy in June with my family (2 adults, 2 children ages 10 and 14).
+    We're interested in historical sites, good food, and some outdoor activities.
+    Our budget is around $5000 excluding flights.
+    Can you suggest an itinerary that includes Rome and Florence?
+    """
 
 def test_travel_prompts():
     """
     Function to test both LLM setups with various travel-related prompts.
+    
+    Test traffic runs at background priority so it never delays real users.
     """
-    # Set of travel-related test prompts
-    test_prompts = [
-        "What are the top 3 tourist attractions in Barcelona that are off the beaten path?",
-        "Create a 3-day itinerary for Tokyo for a first-time visitor.",
-        "What's the best time of year to visit New Zealand and why?",
-        "Suggest some budget-friendly accommodations in Bali.",
-        "What cultural considerations should I be aware of when visiting Morocco?"
-    ]
+    test_prompts = TRAVEL_TEST_PROMPTS
     
     results = {}
     
-    print("\n===== TESTING PUBLIC API (OpenAI) =====\n")
-    for i, prompt in enumerate(test_prompts, 1):
-        print(f"\nTest Prompt {i}: {prompt}")
-        response = query_openai_api(prompt)
-        print(f"\nOpenAI Response:\n{response}\n")
-        print("-" * 80)
+    with request_priority(BACKGROUND):
+        print("\n===== TESTING PUBLIC API (OpenAI) =====\n")
+        for i, prompt in enumerate(test_prompts, 1):
+            print(f"\nTest Prompt {i}: {prompt}")
+            response = query_openai_api(prompt)
+            print(f"\nOpenAI Response:\n{response}\n")
+            print("-" * 80)
+            
+            # Store result
+            if i not in results:
+                results[i] = {}
+            results[i]["OpenAI"] = response
         
-        # Store result
-        if i not in results:
-            results[i] = {}
-        results[i]["OpenAI"] = response
-    
-    print("\n\n===== TESTING LOCAL LLAMA 3.2 =====\n")
-    for i, prompt in enumerate(test_prompts, 1):
-        print(f"\nTest Prompt {i}: {prompt}")
-        response = query_local_llama(prompt)
-        print(f"\nLlama 3.2 Response:\n{response}\n")
-        print("-" * 80)
-        
-        # Store result
-        if i not in results:
-            results[i] = {}
-        results[i]["Llama 3.2"] = response
+        print("\n\n===== TESTING LOCAL LLAMA 3.2 =====\n")
+        for i, prompt in enumerate(test_prompts, 1):
+            print(f"\nTest Prompt {i}: {prompt}")
+            response = query_local_llama(prompt)
+            print(f"\nLlama 3.2 Response:\n{response}\n")
+            print("-" * 80)
+            
+            # Store result
+            if i not in results:
+                results[i] = {}
+            results[i]["Llama 3.2"] = response
     
     return results
 
@@ -133,12 +913,7 @@ if __name__ == "__main__":
     results = test_travel_prompts()
     
     # Test a specific travel planning prompt
-    comparison_prompt = """
-    I'm planning a 7-day trip to Italy in June with my family (2 adults, 2 children ages 10 and 14).
-    We're interested in historical sites, good food, and some outdoor activities.
-    Our budget is around $5000 excluding flights.
-    Can you suggest an itinerary that includes Rome and Florence?
-    """
+    comparison_prompt = COMPARISON_PROMPT
     
     print("\n===== MODEL COMPARISON =====\n")
     print(f"Prompt: {comparison_prompt}\n")
@@ -1,34 +1,140 @@
 import os
+import sys
 import argparse
 
 def main():
     """
     Main entry point for the Travel Assistant application.
-    Allows selecting between CLI mode and web frontend.
+    Allows selecting between CLI mode, web frontend, batch generation and the HTTP API.
     """
+    # Settings in .env configure every module, so it is read before any of them is imported
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     parser = argparse.ArgumentParser(description="Personal Travel Assistant")
-    parser.add_argument("--mode", choices=["cli", "web"], default="web",
-                      help="Mode to run the assistant (cli or web)")
+    parser.add_argument("--mode", choices=["cli", "web", "batch", "api"], default="web",
+                      help="Mode to run the assistant (cli, web, batch or api)")
     parser.add_argument("--test-llm", action="store_true",
                       help="Run LLM tests before starting")
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("METRICS_PORT", "0")),
+                      help="Serve Prometheus metrics on this port in cli, web and batch mode "
+                           "(default METRICS_PORT; the api mode serves them at /metrics)")
+    
+    parser.add_argument("--benchmark", action="store_true",
+                      help="Run the latency benchmark and exit")
+    
+    parser.add_argument("--warm-cache", action="store_true",
+                      help="Pre-generate plans for the popular destinations into the response cache and exit")
+    
+    parser.add_argument("--startup-report", action="store_true",
+                      help="Report cold-start import time for each mode and exit")
+    parser.add_argument("--startup-budget", type=float,
+                      help="Exit with an error if a mode takes longer than this many ms to import")
+    parser.add_argument("--startup-output",
+                      help="JSON file the startup report is also written to")
+    
+    bench = parser.add_argument_group("benchmark")
+    bench.add_argument("--bench-backends", nargs="+", default=["openai", "llama"],
+                      help="Backends to benchmark")
+    bench.add_argument("--bench-corpus",
+                      help="JSON list or text file (one prompt per line) of prompts; defaults to the built-in test prompts")
+    bench.add_argument("--bench-repetitions", type=int, default=3,
+                      help="Times each prompt is sent per concurrency level")
+    bench.add_argument("--bench-concurrency", type=int, nargs="+", default=[1],
+                      help="Concurrency levels to benchmark")
+    bench.add_argument("--bench-output", default="benchmark_results.json",
+                      help="JSON file the results are written to")
+    
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--input", help="JSONL file of user_responses dicts to generate plans for")
+    batch.add_argument("--output", default="batch_plans.jsonl",
+                      help="JSONL file results are appended to")
+    batch.add_argument("--model", choices=["openai", "llama", "auto"], default="openai",
+                      help="Model for requests that don't specify one")
+    batch.add_argument("--workers", type=int, default=4,
+                      help="Number of requests processed at once")
+    batch.add_argument("--openai-concurrency", type=int, default=0,
+                      help="Maximum in-flight OpenAI calls (0 for no extra limit)")
+    batch.add_argument("--llama-concurrency", type=int, default=1,
+                      help="Maximum in-flight Llama calls (0 for no extra limit)")
+    batch.add_argument("--no-resume", action="store_true",
+                      help="Regenerate requests that already succeeded in the output file")
+    
+    api = parser.add_argument_group("api mode")
+    api.add_argument("--host", help="Interface the API listens on (default API_HOST or 0.0.0.0)")
+    api.add_argument("--port", type=int, help="Port the API listens on (default API_PORT or 8080)")
+    api.add_argument("--api-workers", type=int, help="Generations served at once (default API_WORKERS or 16)")
+    api.add_argument("--queue-size", type=int,
+                      help="Requests allowed to wait for a worker before getting a 503 (default API_QUEUE_SIZE or 64)")
     
     args = parser.parse_args()
     
+    if args.mode == "batch" and not args.input:
+        parser.error("--mode batch requires --input")
+    
+    if args.benchmark:
+        from benchmark import run_benchmark, load_corpus, print_benchmark_report, write_benchmark_report
+        report = run_benchmark(
+            backends=args.bench_backends,
+            corpus=load_corpus(args.bench_corpus) if args.bench_corpus else None,
+            repetitions=args.bench_repetitions,
+            concurrency_levels=args.bench_concurrency
+        )
+        print_benchmark_report(report)
+        write_benchmark_report(report, args.bench_output)
+        return
+    
+    if args.startup_report:
+        from startup_report import run_startup_report, print_startup_report, write_startup_report
+        report = run_startup_report()
+        within_budget = print_startup_report(report, args.startup_budget)
+        if args.startup_output:
+            write_startup_report(report, args.startup_output)
+        sys.exit(0 if within_budget else 1)
+    
+    if args.warm_cache:
+        from cache_warmer import warm_cache, print_warm_summary
+        print_warm_summary(warm_cache())
+        return
+    
     # Run LLM tests if requested
     if args.test_llm:
         print("Testing LLM configurations...")
         from llm_setup import test_travel_prompts
         test_travel_prompts()
     
+    if args.metrics_port and args.mode != "api":
+        from metrics import start_metrics_server
+        start_metrics_server(args.metrics_port)
+        print(f"Serving metrics on http://localhost:{args.metrics_port}/metrics")
+    
     # Launch the appropriate interface
     if args.mode == "cli":
         print("Starting CLI interface...")
         from dialogue_system import run_cli_dialogue
         run_cli_dialogue()
+    elif args.mode == "batch":
+        print(f"Generating travel plans from {args.input}...")
+        from batch_runner import run_batch, print_batch_summary
+        summary = run_batch(
+            args.input,
+            args.output,
+            model=args.model,
+            workers=args.workers,
+            backend_limits={"openai": args.openai_concurrency, "llama": args.llama_concurrency},
+            resume=not args.no_resume
+        )
+        print_batch_summary(summary)
+    elif args.mode == "api":
+        print("Starting HTTP API...")
+        from api_server import run_api_server
+        run_api_server(args.host, args.port, args.api_workers, args.queue_size)
     else:
         print("Starting web interface. Please wait...")
-        # We use os.system because streamlit needs to be run as a separate process
-        os.system("streamlit run frontend.py")
+        # Bootstrap Streamlit in this process instead of starting a second interpreter
+        from streamlit.web import cli as streamlit_cli
+        sys.argv = ["streamlit", "run", os.path.join(os.path.dirname(os.path.abspath(__file__)), "frontend.py")]
+        sys.exit(streamlit_cli.main())
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
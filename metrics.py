@@ -0,0 +1,375 @@
+import os
+import json
+import time
+import queue
+import atexit
+import bisect
+import threading
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+
+# Optional JSONL file that gets one line per LLM call
+LLM_TRACE_PATH = os.getenv("LLM_TRACE_PATH") or None
+# Seconds between batched writes to the trace file
+LLM_TRACE_FLUSH_INTERVAL = float(os.getenv("LLM_TRACE_FLUSH_INTERVAL", "1"))
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or ())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """
+    Monotonically increasing count, one series per combination of label values.
+    """
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        """
+        Args:
+            name (str): Metric name
+            help (str): One-line description
+            labels (tuple): Label names
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        """
+        Add to the series for the given label values.
+
+        Args:
+            *label_values: One value per label name, in order
+            amount (float): Amount to add
+        """
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        """
+        Read one series.
+
+        Returns:
+            float: Its current value, 0 if it was never incremented
+        """
+        with self._lock:
+            return self._values.get(label_values, 0)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+class Histogram:
+    """
+    Distribution of observed values in fixed buckets, one series per combination of label values.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Args:
+            name (str): Metric name
+            help (str): One-line description
+            labels (tuple): Label names
+            buckets (tuple): Ascending bucket upper bounds
+        """
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """
+        Record a value in the series for the given label values.
+
+        Args:
+            value (float): The observation
+            *label_values: One value per label name, in order
+        """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts (the last one is +Inf), then the sum of observations
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        with self._lock:
+            series = {key: list(counts) for key, counts in self._series.items()}
+        lines = []
+        for key, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    """
+    The process's metrics, rendered in the Prometheus text exposition format.
+
+    Besides counters and histograms updated on the request path, collectors
+    can be added to report point-in-time values (queue depths, open
+    circuits) that are only read when the metrics are scraped.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labels=()):
+        """
+        Create and register a Counter.
+
+        Returns:
+            Counter: The new counter
+        """
+        metric = Counter(name, help, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        """
+        Create and register a Histogram.
+
+        Returns:
+            Histogram: The new histogram
+        """
+        metric = Histogram(name, help, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """
+        Register a function called at scrape time.
+
+        Args:
+            collector (callable): Returns (name, type, help, samples) tuples, where
+                samples is a list of (labels dict, value) pairs
+        """
+        self._collectors.append(collector)
+
+    def remove_collector(self, collector):
+        """
+        Unregister a function added with add_collector.
+
+        Args:
+            collector (callable): The function to remove
+        """
+        if collector in self._collectors:
+            self._collectors.remove(collector)
+
+    def render(self):
+        """
+        Render every metric.
+
+        Returns:
+            str: Prometheus text format (version 0.0.4)
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {str(e)}")
+                continue
+            for name, kind, help, samples in collected:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+class TraceWriter:
+    """
+    Appends one JSON line per record to a file.
+
+    Records are queued and written in batches by a background thread, so a
+    call on the request path never waits for the disk.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        """
+        Args:
+            path (str): JSONL file to append to
+            flush_interval (float): Seconds between batched writes
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._write_lock = threading.Lock()
+        threading.Thread(target=self._write_periodically, name="llm-trace", daemon=True).start()
+        # Don't lose the last batch on a clean shutdown
+        atexit.register(self.flush)
+
+    def write(self, record):
+        """
+        Queue a record.
+
+        Args:
+            record (dict): JSON-serializable record
+        """
+        self._queue.put(record)
+
+    def _write_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Write every queued record.
+        """
+        with self._write_lock:
+            records = []
+            while True:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not records:
+                return
+            try:
+                with open(self.path, "a", encoding="utf-8") as trace:
+                    trace.write("".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records))
+            except OSError as e:
+                print(f"Error writing LLM trace: {str(e)}")
+
+# Metrics of this process, served by the API's /metrics endpoint or start_metrics_server
+registry = MetricsRegistry()
+
+llm_requests = registry.counter(
+    "llm_requests_total", "LLM requests by backend, model, cache result and outcome",
+    ("backend", "model", "cache", "outcome")
+)
+llm_request_seconds = registry.histogram(
+    "llm_request_seconds", "Wall time of upstream LLM calls", ("backend", "model")
+)
+llm_first_token_seconds = registry.histogram(
+    "llm_first_token_seconds", "Time to first token of streamed upstream LLM calls", ("backend", "model")
+)
+llm_prompt_tokens = registry.counter(
+    "llm_prompt_tokens_total", "Prompt tokens sent upstream", ("backend", "model")
+)
+llm_completion_tokens = registry.counter(
+    "llm_completion_tokens_total", "Completion tokens received from upstream", ("backend", "model")
+)
+llm_finish_reasons = registry.counter(
+    "llm_finish_reasons_total", "Upstream completions by finish reason", ("backend", "model", "reason")
+)
+
+trace_writer = TraceWriter(LLM_TRACE_PATH, LLM_TRACE_FLUSH_INTERVAL) if LLM_TRACE_PATH else None
+
+def record_llm_call(backend, model, outcome, seconds, first_token=None, prompt_tokens=0,
+                    completion_tokens=0, finish_reason=None, priority=None):
+    """
+    Record an upstream LLM call.
+
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name sent to the backend
+        outcome (str): "ok", "error" or "abandoned" (dropped before it finished)
+        seconds (float): Wall time of the call
+        first_token (float): Time to first token, for streamed calls
+        prompt_tokens (int): Prompt tokens, as reported by the backend or estimated
+        completion_tokens (int): Completion tokens, as reported by the backend or estimated
+        finish_reason (str): Why generation stopped, if the backend said
+        priority (str): Request priority, for the trace
+    """
+    llm_requests.inc(backend, model, "miss", outcome)
+    # A dropped call's duration is how long it was wanted, not how long the backend took
+    if outcome != "abandoned":
+        llm_request_seconds.observe(seconds, backend, model)
+    if first_token is not None:
+        llm_first_token_seconds.observe(first_token, backend, model)
+    llm_prompt_tokens.inc(backend, model, amount=prompt_tokens)
+    llm_completion_tokens.inc(backend, model, amount=completion_tokens)
+    if finish_reason:
+        llm_finish_reasons.inc(backend, model, finish_reason)
+    if trace_writer is not None:
+        trace_writer.write({
+            "time": round(time.time(), 3),
+            "backend": backend,
+            "model": model,
+            "cache": "miss",
+            "outcome": outcome,
+            "seconds": round(seconds, 4),
+            "first_token_seconds": None if first_token is None else round(first_token, 4),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "finish_reason": finish_reason,
+            "priority": priority
+        })
+
+def record_cache_hit(backend, model):
+    """
+    Record a request answered from the response cache.
+
+    Args:
+        backend (str): Backend name ("openai" or "llama")
+        model (str): Model name the request was for
+    """
+    llm_requests.inc(backend, model, "hit", "ok")
+    if trace_writer is not None:
+        trace_writer.write({"time": round(time.time(), 3), "backend": backend, "model": model,
+                            "cache": "hit", "outcome": "ok"})
+
+def start_metrics_server(port, host="0.0.0.0"):
+    """
+    Serve /metrics from a background thread, for processes without the HTTP API.
+
+    Args:
+        port (int): Port to listen on
+        host (str): Interface to bind
+
+    Returns:
+        ThreadingHTTPServer: The running server
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
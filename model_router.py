@@ -0,0 +1,229 @@
+import os
+import time
+import threading
+from collections import deque
+
+# Seconds of history the router learns from; older calls are forgotten so a backend that recovers is tried again
+ROUTER_WINDOW = float(os.getenv("ROUTER_WINDOW", "300"))
+# Calls a backend needs within the window before its estimate is trusted; backends with fewer are tried first
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "3"))
+
+def fit_line(points):
+    """
+    Least-squares fit of y = a + b * x, with both coefficients kept non-negative.
+
+    Args:
+        points (list): (x, y) pairs
+
+    Returns:
+        tuple: (a, b); b is 0 when the x values are too close together to fit a slope
+    """
+    count = len(points)
+    mean_x = sum(x for x, _ in points) / count
+    mean_y = sum(y for _, y in points) / count
+    spread = sum((x - mean_x) ** 2 for x, _ in points)
+    slope = 0.0
+    if count >= 3 and spread > 1e-9:
+        slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in points) / spread)
+    return max(0.0, mean_y - slope * mean_x), slope
+
+class ModelRouter:
+    """
+    Picks the backend expected to finish a request soonest.
+
+    For every backend it keeps the recent calls (prompt size, time to first
+    token, total time, response size, success) and the number in flight.
+    A request's expected completion time on a backend is its first-token
+    time for a prompt of that size, plus the time to generate a typical
+    response, plus the wait for a free slot when the backend is already
+    serving as many requests as it can run at once, stretched by its recent
+    error rate. Callers can add known waits such as a rate-limit queue.
+    """
+
+    def __init__(self, concurrency=None, window=None, min_samples=None):
+        """
+        Args:
+            concurrency (dict): Requests each backend serves at once before
+                new ones queue; backends not listed are assumed not to queue
+            window (float): Seconds of history used; defaults to ROUTER_WINDOW
+            min_samples (int): Calls needed before a backend's estimate is
+                trusted; defaults to ROUTER_MIN_SAMPLES
+        """
+        self.concurrency = dict(concurrency or {})
+        self.window = ROUTER_WINDOW if window is None else window
+        self.min_samples = ROUTER_MIN_SAMPLES if min_samples is None else min_samples
+        self._calls = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.routed = {}
+
+    @classmethod
+    def from_env(cls, prefixes):
+        """
+        Build a router with each backend's concurrency read from <prefix>_ROUTER_CONCURRENCY.
+
+        Args:
+            prefixes (dict): Environment variable prefix per backend name, e.g. {"openai": "OPENAI"}
+
+        Returns:
+            ModelRouter: The configured router
+        """
+        # A hosted API serves many requests at once; a local model usually runs one at a time
+        defaults = {"OPENAI": "32"}
+        return cls(concurrency={
+            name: int(os.getenv(f"{prefix}_ROUTER_CONCURRENCY", defaults.get(prefix, "1")))
+            for name, prefix in prefixes.items()
+        })
+
+    def started(self, backend):
+        """
+        Count a call that has been sent to a backend.
+
+        Args:
+            backend (str): Backend name
+        """
+        with self._lock:
+            self._in_flight[backend] = self._in_flight.get(backend, 0) + 1
+
+    def finished(self, backend, prompt_tokens, seconds, first_token=None, output_tokens=0, ok=True):
+        """
+        Record a call that has completed.
+
+        Args:
+            backend (str): Backend name
+            prompt_tokens (int): Estimated prompt size
+            seconds (float): Time until the whole response had arrived
+            first_token (float): Time until the first token, for streamed calls
+            output_tokens (int): Estimated response size
+            ok (bool): False if the call failed
+        """
+        with self._lock:
+            self._in_flight[backend] = max(0, self._in_flight.get(backend, 0) - 1)
+            self._calls.setdefault(backend, deque(maxlen=1000)).append(
+                (time.monotonic(), prompt_tokens, seconds, first_token, output_tokens, ok)
+            )
+
+    def abandoned(self, backend):
+        """
+        Release a call that was dropped before it completed, without recording it.
+
+        Args:
+            backend (str): Backend name
+        """
+        with self._lock:
+            self._in_flight[backend] = max(0, self._in_flight.get(backend, 0) - 1)
+
+    def _recent(self, backend):
+        # Caller holds the lock
+        calls = self._calls.get(backend)
+        if not calls:
+            return []
+        cutoff = time.monotonic() - self.window
+        while calls and calls[0][0] < cutoff:
+            calls.popleft()
+        return list(calls)
+
+    def estimate(self, backend, prompt_tokens, extra_wait=0.0):
+        """
+        Estimate how long a backend would take to complete a request.
+
+        Args:
+            backend (str): Backend name
+            prompt_tokens (int): Estimated prompt size
+            extra_wait (float): Known wait before the request can be sent, e.g. a rate-limit queue
+
+        Returns:
+            float: Seconds, or None when the backend has too few recent calls to tell
+        """
+        with self._lock:
+            calls = self._recent(backend)
+            in_flight = self._in_flight.get(backend, 0)
+        if len(calls) < self.min_samples:
+            return None
+        succeeded = [call for call in calls if call[5]]
+        if not succeeded:
+            return float("inf")
+
+        # Generation speed, from streamed calls that report when their first token arrived
+        per_token = [
+            (seconds - first_token) / output_tokens
+            for _, _, seconds, first_token, output_tokens, _ in succeeded
+            if first_token is not None and output_tokens > 0
+        ]
+        output_tokens = sum(call[4] for call in succeeded) / len(succeeded)
+        if per_token:
+            seconds_per_token = sorted(per_token)[len(per_token) // 2]
+            # Time before generation starts grows with the prompt, most visibly on a local CPU
+            startup = [
+                (prompt, first_token if first_token is not None else max(0.0, seconds - output * seconds_per_token))
+                for _, prompt, seconds, first_token, output, _ in succeeded
+            ]
+            base, per_prompt_token = fit_line(startup)
+            service = base + per_prompt_token * prompt_tokens + seconds_per_token * output_tokens
+        else:
+            base, per_prompt_token = fit_line([(call[1], call[2]) for call in succeeded])
+            service = base + per_prompt_token * prompt_tokens
+
+        concurrency = self.concurrency.get(backend)
+        queued = 0 if not concurrency else max(0, in_flight + 1 - concurrency) / concurrency
+        error_rate = 1 - len(succeeded) / len(calls)
+        return (extra_wait + service * (1 + queued)) / (1 - min(error_rate, 0.9))
+
+    def choose(self, prompt_tokens, candidates, extra_wait=None):
+        """
+        Pick the backend for a request.
+
+        Backends without enough recent calls are tried first (unless they are
+        already busy), so every backend keeps being measured.
+
+        Args:
+            prompt_tokens (int): Estimated prompt size
+            candidates (list): Backend names to choose from, in order of preference for ties
+            extra_wait (dict): Optional known wait per backend, e.g. a rate-limit queue
+
+        Returns:
+            str: The chosen backend name
+        """
+        extra_wait = extra_wait or {}
+        estimates = {name: self.estimate(name, prompt_tokens, extra_wait.get(name, 0.0)) for name in candidates}
+        with self._lock:
+            unexplored = [
+                name for name, estimate in estimates.items()
+                if estimate is None and self._in_flight.get(name, 0) < (self.concurrency.get(name) or float("inf"))
+            ]
+        if unexplored:
+            choice = unexplored[0]
+        else:
+            known = {name: estimate for name, estimate in estimates.items() if estimate is not None}
+            choice = min(known, key=known.get) if known else candidates[0]
+        with self._lock:
+            self.routed[choice] = self.routed.get(choice, 0) + 1
+        return choice
+
+    def stats(self):
+        """
+        Report what the router currently knows about each backend.
+
+        Returns:
+            dict: Per backend: calls in the window, error rate, calls in flight,
+                requests routed to it and the expected seconds for a 500-token prompt
+                (None while unknown or when every recent call failed)
+        """
+        with self._lock:
+            names = set(self._calls) | set(self._in_flight) | set(self.routed)
+            recent = {name: self._recent(name) for name in names}
+            in_flight = dict(self._in_flight)
+            routed = dict(self.routed)
+        report = {}
+        for name in sorted(names):
+            calls = recent[name]
+            failed = sum(1 for call in calls if not call[5])
+            expected = self.estimate(name, 500)
+            report[name] = {
+                "calls": len(calls),
+                "error_rate": failed / len(calls) if calls else 0.0,
+                "in_flight": in_flight.get(name, 0),
+                "routed": routed.get(name, 0),
+                "expected_seconds": None if expected in (None, float("inf")) else round(expected, 2)
+            }
+        return report
@@ -0,0 +1,231 @@
+import re
+
+# Markdown headings ("## Day 3: Rome") and bold lines used as headings ("**Day 3: Rome**")
+HEADING_PATTERN = re.compile(r"^\s*(#{1,6})\s+(.+?)\s*#*\s*$")
+BOLD_HEADING_PATTERN = re.compile(r"^\s*\*\*(.+?)\*\*:?\s*$")
+
+# Section keys and the heading words that identify them, checked in order
+SECTION_KEYWORDS = [
+    ("accommodation", ("accommodation", "where to stay", "hotel", "lodging", "stay")),
+    ("dining", ("dining", "restaurant", "food", "cuisine", "where to eat", "meal")),
+    ("costs", ("cost", "budget", "price", "expense")),
+    ("tips", ("tip", "advice", "practical", "know before"))
+]
+
+# Words in a refinement request that point at each section
+REFINEMENT_KEYWORDS = {
+    "accommodation": ("accommodation", "hotel", "hostel", "apartment", "airbnb", "lodging", "room"),
+    "dining": ("dining", "restaurant", "food", "eat", "dinner", "lunch", "breakfast", "cuisine",
+               "vegan", "vegetarian", "gluten", "halal", "kosher", "meal", "cafe"),
+    "costs": ("cost", "budget", "price", "expensive", "cheaper", "cheap", "afford", "spend", "$"),
+    "tips": ("tip", "advice", "transport", "visa", "currency", "safety", "packing", "pack ")
+}
+
+# Topics that stay within the named days when a request mentions specific days
+# ("a vegan dinner on day 3" rewrites day 3, not the dining section)
+DAY_SCOPED_SECTIONS = ("dining", "costs", "tips")
+
+# Requests that change the shape of the whole plan and need a full rewrite
+WHOLE_PLAN_PATTERN = re.compile(
+    r"\b(whole|entire|overall|everything|every day|each day|all days|all the days|rewrite|start over|"
+    r"(add|extra|another|one more|remove|drop|fewer|more) (\w+ )?days?\b(?! ?trip)|shorten|lengthen|extend)",
+    re.IGNORECASE
+)
+
+ORDINAL_DAYS = {
+    "first": 1, "second": 2, "third": 3, "fourth": 4, "fifth": 5, "sixth": 6, "seventh": 7,
+    "eighth": 8, "ninth": 9, "tenth": 10, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10
+}
+
+# Characters of the plan's opening kept as context for section rewrites
+PREAMBLE_CONTEXT_CHARS = 600
+
+def _parse_heading(line):
+    # Returns (level, title) for a heading line, or None; bold headings rank below markdown ones
+    match = HEADING_PATTERN.match(line)
+    if match:
+        return len(match.group(1)), match.group(2).strip()
+    match = BOLD_HEADING_PATTERN.match(line)
+    if match:
+        return 7, match.group(1).strip()
+    return None
+
+def classify_heading(title):
+    """
+    Work out which plan section a heading introduces.
+
+    Args:
+        title (str): Heading text without markdown markers
+
+    Returns:
+        str: Section key ("day-3", "accommodation", "dining", "costs", "tips"), or None
+    """
+    lowered = title.lower()
+    match = re.search(r"\bday\s*(\d+)", lowered)
+    if match:
+        return f"day-{int(match.group(1))}"
+    for key, words in SECTION_KEYWORDS:
+        if any(word in lowered for word in words):
+            return key
+    return None
+
+def split_plan_sections(plan):
+    """
+    Split a generated plan into addressable sections.
+
+    The heading level of the first recognised section (a day, accommodation,
+    dining, costs or tips heading) is taken as the section level. Every
+    heading at that level or above starts a new section, and deeper headings
+    stay inside their parent. Text before the first section is the preamble.
+
+    Args:
+        plan (str): The travel plan
+
+    Returns:
+        list: Section dicts with "key", "title" and "text"; joining the texts
+            gives back the original plan
+    """
+    lines = plan.splitlines(keepends=True)
+    headings = []
+    for index, line in enumerate(lines):
+        parsed = _parse_heading(line)
+        if parsed:
+            headings.append((index, *parsed))
+    levels = [level for _, level, title in headings if classify_heading(title)]
+    if not levels:
+        return [{"key": "preamble", "title": "", "text": plan}]
+    section_level = min(levels)
+
+    sections = [{"key": "preamble", "title": "", "start": 0}]
+    seen = {"preamble"}
+    for index, level, title in headings:
+        # Deeper headings stay in their section; a title above the first section stays in the preamble
+        if level > section_level or level < section_level and len(sections) == 1:
+            continue
+        key = classify_heading(title) or re.sub(r"[^a-z0-9]+", "-", title.lower()).strip("-") or "section"
+        base, suffix = key, 2
+        while key in seen:
+            key, suffix = f"{base}-{suffix}", suffix + 1
+        seen.add(key)
+        sections.append({"key": key, "title": title, "start": index})
+
+    for section, following in zip(sections, sections[1:] + [{"start": len(lines)}]):
+        section["text"] = "".join(lines[section.pop("start"):following["start"]])
+    return [section for section in sections if section["text"] or section["key"] != "preamble"]
+
+def join_plan_sections(sections):
+    """
+    Reassemble a plan from its sections.
+
+    Args:
+        sections (list): Output of split_plan_sections, possibly with rewritten texts
+
+    Returns:
+        str: The plan
+    """
+    return "".join(section["text"] for section in sections)
+
+def _requested_days(request, day_numbers):
+    # Day numbers a refinement request mentions, e.g. "day 3", "days 2-4", "third day", "last day"
+    lowered = request.lower()
+    days = set()
+    for match in re.finditer(r"\bdays?\s*(\d+)(?:\s*(?:-|–|to|and|&)\s*(\d+))?", lowered):
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        days.update(range(first, last + 1))
+    for word, number in ORDINAL_DAYS.items():
+        if re.search(rf"\b{word} day\b|\bday {word}\b", lowered):
+            days.add(number)
+    if day_numbers and re.search(r"\b(last|final) day\b", lowered):
+        days.add(max(day_numbers))
+    return days
+
+def route_refinement(sections, refinement_request):
+    """
+    Decide which sections of a plan a refinement request touches.
+
+    Args:
+        sections (list): Output of split_plan_sections
+        refinement_request (str): User's refinement request
+
+    Returns:
+        list: Keys of the sections to regenerate, or None when the request
+            cannot be confined to sections and the whole plan must be rewritten
+    """
+    keys = [section["key"] for section in sections]
+    day_numbers = [int(key.split("-")[1]) for key in keys if re.fullmatch(r"day-\d+", key)]
+    if not day_numbers or WHOLE_PLAN_PATTERN.search(refinement_request):
+        return None
+
+    targets = {f"day-{number}" for number in _requested_days(refinement_request, day_numbers)}
+    lowered = refinement_request.lower()
+    for key, words in REFINEMENT_KEYWORDS.items():
+        if targets and key in DAY_SCOPED_SECTIONS:
+            continue
+        if any(re.search(rf"\b{re.escape(word)}", lowered) if word[0].isalpha() else word in lowered
+               for word in words):
+            targets.add(key)
+
+    if not targets or not targets.issubset(keys) or len(targets) * 2 > len(keys):
+        return None
+    return [key for key in keys if key in targets]
+
+def plan_outline(sections):
+    """
+    Summarize a plan as its opening text and section headings.
+
+    Args:
+        sections (list): Output of split_plan_sections
+
+    Returns:
+        str: Compact context for rewriting one section
+    """
+    preamble = sections[0]["text"].strip() if sections[0]["key"] == "preamble" else ""
+    if len(preamble) > PREAMBLE_CONTEXT_CHARS:
+        preamble = preamble[:PREAMBLE_CONTEXT_CHARS].rsplit(" ", 1)[0] + "..."
+    headings = "\n".join(f"- {section['title']}" for section in sections if section["title"])
+    return f"{preamble}\n\nSections:\n{headings}".strip()
+
+def splice_section(section, chunks):
+    """
+    Fit a rewritten section back into the plan's layout as it streams in.
+
+    The model is asked for the section body only, so the original heading is
+    emitted first and a heading the model repeats anyway is dropped. The
+    blank lines that separated the section from the next one are kept.
+
+    Args:
+        section (dict): The original section
+        chunks (iterable): Pieces of the model's rewrite
+
+    Yields:
+        str: Pieces of the text that replaces the section
+    """
+    heading, _, _ = section["text"].partition("\n")
+    yield heading + "\n"
+
+    buffer = ""
+    checked_heading = False
+    pending_newlines = ""
+    for chunk in chunks:
+        if not checked_heading:
+            buffer = (buffer + chunk).lstrip("\n")
+            if "\n" not in buffer:
+                continue
+            first_line, _, rest = buffer.partition("\n")
+            parsed = _parse_heading(first_line)
+            if parsed and classify_heading(parsed[1]) == classify_heading(section["title"]):
+                buffer = rest.lstrip("\n")
+            checked_heading = True
+            chunk, buffer = buffer, ""
+        # Hold back trailing newlines so the section ends with its original spacing
+        body = chunk.rstrip("\n")
+        if body:
+            yield pending_newlines + body
+            pending_newlines = chunk[len(body):]
+        else:
+            pending_newlines += chunk
+    if buffer.strip():
+        yield buffer.rstrip("\n")
+    yield section["text"][len(section["text"].rstrip("\n")):] or "\n"
@@ -0,0 +1,338 @@
+import os
+import time
+import heapq
+import asyncio
+import random
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Request priorities; lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Priority of LLM calls made from the current thread or task
+_current_priority = contextvars.ContextVar("llm_request_priority", default=INTERACTIVE)
+
+@contextmanager
+def request_priority(priority):
+    """
+    Run a block of code with a given LLM request priority.
+
+    Batch jobs and test runs wrap their work in request_priority(BACKGROUND)
+    so user-facing requests are always served first.
+
+    Args:
+        priority (int): INTERACTIVE or BACKGROUND
+    """
+    token = _current_priority.set(priority)
+    try:
+        yield
+    finally:
+        _current_priority.reset(token)
+
+def current_priority():
+    """
+    Return the LLM request priority of the current thread or task.
+
+    Returns:
+        int: INTERACTIVE or BACKGROUND
+    """
+    return _current_priority.get()
+
+def retry_after_seconds(error, attempt, base=1.0):
+    """
+    Work out how long to wait before retrying a throttled request.
+
+    Uses the server's Retry-After (or retry-after-ms) header when present,
+    otherwise exponential backoff with full jitter.
+
+    Args:
+        error (Exception): The rate-limit error; its .response headers are read if present
+        attempt (int): Zero-based retry attempt
+        base (float): Base backoff in seconds
+
+    Returns:
+        float: Seconds to wait
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return random.uniform(0, base * 2 ** attempt)
+
+class RateLimiter:
+    """
+    Process-wide token-bucket limiter for requests/minute and tokens/minute.
+
+    Callers that cannot be served immediately queue instead of failing, and
+    the queue is ordered by priority, then arrival. Threads wait with
+    acquire and coroutines with aacquire, in the same queue. After a 429
+    response the whole limiter pauses for the server's Retry-After.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        """
+        Args:
+            requests_per_minute (float): Request budget per minute (0 for unlimited)
+            tokens_per_minute (float): Token budget per minute (0 for unlimited)
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests_available = float(requests_per_minute)
+        self._tokens_available = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._condition = threading.Condition()
+        self._waiters = []
+        # Queue entries of waiting coroutines, mapped to their loop and wake-up event
+        self._async_waiters = {}
+        self._sequence = itertools.count()
+        self.granted = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.wait_by_priority = {}
+
+    @classmethod
+    def from_env(cls, prefix):
+        """
+        Build a limiter from <prefix>_REQUESTS_PER_MINUTE and <prefix>_TOKENS_PER_MINUTE.
+
+        Args:
+            prefix (str): Environment variable prefix, e.g. "OPENAI"
+
+        Returns:
+            RateLimiter: The configured limiter
+        """
+        return cls(
+            requests_per_minute=float(os.getenv(f"{prefix}_REQUESTS_PER_MINUTE", "3500")),
+            tokens_per_minute=float(os.getenv(f"{prefix}_TOKENS_PER_MINUTE", "90000"))
+        )
+
+    def _refill(self, now):
+        # Caller holds the lock
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests_available = min(
+                self.requests_per_minute,
+                self._requests_available + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._tokens_available = min(
+                self.tokens_per_minute,
+                self._tokens_available + elapsed * self.tokens_per_minute / 60
+            )
+
+    def _time_until_ready(self, now, tokens):
+        # Caller holds the lock; seconds until the head of the queue can be served
+        wait = self._blocked_until - now
+        if self.requests_per_minute and self._requests_available < 1:
+            wait = max(wait, (1 - self._requests_available) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute and self._tokens_available < tokens:
+            wait = max(wait, (tokens - self._tokens_available) * 60 / self.tokens_per_minute)
+        return wait
+
+    def _notify_all(self):
+        # Caller holds the lock; wakes waiting threads and coroutines alike
+        self._condition.notify_all()
+        for loop, event in self._async_waiters.values():
+            loop.call_soon_threadsafe(event.set)
+
+    def _try_grant(self, entry, tokens):
+        # Caller holds the lock; reserves the request if it is at the head of the
+        # queue and fits, otherwise returns the seconds worth waiting before re-checking
+        now = time.monotonic()
+        self._refill(now)
+        if self._waiters[0] != entry:
+            return 1.0
+        wait = self._time_until_ready(now, tokens)
+        if wait > 0:
+            return wait
+        heapq.heappop(self._waiters)
+        if self.requests_per_minute:
+            self._requests_available -= 1
+        if self.tokens_per_minute:
+            self._tokens_available -= tokens
+        self._async_waiters.pop(entry, None)
+        # Let the next waiter re-check the budgets
+        self._notify_all()
+        return None
+
+    def _withdraw(self, entry):
+        # Caller holds the lock; drops a waiter that gave up
+        self._async_waiters.pop(entry, None)
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+            self._notify_all()
+
+    def _record_grant(self, priority, waited):
+        # Caller holds the lock
+        self.granted += 1
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        self.wait_by_priority[name] = self.wait_by_priority.get(name, 0.0) + waited
+
+    def _prepare(self, tokens, priority):
+        # Fills in the default priority and caps the token estimate
+        if priority is None:
+            priority = current_priority()
+        if self.tokens_per_minute:
+            # A request larger than the whole budget would otherwise never run
+            tokens = min(tokens, self.tokens_per_minute)
+        return tokens, priority
+
+    def acquire(self, tokens=1, priority=None):
+        """
+        Wait until the request fits in both budgets, then reserve it.
+
+        Args:
+            tokens (int): Estimated prompt plus completion tokens
+            priority (int): INTERACTIVE or BACKGROUND; defaults to the current priority
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        tokens, priority = self._prepare(tokens, priority)
+        start = time.monotonic()
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while True:
+                    wait = self._try_grant(entry, tokens)
+                    if wait is None:
+                        break
+                    self._condition.wait(wait)
+            except BaseException:
+                self._withdraw(entry)
+                raise
+            waited = time.monotonic() - start
+            self._record_grant(priority, waited)
+        return waited
+
+    async def aacquire(self, tokens=1, priority=None):
+        """
+        Wait on the event loop until the request fits in both budgets, then reserve it.
+
+        The coroutine queues alongside threads calling acquire. If it is
+        cancelled while queued, it leaves the queue without using the budget.
+
+        Args:
+            tokens (int): Estimated prompt plus completion tokens
+            priority (int): INTERACTIVE or BACKGROUND; defaults to the current priority
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        tokens, priority = self._prepare(tokens, priority)
+        start = time.monotonic()
+        wakeup = asyncio.Event()
+        with self._condition:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiters, entry)
+            self._async_waiters[entry] = (asyncio.get_running_loop(), wakeup)
+        try:
+            while True:
+                with self._condition:
+                    wakeup.clear()
+                    wait = self._try_grant(entry, tokens)
+                    if wait is None:
+                        waited = time.monotonic() - start
+                        self._record_grant(priority, waited)
+                        return waited
+                try:
+                    await asyncio.wait_for(wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self._condition:
+                self._withdraw(entry)
+            raise
+
+    def record_usage(self, reserved_tokens, actual_tokens):
+        """
+        Correct the token budget once the real usage of a request is known.
+
+        Args:
+            reserved_tokens (int): Tokens reserved by acquire
+            actual_tokens (int): Tokens the API reported using
+        """
+        if not self.tokens_per_minute or actual_tokens is None:
+            return
+        with self._condition:
+            self._tokens_available = min(
+                self.tokens_per_minute,
+                self._tokens_available + reserved_tokens - actual_tokens
+            )
+            self._notify_all()
+
+    def penalize(self, retry_after):
+        """
+        Pause every queued request after the server returned 429.
+
+        Args:
+            retry_after (float): Seconds the server asked us to wait
+        """
+        with self._condition:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            self._notify_all()
+
+    def estimated_wait(self, tokens=1):
+        """
+        Estimate how long a new request would wait before it is granted.
+
+        Requests already queued are assumed to be about the size of this one.
+
+        Args:
+            tokens (int): Estimated prompt plus completion tokens
+
+        Returns:
+            float: Seconds, 0 if the request could go right away
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            ahead = len(self._waiters) + 1
+            wait = self._blocked_until - now
+            if self.requests_per_minute:
+                wait = max(wait, (ahead - self._requests_available) * 60 / self.requests_per_minute)
+            if self.tokens_per_minute:
+                needed = ahead * min(tokens, self.tokens_per_minute)
+                wait = max(wait, (needed - self._tokens_available) * 60 / self.tokens_per_minute)
+            return max(0.0, wait)
+
+    def stats(self):
+        """
+        Report queue depth and waiting times.
+
+        Returns:
+            dict: Queue depth (total and per priority), grants, 429 count and wait times
+        """
+        with self._condition:
+            queued = {}
+            for priority, _ in self._waiters:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                queued[name] = queued.get(name, 0) + 1
+            return {
+                "queue_depth": len(self._waiters),
+                "queued_by_priority": queued,
+                "granted": self.granted,
+                "throttled": self.throttled,
+                "average_wait": self.total_wait / self.granted if self.granted else 0.0,
+                "max_wait": self.max_wait,
+                "wait_by_priority": dict(self.wait_by_priority),
+                "blocked_for": max(0.0, self._blocked_until - time.monotonic())
+            }
@@ -0,0 +1,418 @@
+import re
+import zlib
+
+# Canonical names for destinations, keyed by the lowercase aliases users type
+DESTINATION_ALIASES = {
+    "paris": "Paris, France",
+    "paris france": "Paris, France",
+    "tokyo": "Tokyo, Japan",
+    "tokyo japan": "Tokyo, Japan",
+    "rome": "Rome, Italy",
+    "roma": "Rome, Italy",
+    "rome italy": "Rome, Italy",
+    "athens": "Athens, Greece",
+    "athens greece": "Athens, Greece",
+    "bangkok": "Bangkok, Thailand",
+    "bangkok thailand": "Bangkok, Thailand",
+    "mexico city": "Mexico City, Mexico",
+    "mexico city mexico": "Mexico City, Mexico",
+    "cdmx": "Mexico City, Mexico",
+    "barcelona": "Barcelona, Spain",
+    "barcelona spain": "Barcelona, Spain",
+    "london": "London, United Kingdom",
+    "london uk": "London, United Kingdom",
+    "new york": "New York City, USA",
+    "new york city": "New York City, USA",
+    "nyc": "New York City, USA",
+    "bali": "Bali, Indonesia",
+    "kyoto": "Kyoto, Japan",
+    "florence": "Florence, Italy",
+    "venice": "Venice, Italy",
+    "lisbon": "Lisbon, Portugal",
+    "amsterdam": "Amsterdam, Netherlands",
+    "sydney": "Sydney, Australia",
+    "istanbul": "Istanbul, Turkey",
+    "marrakech": "Marrakech, Morocco",
+    "marrakesh": "Marrakech, Morocco",
+    "new zealand": "New Zealand",
+    "italy": "Italy",
+    "japan": "Japan",
+    "greece": "Greece",
+    "thailand": "Thailand",
+    "morocco": "Morocco"
+}
+
+# Conversational filler stripped from free-text answers
+_FILLER_PATTERN = re.compile(
+    r"^(i'?d like to|i would like to|i want to|we'?d like to|we want to|"
+    r"planning to|thinking of|hoping to)?\s*(go|travel|visit|see|head)?\s*(to)?\s+"
+)
+
+# Answers that mean the user has nothing to add
+_EMPTY_ANSWERS = {"", "no", "none", "nope", "n/a", "na", "nothing", "not really", "no preference", "-",
+                  "nil", "no preferences", "no restrictions", "no dietary restrictions", "no thanks",
+                  "none thanks", "not sure", "anything", "any"}
+
+_NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5,
+    "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10, "eleven": 11,
+    "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20, "thirty": 30
+}
+# Longest words first so "fourteen" isn't read as "four"
+_NUMBER = r"(\d+|" + "|".join(sorted(_NUMBER_WORDS, key=len, reverse=True)) + r")"
+_DURATION_PATTERN = re.compile(
+    r"(?:\b" + _NUMBER + r"\s*(?:-|to)\s*)?\b" + _NUMBER + r"[\s-]*(day|night|week|fortnight)s?\b"
+)
+_MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september",
+           "october", "november", "december"]
+_MONTH_PATTERN = re.compile(
+    r"\b(" + "|".join(_MONTHS) + r"|spring|summer|autumn|fall|winter)\b"
+)
+# Date spans such as "june 3 to june 13" or "3 to 13 june"
+_MONTH_NAMES = "(" + "|".join(_MONTHS) + ")"
+_DATE_SPAN_PATTERNS = [
+    re.compile(_MONTH_NAMES + r"\s+(\d{1,2})(?:st|nd|rd|th)?\s*(?:-|to|until|till)\s*(?:"
+               + _MONTH_NAMES + r"\s+)?(\d{1,2})(?:st|nd|rd|th)?\b"),
+    re.compile(r"\b(\d{1,2})(?:st|nd|rd|th)?\s*(?:" + _MONTH_NAMES + r"\s*)?(?:-|to|until|till)\s*"
+               r"(\d{1,2})(?:st|nd|rd|th)?\s+" + _MONTH_NAMES + r"\b")
+]
+_MONTH_DAYS = [31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# Upper bounds (inclusive) of the trip-length buckets, in days
+DURATION_BUCKETS = [3, 7, 10, 14, 21]
+
+_CURRENCY_SYMBOLS = {"$": "$", "usd": "$", "dollars": "$", "€": "€", "eur": "€", "euros": "€",
+                     "£": "£", "gbp": "£", "pounds": "£", "¥": "¥", "jpy": "¥", "yen": "¥",
+                     "aud": "A$", "cad": "C$"}
+_BUDGET_PATTERN = re.compile(
+    r"(\$|€|£|¥|usd|eur|gbp|jpy|aud|cad)?\s*(\d[\d,]*(?:\.\d+)?)\s*(k\b)?\s*"
+    r"(usd|eur|gbp|jpy|aud|cad|dollars|euros|pounds|yen)?"
+)
+
+# Upper bounds (exclusive) of the budget buckets, in the user's currency
+BUDGET_BUCKETS = [500, 1000, 2000, 3500, 5000, 7500, 10000, 15000]
+
+# Fields that identify a trip closely enough to group similar requests together
+_GROUP_FIELDS = ("travel_destination", "travel_dates", "budget")
+
+def canonicalize_text(text):
+    """
+    Canonicalize whitespace, case and trailing punctuation of a free-text answer.
+
+    Args:
+        text (str): Raw user answer
+
+    Returns:
+        str: Canonical answer, or an empty string if the user gave nothing useful
+    """
+    text = " ".join(str(text).split()).lower().strip(" .!,;")
+    return "" if text in _EMPTY_ANSWERS else text
+
+def canonicalize_destination(text):
+    """
+    Map a destination answer to its canonical name.
+
+    Args:
+        text (str): Raw destination answer, e.g. "I'd like to visit Paris"
+
+    Returns:
+        str: Canonical destination, e.g. "Paris, France"
+    """
+    text = canonicalize_text(text)
+    if not text:
+        return ""
+
+    cleaned = re.sub(r"[^\w\s']", " ", text)
+    cleaned = _FILLER_PATTERN.sub("", " ".join(cleaned.split()))
+    # Only the whole answer is mapped, so "new york state" doesn't become New York City
+    if cleaned in DESTINATION_ALIASES:
+        return DESTINATION_ALIASES[cleaned]
+
+    return _FILLER_PATTERN.sub("", text).title()
+
+def extract_trip_days(text):
+    """
+    Pull the trip length out of a dates/duration answer.
+
+    Ranges such as "3-4 days" count as their upper end.
+
+    Args:
+        text (str): Answer such as "10 days in August", "two weeks" or "June 3 to June 13"
+
+    Returns:
+        int: Trip length in days, or None if no duration was found
+    """
+    text = canonicalize_text(text)
+    match = _DURATION_PATTERN.search(text)
+    if match:
+        count = match.group(2)
+        count = int(count) if count.isdigit() else _NUMBER_WORDS[count]
+        unit = match.group(3)
+        if unit == "week":
+            return count * 7
+        if unit == "fortnight":
+            return count * 14
+        return count
+    days = _date_span_days(text)
+    if days is not None:
+        return days
+    if "weekend" in text:
+        return 2
+    if "fortnight" in text:
+        return 14
+    if "week" in text:
+        return 7
+    return None
+
+def _date_span_days(text):
+    # Inclusive length of a span such as "june 3 to june 13" or "28 july - 4 august"
+    match = _DATE_SPAN_PATTERNS[0].search(text)
+    if match:
+        start_month, start, end_month, end = match.groups()
+    else:
+        match = _DATE_SPAN_PATTERNS[1].search(text)
+        if not match:
+            return None
+        start, start_month, end, end_month = match.groups()
+        start_month = start_month or end_month
+    end_month = end_month or start_month
+    first = _MONTHS.index(start_month)
+    last = _MONTHS.index(end_month)
+    days = 0
+    month = first
+    while month != last:
+        days += _MONTH_DAYS[month]
+        month = (month + 1) % 12
+    days += int(end) - int(start) + 1
+    return days if 0 < days <= 366 else None
+
+def bucket_duration(days):
+    """
+    Map a trip length onto a duration bucket.
+
+    Args:
+        days (int): Trip length in days
+
+    Returns:
+        str: Bucket label such as "4-7 days"
+    """
+    lower = 1
+    for upper in DURATION_BUCKETS:
+        if days <= upper:
+            return f"{lower}-{upper} days"
+        lower = upper + 1
+    return f"{lower}+ days"
+
+def normalize_travel_dates(text):
+    """
+    Reduce a dates/duration answer to the trip length plus the month or season.
+
+    The exact length is kept, since a 2-day and a 3-day trip need different
+    plans; request_fingerprint buckets it to group similar requests.
+
+    Args:
+        text (str): Raw dates/duration answer
+
+    Returns:
+        str: Canonical answer such as "9 days in august"
+    """
+    canonical = canonicalize_text(text)
+    days = extract_trip_days(canonical)
+    if days is None:
+        return canonical
+
+    when = _MONTH_PATTERN.search(canonical)
+    label = f"{days} days"
+    return f"{label} in {when.group(1)}" if when else label
+
+def normalize_budget(text):
+    """
+    Reduce a budget answer to a budget range.
+
+    Args:
+        text (str): Raw budget answer, e.g. "around $3,000 excluding flights"
+
+    Returns:
+        str: Canonical range such as "$2,000-$3,500", or the canonical text if
+            no amount could be found
+    """
+    canonical = canonicalize_text(text)
+    for match in _BUDGET_PATTERN.finditer(canonical):
+        prefix, amount, thousands, suffix = match.groups()
+        try:
+            value = float(amount.replace(",", ""))
+        except ValueError:
+            continue
+        if thousands:
+            value *= 1000
+        if value < 50:
+            # Bare small numbers are usually counts ("2 people"), not money
+            continue
+
+        symbol = _CURRENCY_SYMBOLS.get(prefix or suffix or "$", "$")
+        lower = 0
+        for upper in BUDGET_BUCKETS:
+            if value < upper:
+                return f"{symbol}{lower:,}-{symbol}{upper:,}"
+            lower = upper
+        return f"{symbol}{lower:,}+"
+    return canonical
+
+def normalize_interests(text):
+    """
+    Canonicalize a list of interests so word order does not matter.
+
+    Args:
+        text (str): Raw interests answer
+
+    Returns:
+        str: Sorted, comma-separated interests
+    """
+    canonical = canonicalize_text(text)
+    items = re.split(r",|;|/|\band\b|&|\+", canonical)
+    items = sorted({" ".join(item.split()) for item in items if item.strip()})
+    return ", ".join(items)
+
+def normalize_user_responses(user_responses):
+    """
+    Canonicalize the answers collected by the dialogue for matching requests.
+
+    Near-identical requests ("Paris", "paris, France ", "I'd like to visit
+    Paris") come out identical, so they share response cache entries. Empty
+    optional answers are dropped. The result only keys the cache; the model
+    is always prompted with the user's own answers.
+
+    Args:
+        user_responses (dict): Dictionary containing user responses
+
+    Returns:
+        dict: Canonical user responses
+    """
+    normalized = {}
+    for name, value in user_responses.items():
+        if name == "travel_destination":
+            value = canonicalize_destination(value)
+        elif name == "travel_dates":
+            value = normalize_travel_dates(value)
+        elif name == "budget":
+            value = normalize_budget(value)
+        elif name == "interests":
+            value = normalize_interests(value)
+        else:
+            value = canonicalize_text(value)
+        if value:
+            normalized[name] = value
+    return normalized
+
+def shingle_sketch(text, size=64):
+    """
+    Compute a bottom-k MinHash sketch of a text's word unigrams and bigrams.
+
+    Args:
+        text (str): Canonical text to sketch
+        size (int): Number of minimum hashes kept
+
+    Returns:
+        frozenset: The smallest shingle hashes
+    """
+    words = re.findall(r"\w+", text)
+    shingles = set(words)
+    shingles.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    hashes = sorted(zlib.crc32(shingle.encode("utf-8")) for shingle in shingles)
+    return frozenset(hashes[:size])
+
+def estimate_similarity(sketch_a, sketch_b, size=64):
+    """
+    Estimate the Jaccard similarity of two texts from their sketches.
+
+    Args:
+        sketch_a (frozenset): Sketch from shingle_sketch
+        sketch_b (frozenset): Sketch from shingle_sketch
+        size (int): Sketch size used to build both sketches
+
+    Returns:
+        float: Estimated similarity between 0 and 1
+    """
+    if not sketch_a or not sketch_b:
+        return 1.0 if sketch_a == sketch_b else 0.0
+    union_sample = sorted(sketch_a | sketch_b)[:size]
+    shared = sum(1 for value in union_sample if value in sketch_a and value in sketch_b)
+    return shared / len(union_sample)
+
+def request_fingerprint(normalized_responses):
+    """
+    Build the similarity fingerprint of a normalized trip request.
+
+    Requests are only compared within the same group (destination, duration
+    bucket and budget bucket); the sketch covers the remaining free text.
+
+    Args:
+        normalized_responses (dict): Output of normalize_user_responses
+
+    Returns:
+        tuple: (group, sketch) pair
+    """
+    fields = dict(normalized_responses)
+    days = extract_trip_days(fields.get("travel_dates", ""))
+    if days is not None:
+        when = _MONTH_PATTERN.search(fields["travel_dates"])
+        fields["travel_dates"] = f"{bucket_duration(days)} in {when.group(1)}" if when else bucket_duration(days)
+    group = "|".join(fields.get(name, "") for name in _GROUP_FIELDS)
+    text = " ".join(
+        value for name, value in sorted(normalized_responses.items())
+        if name not in _GROUP_FIELDS
+    )
+    return group, shingle_sketch(text)
+
+class SimilarityIndex:
+    """
+    In-memory index of request fingerprints used to find close cached plans.
+    """
+
+    def __init__(self, threshold=0.9, max_per_group=32):
+        """
+        Args:
+            threshold (float): Minimum estimated similarity to count as a match
+            max_per_group (int): Fingerprints kept per group, newest first
+        """
+        self.threshold = threshold
+        self.max_per_group = max_per_group
+        self._groups = {}
+
+    def add(self, scope, fingerprint, key):
+        """
+        Remember which cache key answered a fingerprint.
+
+        Args:
+            scope (str): Backend/model scope the key belongs to
+            fingerprint (tuple): Output of request_fingerprint
+            key (str): Cache key holding the response
+        """
+        group, sketch = fingerprint
+        entries = self._groups.setdefault((scope, group), [])
+        entries[:] = [entry for entry in entries if entry[1] != key]
+        entries.insert(0, (sketch, key))
+        del entries[self.max_per_group:]
+
+    def find(self, scope, fingerprint):
+        """
+        Find the cache key of the closest previous request.
+
+        A baseline request of the group, one that gave no free-text answers
+        (e.g. a warmed plan), only matches requests that gave none either.
+
+        Args:
+            scope (str): Backend/model scope to search
+            fingerprint (tuple): Output of request_fingerprint
+
+        Returns:
+            str: Best matching cache key, or None if nothing is close enough
+        """
+        group, sketch = fingerprint
+        best_key, best_score = None, self.threshold
+        for candidate, key in self._groups.get((scope, group), ()):
+            score = estimate_similarity(sketch, candidate)
+            if score >= best_score:
+                best_key, best_score = key, score
+        return best_key
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import zlib
+import atexit
+import sqlite3
+import threading
+from collections import OrderedDict, deque
+
+def encode_state(state):
+    """
+    Serialize session state compactly.
+
+    Args:
+        state (dict): JSON-serializable session state
+
+    Returns:
+        bytes: Compressed JSON
+    """
+    return zlib.compress(json.dumps(state, separators=(",", ":"), ensure_ascii=False).encode("utf-8"))
+
+def decode_state(blob):
+    """
+    Reverse encode_state.
+
+    Args:
+        blob (bytes): Output of encode_state
+
+    Returns:
+        dict: The session state
+    """
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+class SessionStore:
+    """
+    Store for frontend sessions and feedback, shared by every process that points at it.
+
+    Without a path, sessions live in a bounded in-process LRU, as before but
+    with a cap on memory. With a path, they live in a SQLite file that every
+    replica on the machine (or on a shared volume) reads from, so any
+    replica can resume any session and a restart loses nothing. Writes are
+    queued and committed in batches by a background thread; reads see
+    queued writes immediately.
+    """
+
+    def __init__(self, path=None, memory_size=1000, ttl=604800, flush_interval=0.5):
+        """
+        Args:
+            path (str): SQLite file shared between processes, or None to keep sessions in memory
+            memory_size (int): Sessions kept when there is no path
+            ttl (float): Seconds of inactivity before a session expires
+            flush_interval (float): Seconds between batched writes to the SQLite file
+        """
+        self.path = path
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._memory = OrderedDict()
+        self._feedback = deque(maxlen=memory_size)
+        self._pending = {}
+        self._pending_feedback = []
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._connection = None
+        self._flusher = None
+        self.writes = 0
+        self.flushes = 0
+
+    @classmethod
+    def from_env(cls):
+        """
+        Build a store configured from SESSION_* environment variables.
+
+        Returns:
+            SessionStore: The configured store
+        """
+        return cls(
+            path=os.getenv("SESSION_STORE_PATH") or None,
+            memory_size=int(os.getenv("SESSION_MEMORY_SIZE", "1000")),
+            ttl=float(os.getenv("SESSION_TTL", "604800")),
+            flush_interval=float(os.getenv("SESSION_FLUSH_INTERVAL", "0.5"))
+        )
+
+    def _db(self):
+        # Open the SQLite file on first use; caller holds the database lock
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "id TEXT PRIMARY KEY, state BLOB NOT NULL, updated REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS feedback ("
+                "session_id TEXT NOT NULL, entry TEXT NOT NULL, created REAL NOT NULL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def load(self, session_id):
+        """
+        Look up a session.
+
+        Args:
+            session_id (str): Session identifier
+
+        Returns:
+            dict: The saved state, or None if the session is unknown or expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._pending.get(session_id) or self._memory.get(session_id)
+            if entry is not None and session_id in self._memory:
+                self._memory.move_to_end(session_id)
+        if entry is None and self.path:
+            try:
+                with self._db_lock:
+                    row = self._db().execute(
+                        "SELECT state, updated FROM sessions WHERE id = ?", (session_id,)
+                    ).fetchone()
+                entry = tuple(row) if row else None
+            except sqlite3.Error as e:
+                print(f"Error reading session store: {str(e)}")
+        if entry is None or now - entry[1] > self.ttl:
+            return None
+        return decode_state(entry[0])
+
+    def save(self, session_id, state):
+        """
+        Save a session, replacing its previous state.
+
+        Args:
+            session_id (str): Session identifier
+            state (dict): JSON-serializable session state
+        """
+        self.save_encoded(session_id, encode_state(state))
+
+    def save_encoded(self, session_id, blob):
+        """
+        Save a session that has already been through encode_state.
+
+        Args:
+            session_id (str): Session identifier
+            blob (bytes): Output of encode_state
+        """
+        entry = (blob, time.time())
+        with self._lock:
+            self.writes += 1
+            if not self.path:
+                self._memory[session_id] = entry
+                self._memory.move_to_end(session_id)
+                while len(self._memory) > self.memory_size:
+                    self._memory.popitem(last=False)
+                return
+            # Only the latest state of a session is written when the batch is flushed
+            self._pending[session_id] = entry
+        self._start_flusher()
+
+    def add_feedback(self, session_id, entry):
+        """
+        Record feedback; earlier entries are kept.
+
+        Args:
+            session_id (str): Session the feedback came from
+            entry (dict): JSON-serializable feedback, e.g. rating and comment
+        """
+        with self._lock:
+            if not self.path:
+                self._feedback.append((session_id, entry))
+                return
+            self._pending_feedback.append((session_id, json.dumps(entry, ensure_ascii=False), time.time()))
+        self._start_flusher()
+
+    def feedback(self, session_id=None, limit=100):
+        """
+        Read recorded feedback, newest first.
+
+        Args:
+            session_id (str): Only return feedback from this session
+            limit (int): Maximum number of entries
+
+        Returns:
+            list: Feedback entries
+        """
+        if not self.path:
+            with self._lock:
+                entries = [entry for sid, entry in reversed(self._feedback) if session_id in (None, sid)]
+            return entries[:limit]
+        self.flush()
+        query = "SELECT entry FROM feedback"
+        params = ()
+        if session_id is not None:
+            query += " WHERE session_id = ?"
+            params = (session_id,)
+        with self._db_lock:
+            rows = self._db().execute(query + " ORDER BY created DESC LIMIT ?", params + (limit,)).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def _start_flusher(self):
+        # The first queued write starts the background flusher
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_periodically, name="session-flusher", daemon=True)
+            self._flusher.start()
+        # Don't lose the last batch on a clean shutdown
+        atexit.register(self.flush)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        """
+        Write queued sessions and feedback to the SQLite file in one transaction.
+        """
+        if not self.path:
+            return
+        with self._db_lock:
+            with self._lock:
+                sessions, self._pending = self._pending, {}
+                feedback, self._pending_feedback = self._pending_feedback, []
+            if not sessions and not feedback:
+                return
+            try:
+                db = self._db()
+                db.executemany(
+                    "INSERT OR REPLACE INTO sessions (id, state, updated) VALUES (?, ?, ?)",
+                    [(session_id, blob, updated) for session_id, (blob, updated) in sessions.items()]
+                )
+                db.executemany("INSERT INTO feedback (session_id, entry, created) VALUES (?, ?, ?)", feedback)
+                db.execute("DELETE FROM sessions WHERE updated < ?", (time.time() - self.ttl,))
+                db.commit()
+                self.flushes += 1
+            except sqlite3.Error as e:
+                print(f"Error writing session store: {str(e)}")
+                # Keep the batch for the next attempt unless newer states replaced it
+                with self._lock:
+                    self._pending = {**sessions, **self._pending}
+                    self._pending_feedback = feedback + self._pending_feedback
+
+    def stats(self):
+        """
+        Report the store's size and write batching.
+
+        Returns:
+            dict: Sessions held in memory, queued writes, writes and flushes
+        """
+        with self._lock:
+            return {
+                "memory_sessions": len(self._memory),
+                "pending_sessions": len(self._pending),
+                "pending_feedback": len(self._pending_feedback),
+                "writes": self.writes,
+                "flushes": self.flushes
+            }
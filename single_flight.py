@@ -0,0 +1,415 @@
+import asyncio
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Abort scope of the upstream requests made from the current thread or task
+_current_abort_scope = contextvars.ContextVar("llm_abort_scope", default=None)
+
+class AbortScope:
+    """
+    Lets another thread drop the upstream requests made under it.
+
+    A request registers a callback that closes it (e.g. its HTTP response)
+    with abortable; abort runs every registered callback, so a read blocked
+    on a stalled backend fails straight away instead of waiting for the
+    next chunk or the read timeout.
+    """
+
+    def __init__(self):
+        self.aborted = False
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def add(self, callback):
+        """
+        Register a callback that drops a request; it runs at once if the scope was already aborted.
+
+        Args:
+            callback (callable): Called without arguments
+        """
+        with self._lock:
+            if not self.aborted:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove(self, callback):
+        """
+        Unregister a callback once its request has finished.
+
+        Args:
+            callback (callable): A callback passed to add
+        """
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def abort(self):
+        """
+        Drop every request made under the scope, and any made under it later.
+        """
+        with self._lock:
+            self.aborted = True
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error dropping upstream request: {str(e)}")
+
+@contextmanager
+def abort_scope(scope):
+    """
+    Run a block of code with its upstream requests under an abort scope.
+
+    Args:
+        scope (AbortScope): The scope to make requests under
+    """
+    token = _current_abort_scope.set(scope)
+    try:
+        yield
+    finally:
+        _current_abort_scope.reset(token)
+
+@contextmanager
+def abortable(callback):
+    """
+    Let the current abort scope drop a request while the block runs.
+
+    Args:
+        callback (callable): Drops the request, e.g. by closing its response
+    """
+    scope = _current_abort_scope.get()
+    if scope is not None:
+        scope.add(callback)
+    try:
+        yield
+    finally:
+        if scope is not None:
+            scope.remove(callback)
+
+def aborted():
+    """
+    Check whether the upstream requests of the current thread or task were dropped.
+
+    Returns:
+        bool: True once the current abort scope has been aborted
+    """
+    scope = _current_abort_scope.get()
+    return scope is not None and scope.aborted
+
+class _Flight:
+    # One upstream call and everything it has produced so far
+    def __init__(self):
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.condition = threading.Condition()
+        # (loop, future) pairs for coroutines waiting on the flight
+        self.waiters = []
+        self.task = None
+        # Callers still reading a stream; once all of them stop, the stream is abandoned
+        self.readers = 0
+        self.abandoned = False
+        # Drops the upstream request as soon as the stream is abandoned
+        self.scope = AbortScope()
+
+def _wake(waiter):
+    # A waiter whose coroutine was cancelled has nothing left to wake
+    if not waiter.done():
+        waiter.set_result(None)
+
+class SingleFlight:
+    """
+    Share one upstream call between concurrent callers asking for the same thing.
+
+    The first caller for a key makes the call; callers that arrive while it
+    is still running attach to it and get the same result (or replay the
+    same stream from its first chunk) instead of sending a duplicate request.
+    Once the call finishes the key is released, so later callers go through
+    the response cache as usual.
+    """
+
+    def __init__(self, enabled=True):
+        """
+        Args:
+            enabled (bool): Set to False to give every caller its own upstream call
+        """
+        self.enabled = enabled
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def _join(self, key, reading=False):
+        # Returns the flight for the key and whether this caller has to start it
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None or flight.abandoned
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+            flight.readers += reading
+            return flight, leader
+
+    def _finish(self, key, flight, error=None):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.condition:
+            flight.error = error
+            flight.done = True
+            flight.condition.notify_all()
+            waiters, flight.waiters = flight.waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def do(self, key, function, *args):
+        """
+        Call a function, or wait for the identical call already in flight.
+
+        Args:
+            key (str): Request key, e.g. the response cache key
+            function (callable): Makes the upstream call
+            *args: Passed on to function
+
+        Returns:
+            The function's result, shared by every caller of the flight
+        """
+        if not self.enabled:
+            return function(*args)
+        flight, leader = self._join(key)
+        if leader:
+            try:
+                flight.result = function(*args)
+            except BaseException as e:
+                self._finish(key, flight, e)
+                raise
+            self._finish(key, flight)
+            return flight.result
+        with flight.condition:
+            flight.condition.wait_for(lambda: flight.done)
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    async def ado(self, key, function, *args):
+        """
+        Await a coroutine function, or the identical call already in flight.
+
+        Shares flights with do, so coroutines and threads asking for the same
+        key attach to the same upstream call. The call runs as its own task,
+        so a caller that is cancelled (e.g. a client that disconnects) doesn't
+        cancel it for the others.
+
+        Args:
+            key (str): Request key, e.g. the response cache key
+            function (callable): Coroutine function that makes the upstream call
+            *args: Passed on to function
+
+        Returns:
+            The function's result, shared by every caller of the flight
+        """
+        if not self.enabled:
+            return await function(*args)
+        flight, leader = self._join(key)
+        if leader:
+            flight.task = asyncio.ensure_future(function(*args))
+            flight.task.add_done_callback(lambda task: self._settle(key, flight, task))
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        with flight.condition:
+            if flight.done:
+                waiter.set_result(None)
+            else:
+                flight.waiters.append((loop, waiter))
+        await waiter
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _settle(self, key, flight, task):
+        if task.cancelled():
+            self._finish(key, flight, asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._finish(key, flight, task.exception())
+        else:
+            flight.result = task.result()
+            self._finish(key, flight)
+
+    def stream(self, key, function, *args):
+        """
+        Stream a generator function's output, or replay the identical stream already in flight.
+
+        The upstream generator runs on its own thread, so a caller that stops
+        reading early doesn't cut the stream short for the others. Once every
+        caller has stopped reading, the upstream request is dropped and the
+        next caller for the key starts a new one.
+
+        Args:
+            key (str): Request key, e.g. the response cache key
+            function (callable): Generator function that streams the upstream response
+            *args: Passed on to function
+
+        Yields:
+            Every chunk of the shared stream, from the first
+        """
+        if not self.enabled:
+            yield from function(*args)
+            return
+        flight, leader = self._join(key, reading=True)
+        if leader:
+            # The pump runs in a copy of the caller's context so its request priority carries over
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(self._pump, key, flight, function, args),
+                name="single-flight", daemon=True
+            ).start()
+
+        reader = {"left": False}
+
+        def leave():
+            self._leave(flight, reader)
+
+        position = 0
+        # A caller that is dropped (e.g. a hedge that lost) stops reading straight away
+        with abortable(leave):
+            try:
+                while True:
+                    with flight.condition:
+                        flight.condition.wait_for(
+                            lambda: len(flight.chunks) > position or flight.done or reader["left"]
+                        )
+                        chunks = flight.chunks[position:]
+                        done = flight.done
+                    if reader["left"]:
+                        return
+                    if not chunks and done:
+                        break
+                    position += len(chunks)
+                    yield from chunks
+            finally:
+                leave()
+        if flight.error is not None:
+            raise flight.error
+
+    def _leave(self, flight, reader):
+        # A reader stops reading; once none are left the upstream request is dropped
+        with self._lock:
+            if reader["left"]:
+                return
+            reader["left"] = True
+            flight.readers -= 1
+            abandon = flight.readers == 0 and not flight.done
+            if abandon:
+                flight.abandoned = True
+        if abandon:
+            flight.scope.abort()
+            if flight.task is not None and not flight.task.get_loop().is_closed():
+                # A coroutine upstream is cancelled rather than left waiting for its next chunk
+                flight.task.get_loop().call_soon_threadsafe(flight.task.cancel)
+        with flight.condition:
+            flight.condition.notify_all()
+
+    def _publish(self, flight, chunk):
+        # Hand a new chunk to the threads and coroutines reading the stream
+        with flight.condition:
+            flight.chunks.append(chunk)
+            flight.condition.notify_all()
+            waiters, flight.waiters = flight.waiters, []
+        for loop, waiter in waiters:
+            loop.call_soon_threadsafe(_wake, waiter)
+
+    def _pump(self, key, flight, function, args):
+        chunks = function(*args)
+        try:
+            with abort_scope(flight.scope):
+                for chunk in chunks:
+                    self._publish(flight, chunk)
+                    if flight.abandoned:
+                        # Nobody is reading any more; closing the generator drops the upstream request
+                        chunks.close()
+                        break
+        except BaseException as e:
+            self._finish(key, flight, e)
+            return
+        self._finish(key, flight)
+
+    async def astream(self, key, function, *args):
+        """
+        Async generator counterpart of stream.
+
+        Shares flights with stream, so coroutines and threads asking for the
+        same key replay the same upstream stream. The upstream runs as its
+        own task; once every reader has stopped reading, the task is
+        cancelled and the next caller for the key starts a new one.
+
+        Args:
+            key (str): Request key, e.g. the response cache key
+            function (callable): Async generator function that streams the upstream response
+            *args: Passed on to function
+
+        Yields:
+            Every chunk of the shared stream, from the first
+        """
+        if not self.enabled:
+            async for chunk in function(*args):
+                yield chunk
+            return
+        flight, leader = self._join(key, reading=True)
+        if leader:
+            flight.task = asyncio.ensure_future(self._apump(key, flight, function, args))
+
+        reader = {"left": False}
+        loop = asyncio.get_running_loop()
+        position = 0
+        try:
+            while True:
+                waiter = None
+                with flight.condition:
+                    chunks = flight.chunks[position:]
+                    done = flight.done
+                    if not chunks and not done:
+                        waiter = loop.create_future()
+                        flight.waiters.append((loop, waiter))
+                if waiter is not None:
+                    await waiter
+                    continue
+                if not chunks and done:
+                    break
+                position += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+        finally:
+            self._leave(flight, reader)
+        if flight.error is not None:
+            raise flight.error
+
+    async def _apump(self, key, flight, function, args):
+        chunks = function(*args)
+        try:
+            async for chunk in chunks:
+                self._publish(flight, chunk)
+        except BaseException as e:
+            self._finish(key, flight, e)
+            return
+        self._finish(key, flight)
+
+    def stats(self):
+        """
+        Report how many upstream calls were shared.
+
+        Returns:
+            dict: Upstream calls started, callers that attached to one, calls in flight
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights)
+            }
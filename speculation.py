@@ -0,0 +1,222 @@
+import os
+import threading
+import contextvars
+from llm_setup import fanout_executor
+from dialogue_system import create_dialogue_stages, stream_travel_plan, stream_refined_travel_plan
+from plan_sections import split_plan_sections, route_refinement
+from request_normalizer import normalize_user_responses
+from rate_limiter import request_priority, BACKGROUND
+
+# Models a plan is speculatively generated with while the optional questions are answered
+SPECULATIVE_MODELS = [model.strip() for model in os.getenv("SPECULATIVE_MODELS", "openai").split(",") if model.strip()]
+
+# Labels used when the optional answers are folded into the speculative plan
+OPTIONAL_LABELS = {
+    "accommodation_preference": "Accommodation preference",
+    "dietary_restrictions": "Dietary restrictions",
+    "additional_info": "Additional information"
+}
+
+def split_responses(user_responses):
+    """
+    Separate the answers to required stages from the optional ones.
+
+    Args:
+        user_responses (dict): Dictionary containing user responses
+
+    Returns:
+        tuple: (required, optional) dictionaries, leaving out blank answers
+    """
+    required, optional = {}, {}
+    for stage in create_dialogue_stages():
+        answer = str(user_responses.get(stage["name"], "")).strip()
+        if stage["name"] == "introduction" or not answer:
+            continue
+        (required if stage["required"] else optional)[stage["name"]] = answer
+    return required, optional
+
+def required_stages_complete(user_responses):
+    """
+    Check whether every required stage has been answered.
+
+    Args:
+        user_responses (dict): Dictionary containing user responses
+
+    Returns:
+        bool: True once a plan can be generated from the answers so far
+    """
+    required, _ = split_responses(user_responses)
+    return all(stage["name"] in required for stage in create_dialogue_stages() if stage["required"])
+
+def material_optional_answers(user_responses):
+    """
+    Collect the optional answers that would change the plan.
+
+    Args:
+        user_responses (dict): Dictionary containing user responses
+
+    Returns:
+        dict: Optional answers other than "none", "no preference" and the like
+    """
+    _, optional = split_responses(user_responses)
+    # Normalization drops the answers that say nothing
+    return {name: optional[name] for name in normalize_user_responses(optional)}
+
+def construct_reconciliation_request(optional_answers):
+    """
+    Phrase the optional answers as a refinement of the speculative plan.
+
+    Args:
+        optional_answers (dict): Output of material_optional_answers
+
+    Returns:
+        str: Refinement request
+    """
+    details = " ".join(
+        f"{OPTIONAL_LABELS.get(name, name)}: {answer.rstrip('.')}." for name, answer in optional_answers.items()
+    )
+    return f"Adjust the plan for these preferences. {details}"
+
+class SpeculativePlan:
+    """
+    Plans generated from the required answers while the optional ones are collected.
+
+    Generation runs on the shared pool at background priority. When the user
+    asks for a plan that is ready, it is used as is if the optional answers
+    add nothing, patched through section-level refinement if they only touch
+    a few sections, and replaced by a fresh generation otherwise. A plan that
+    is still being written is not waited on at background priority: the
+    request takes the normal interactive path, which attaches to the
+    speculative upstream calls through single-flight when it asks for the
+    same plan.
+    """
+
+    def __init__(self, user_responses, models=None):
+        """
+        Args:
+            user_responses (dict): Answers so far; every required stage must be answered
+            models (list): Models to speculate with; defaults to SPECULATIVE_MODELS
+        """
+        self.required, _ = split_responses(user_responses)
+        self.key = normalize_user_responses(self.required)
+        # Set to stop generations that are already running
+        self.cancelled = threading.Event()
+        # Each call runs in a copy of the caller's context, then drops to background priority
+        self.futures = {
+            model: fanout_executor.submit(contextvars.copy_context().run, self._generate, model)
+            for model in (models or SPECULATIVE_MODELS)
+        }
+
+    def _generate(self, model):
+        # Streamed, so an interactive request for the same plan can join it mid-flight
+        with request_priority(BACKGROUND):
+            chunks = stream_travel_plan(self.required, model, hedge=False, cancel=self.cancelled)
+            pieces = []
+            try:
+                for chunk in chunks:
+                    if self.cancelled.is_set():
+                        return "Error: Speculative plan cancelled"
+                    pieces.append(chunk)
+            finally:
+                # Closing the stream drops its upstream call unless another request shares it
+                chunks.close()
+            return "".join(pieces)
+
+    def matches(self, user_responses):
+        """
+        Check whether the required answers are still the ones speculated on.
+
+        Args:
+            user_responses (dict): Current user responses
+
+        Returns:
+            bool: True if the speculative plans still apply
+        """
+        required, _ = split_responses(user_responses)
+        return normalize_user_responses(required) == self.key
+
+    def cancel(self):
+        """
+        Drop speculative generations, stopping the ones already running.
+        """
+        self.cancelled.set()
+        for future in self.futures.values():
+            future.cancel()
+
+    def stream(self, user_responses, model, hedge=None):
+        """
+        Stream the plan for the final answers, starting from the speculative one.
+
+        Args:
+            user_responses (dict): The final user responses
+            model (str): Model the user chose
+            hedge (bool): Passed on to stream_travel_plan when a fresh plan is needed
+
+        Yields:
+            str: Pieces of the travel plan
+        """
+        future = self.futures.get(model)
+        optional_answers = material_optional_answers(user_responses)
+        if future is not None and not future.done() and optional_answers:
+            # A plan still being written that the answers change would only be patched or
+            # replaced once it finished, so stop paying for it and start the real one now
+            self.cancel()
+        if future is None or not self.matches(user_responses) or future.cancel() or not future.done():
+            # Nothing usable was speculated, it never started, or it is still running; in the last
+            # case the fresh request shares its in-flight calls when the optional answers add nothing
+            yield from stream_travel_plan(user_responses, model, hedge)
+            return
+
+        plan = future.result()
+        if plan.startswith("Error"):
+            yield from stream_travel_plan(user_responses, model, hedge)
+            return
+
+        if not optional_answers:
+            yield plan
+            return
+
+        request = construct_reconciliation_request(optional_answers)
+        if route_refinement(split_plan_sections(plan), request) is None:
+            # The answers reshape the whole plan; a fresh generation is as cheap as a rewrite
+            yield from stream_travel_plan(user_responses, model, hedge)
+            return
+        yield from stream_refined_travel_plan(plan, request, model)
+
+def update_speculation(speculation, user_responses, models=None):
+    """
+    Start, keep or restart speculative generation after an answer changes.
+
+    Args:
+        speculation (SpeculativePlan): The current speculation, or None
+        user_responses (dict): Answers so far
+        models (list): Models to speculate with; defaults to SPECULATIVE_MODELS
+
+    Returns:
+        SpeculativePlan: The speculation to keep, or None until the required stages are answered
+    """
+    if speculation is not None and speculation.matches(user_responses):
+        return speculation
+    if speculation is not None:
+        speculation.cancel()
+    if not required_stages_complete(user_responses):
+        return None
+    return SpeculativePlan(user_responses, models)
+
+def stream_plan(speculation, user_responses, model, hedge=None):
+    """
+    Stream a travel plan, using a speculative one when it applies.
+
+    Args:
+        speculation (SpeculativePlan): The current speculation, or None
+        user_responses (dict): The final user responses
+        model (str): Model to use ("openai" or "llama")
+        hedge (bool): Passed on to stream_travel_plan; comparisons pass False
+            so each model answers for itself
+
+    Returns:
+        generator: Pieces of the travel plan
+    """
+    if speculation is None:
+        return stream_travel_plan(user_responses, model, hedge)
+    return speculation.stream(user_responses, model, hedge)
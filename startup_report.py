@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import subprocess
+
+# Modules each entry point imports before it can serve a request
+STARTUP_MODULES = {
+    "cli": "dialogue_system",
+    "batch": "batch_runner",
+    "web": "streamlit, speculation, cache_warmer",
+    "api": "api_server"
+}
+
+# Cold imports measured per module; the fastest run is reported to damp noise
+STARTUP_RUNS = int(os.getenv("STARTUP_REPORT_RUNS", "3"))
+
+def parse_importtime(output):
+    """
+    Parse the stderr of `python -X importtime`.
+
+    Args:
+        output (str): Captured stderr
+
+    Returns:
+        list: (module, self_ms, cumulative_ms, depth) tuples in import order
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        imports.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000, depth))
+    return imports
+
+def measure_import_time(statement, runs=None):
+    """
+    Time a cold import in fresh interpreters.
+
+    Args:
+        statement (str): Modules to import, e.g. "dialogue_system" or "streamlit, speculation"
+        runs (int): Interpreters to start; defaults to STARTUP_RUNS
+
+    Returns:
+        dict: Total milliseconds and the per-module breakdown of the fastest run
+    """
+    project_dir = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    for _ in range(runs or STARTUP_RUNS):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {statement}"],
+            cwd=project_dir, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1]}
+        imports = parse_importtime(result.stderr)
+        # Top-level entries add up to the whole import; nested ones are already counted in them
+        total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        if best is None or total < best["total_ms"]:
+            best = {"total_ms": round(total, 1), "imports": imports}
+    return best
+
+def run_startup_report(modes=None, top=10, runs=None):
+    """
+    Measure cold-start import time for each entry point.
+
+    Args:
+        modes (list): Entry points to measure; defaults to all of STARTUP_MODULES
+        top (int): Slowest imports to list per entry point; only the measured modules
+            and their direct imports are listed, by time including their own imports
+        runs (int): Interpreters to start per entry point; defaults to STARTUP_RUNS
+
+    Returns:
+        dict: Results keyed by entry point
+    """
+    report = {}
+    for mode in modes or STARTUP_MODULES:
+        measured = measure_import_time(STARTUP_MODULES[mode], runs)
+        if "error" in measured:
+            report[mode] = measured
+            continue
+        shallow = [entry for entry in measured["imports"] if entry[3] <= 1]
+        slowest = sorted(shallow, key=lambda entry: entry[2], reverse=True)[:top]
+        report[mode] = {
+            "modules": STARTUP_MODULES[mode],
+            "total_ms": measured["total_ms"],
+            "slowest": [{"module": name, "self_ms": round(self_ms, 1), "cumulative_ms": round(cumulative, 1)}
+                        for name, self_ms, cumulative, _ in slowest]
+        }
+    return report
+
+def print_startup_report(report, budget_ms=None):
+    """
+    Print the startup report and check it against a time budget.
+
+    Args:
+        report (dict): Output of run_startup_report
+        budget_ms (float): Optional import-time budget per entry point
+
+    Returns:
+        bool: True if every entry point imported within the budget
+    """
+    within_budget = True
+    print("\n===== STARTUP REPORT =====")
+    for mode, result in report.items():
+        if "error" in result:
+            print(f"\n{mode}: failed to import ({result['error']})")
+            within_budget = False
+            continue
+        over = budget_ms is not None and result["total_ms"] > budget_ms
+        within_budget = within_budget and not over
+        status = f" (over the {budget_ms:g} ms budget)" if over else ""
+        print(f"\n{mode}: {result['total_ms']:.1f} ms to import {result['modules']}{status}")
+        for entry in result["slowest"]:
+            print(f"  {entry['cumulative_ms']:8.1f} ms  {entry['module']} ({entry['self_ms']:.1f} ms on its own)")
+    return within_budget
+
+def write_startup_report(report, output_path):
+    """
+    Save the startup report as JSON so runs can be compared.
+
+    Args:
+        report (dict): Output of run_startup_report
+        output_path (str): File to write
+    """
+    with open(output_path, "w", encoding="utf-8") as output:
+        json.dump(report, output, indent=2)
+    print(f"\nStartup report written to {output_path}")